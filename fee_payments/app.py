@@ -1,68 +1,160 @@
 from xml.parsers.expat import errors
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file, make_response, session, Response
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, url_for, flash, jsonify, send_file, make_response, session, Response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user, UserMixin
 from functools import wraps
+from contextlib import ExitStack
 import os
-import pandas as pd
-import numpy as np
 from io import BytesIO
 import base64
-from datetime import datetime, timedelta
+from datetime import datetime
 import threading
+import logging
+import time
+import hmac
 import re
 
-# Import database models
-from models import db, init_db, Student, FeeMaster, Payment, Admin
+# pandas, numpy and matplotlib are imported inside the upload, report and chart
+# functions that need them, so importing this module and booting a worker stays fast
 
-# Initialize Flask app
-app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Secret key for flash messages
+# Import database models
+from models import db, init_db, bootstrap_db, Student, FeeMaster, Payment, Admin, Batch, Branch
+from fee_types import fee_type_registry, fee_types_cli
+from dimensions import dimension_id, id_of, join_student_names
+from filter_options import filter_options
+from student_search import student_search
+from student_index import student_index
+from selections import create_selection, selection_exists, join_selection
+from archive import archive_fully_paid, restore_archive, recent_archives
+from cold_storage import archive_cli, archived_batch, historical_session
+from query_stats import install_query_stats, query_report
+from slow_log import install_slow_log, recent_slow_requests
+from metrics import install_metrics, render as render_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from profiler import install_profiler, recent_profiles, profile_file
+from memory_profile import install_memory_profile, recent_memory_profiles, note_rows
+from structured_log import install_logging, subsystem_logger
+from metrics import UPLOAD_ROWS, UPLOAD_ROW_ERRORS, UPLOADS, UPLOAD_SECONDS, CHART_RENDER
+from money import to_paise, from_paise, split_paise
+from config import Config, load_secret_key
 
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///fee_payments.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)  # For "remember me" functionality
+# All routes live on this blueprint; create_app() registers it
+bp = Blueprint('main', __name__)
 
-# Initialize database
-init_db(app)
+# Per-row upload messages; their level can be set on its own (FEE_LOG_LEVELS)
+upload_log = subsystem_logger('upload')
+# Sample key of the per-row messages, so a large sheet doesn't flood the log
+UPLOAD_ROW = {'sample_key': 'upload.row'}
+# Sheet rows per chunk of an upload: its students and fee entries are looked up
+# in one query each, and its writes are flushed together
+UPLOAD_CHUNK_ROWS = 25
 
 # Initialize login manager
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'admin_login'
+login_manager.login_view = 'main.admin_login'
 login_manager.login_message = 'Please log in as admin to access this page.'
 login_manager.login_message_category = 'info'
 
+def create_app(config_object=Config):
+    """Application factory"""
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    install_logging(app)
+    # Shared by all worker processes so sessions signed by one worker are valid in the others
+    app.secret_key = load_secret_key(app.instance_path)
+
+    # Initialize database
+    init_db(app, bootstrap=app.config['BOOTSTRAP_DB_ON_IMPORT'])
+    if app.config['QUERY_STATS']:
+        with app.app_context():
+            install_query_stats(app, db.engine)
+        if app.config['SLOW_REQUEST_MS']:
+            install_slow_log(app)
+    if app.config['METRICS']:
+        with app.app_context():
+            install_metrics(app, db.engine)
+    install_profiler(app)
+    install_memory_profile(app)
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    app.cli.add_command(fee_types_cli)
+    app.cli.add_command(archive_cli)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create tables, apply migrations and add the default admin"""
+        bootstrap_db(app)
+        print("Database initialized.")
+
+    if app.config['WARMUP_ON_START']:
+        warm_up(app)
+    return app
+
+def warm_up(app):
+    """Import the heavy libraries and open a database connection ahead of the first request.
+
+    Opt-in (FEE_WARMUP=1): startup gets slower but the first upload or chart
+    request doesn't pay for the imports, and the registration number index
+    (student_index.py) is built. With gunicorn's preload_app the work is done
+    once in the master and shared by the forked workers.
+    """
+    import pandas
+    import numpy
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import seaborn
+    with app.app_context():
+        # Opens a pooled connection, which also runs the SQLite PRAGMA profile
+        with db.engine.connect():
+            pass
+        student_index.build()
+
 @login_manager.user_loader
 def load_user(user_id):
     return Admin.query.get(int(user_id))
 
-# Utility function to normalize fee types
-def normalize_fee_type(fee_type):
-    # First standardize the input
-    if not fee_type:
-        return ""
-    fee_type = fee_type.lower().strip()
-    
-    # Map to standard names - FIXED order to check Phase 3 first before Phase 2
-    if 'crt' in fee_type:
-        return 'crt fee'
-    elif any(x in fee_type for x in ['phase 3', 'phase-3', 'phase-iii', 'phase iii']):
-        return 'smart interviews phase-iii'
-    elif any(x in fee_type for x in ['phase 2', 'phase-2', 'phase-ii', 'phase ii']):
-        return 'smart interviews phase-ii'
-    return fee_type
-
-# Function to standardize fee type labels for display
-def get_standardized_fee_type_label(fee_type):
-    fee_type = fee_type.lower()
-    if 'crt' in fee_type:
-        return 'CRT'
-    elif 'phase-iii' in fee_type or 'phase 3' in fee_type:
-        return 'Phase 3'
-    elif 'phase-ii' in fee_type or 'phase 2' in fee_type:
-        return 'Phase 2'
-    else:
-        return fee_type.title()  # Default case, capitalize words
+def student_id_of(regd_no):
+    """Scalar subquery for a student's id, so a filter by registration number stays one query"""
+    return db.session.query(Student.id).filter(Student.regd_no == regd_no).scalar_subquery()
+
+def upload_lookups(regd_nos):
+    """Students with these registration numbers and their fee entries, in one query each"""
+    students = {student.regd_no: student for student in Student.query.filter(Student.regd_no.in_(set(regd_nos)))}
+    fee_entries = {}
+    if students:
+        regd_no_of = {student.id: regd_no for regd_no, student in students.items()}
+        entries = FeeMaster.query.filter(FeeMaster.student_id.in_(list(regd_no_of))).order_by(FeeMaster.id)
+        for entry in entries:
+            # The first entry of a student and fee type, as a filter_by(...).first() would find
+            fee_entries.setdefault((regd_no_of[entry.student_id], entry.fee_type_id), entry)
+    return students, fee_entries
+
+def paid_totals_subquery(*filters):
+    """Total paid (in paise) per student and fee type"""
+    return db.session.query(
+        Payment.student_id.label('student_id'),
+        Payment.fee_type_id.label('fee_type_id'),
+        db.func.sum(Payment.amount_paid_paise).label('paid_paise')
+    ).filter(
+        *filters
+    ).group_by(
+        Payment.student_id,
+        Payment.fee_type_id
+    ).subquery()
+
+def paid_for_fee(paid):
+    """Join condition matching a paid_totals_subquery() row to its FeeMaster row"""
+    return db.and_(paid.c.student_id == FeeMaster.student_id, paid.c.fee_type_id == FeeMaster.fee_type_id)
+
+def payment_status_case(paid_paise, amount_paise):
+    """SQL CASE giving the payment status label - amounts are integer paise, so no epsilon"""
+    return db.case(
+        (paid_paise >= amount_paise, 'Paid'),
+        (paid_paise > 0, 'Partially Paid'),
+        else_='Not Paid'
+    )
+
+def status_count(status, label):
+    return db.func.coalesce(db.func.sum(db.case((status == label, 1), else_=0)), 0)
 
 # Function to create visualizations
 
@@ -70,12 +162,13 @@ def get_payment_status_by_fee_type():
     fee_type_stats = {}
     
     try:
-        # Get all distinct batch years
-        batch_years = [year[0] for year in db.session.query(Student.batch_year).distinct().order_by(Student.batch_year).all()]
+        # Batch years come from the batch dimension table
+        batch_labels = dict(db.session.query(Batch.id, Batch.name))
+        batch_years = sorted(batch_labels.values())
         
         # Initialize the stats dictionary with batch year breakdowns
-        for fee_type in ['CRT', 'Phase 2', 'Phase 3']:
-            fee_type_stats[fee_type] = {
+        for fee_type in fee_type_registry.all():
+            fee_type_stats[fee_type.label] = {
                 'total': 0, 
                 'paid': 0, 
                 'partially_paid': 0, 
@@ -83,85 +176,55 @@ def get_payment_status_by_fee_type():
                 'by_batch': {year: {'total': 0, 'paid': 0, 'partially_paid': 0, 'not_paid': 0} for year in batch_years}
             }
         
-        # Get all students with fee entries
-        students = db.session.query(Student.regd_no, Student.batch_year).join(
-            FeeMaster, FeeMaster.regd_no == Student.regd_no
-        ).distinct().all()
+        # One aggregate query for every fee type and batch year
+        paid = paid_totals_subquery()
+        paid_paise = db.func.coalesce(paid.c.paid_paise, 0)
+        status = payment_status_case(paid_paise, FeeMaster.amount_paise)
+        
+        rows = db.session.query(
+            FeeMaster.fee_type_id,
+            Student.batch_id,
+            db.func.count(FeeMaster.id).label('total'),
+            status_count(status, 'Paid').label('paid'),
+            status_count(status, 'Partially Paid').label('partially_paid'),
+            status_count(status, 'Not Paid').label('not_paid')
+        ).join(
+            Student, Student.id == FeeMaster.student_id
+        ).outerjoin(
+            paid, paid_for_fee(paid)
+        ).group_by(
+            FeeMaster.fee_type_id,
+            Student.batch_id
+        ).all()
         
-        # Log how many students we're processing
-        app.logger.info(f"Processing payment status for {len(students)} students across all batches")
-        
-        # Process each student
-        for student in students:
-            regd_no = student.regd_no
-            batch_year = student.batch_year
-            
-            # Get all fee entries for this student
-            fee_entries = db.session.query(
-                FeeMaster.fee_type,
-                FeeMaster.amount,
-                FeeMaster.remarks
-            ).filter(FeeMaster.regd_no == regd_no).all()
-            
-            # Process each fee entry
-            for entry in fee_entries:
-                std_fee_type = get_standardized_fee_type_label(entry.fee_type)
-                
-                # Skip if not one of our standard fee types
-                if std_fee_type not in fee_type_stats:
-                    continue
-                
-                # Get payment info for this fee type
-                normalized_entry_type = normalize_fee_type(entry.fee_type)
-                payment = db.session.query(
-                    db.func.sum(Payment.amount_paid).label('total_paid')
-                ).filter(
-                    Payment.regd_no == regd_no,
-                    db.func.lower(Payment.fee_type).like(f'%{normalized_entry_type}%')
-                ).first()
-                
-                # Calculate payment status using same logic as student details
-                total_paid = payment.total_paid if payment and payment.total_paid else 0
-                entry_amount = float(entry.amount)
-                
-                # Increment total counter
-                fee_type_stats[std_fee_type]['total'] += 1
-                if batch_year in fee_type_stats[std_fee_type]['by_batch']:
-                    fee_type_stats[std_fee_type]['by_batch'][batch_year]['total'] += 1
-                
-                # Determine status with same epsilon logic as student details
-                epsilon = 0.01  # Allow for small floating point differences
-                if total_paid >= (entry_amount - epsilon):
-                    fee_type_stats[std_fee_type]['paid'] += 1
-                    if batch_year in fee_type_stats[std_fee_type]['by_batch']:
-                        fee_type_stats[std_fee_type]['by_batch'][batch_year]['paid'] += 1
-                elif total_paid > 0:
-                    fee_type_stats[std_fee_type]['partially_paid'] += 1
-                    if batch_year in fee_type_stats[std_fee_type]['by_batch']:
-                        fee_type_stats[std_fee_type]['by_batch'][batch_year]['partially_paid'] += 1
-                else:
-                    fee_type_stats[std_fee_type]['not_paid'] += 1
-                    if batch_year in fee_type_stats[std_fee_type]['by_batch']:
-                        fee_type_stats[std_fee_type]['by_batch'][batch_year]['not_paid'] += 1
+        for row in rows:
+            stats = fee_type_stats.get(fee_type_registry.label(row.fee_type_id))
+            if stats is None:
+                continue
+            batch_year = batch_labels.get(row.batch_id)
+            for key in ('total', 'paid', 'partially_paid', 'not_paid'):
+                stats[key] += row._mapping[key]
+                if batch_year in stats['by_batch']:
+                    stats['by_batch'][batch_year][key] += row._mapping[key]
         
         # Log the stats before returning
         for fee_type, stats in fee_type_stats.items():
-            app.logger.info(f"{fee_type} stats: Total={stats['total']}, Paid={stats['paid']}, "
-                           f"Partially Paid={stats['partially_paid']}, Not Paid={stats['not_paid']}")
+            current_app.logger.info("%s stats: Total=%d, Paid=%d, Partially Paid=%d, Not Paid=%d", fee_type,
+                                    stats['total'], stats['paid'], stats['partially_paid'], stats['not_paid'])
                     
         return fee_type_stats
     except Exception as e:
-        app.logger.error(f"Error getting payment status by fee type: {str(e)}")
+        current_app.logger.error(f"Error getting payment status by fee type: {str(e)}")
         import traceback
-        app.logger.error(traceback.format_exc())
+        current_app.logger.error(traceback.format_exc())
         return fee_type_stats  # Return empty stats on error
 
-@app.route('/')
+@bp.route('/')
 def index():
     # Redirect to dashboard if logged in, otherwise to admin login page
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
-    return redirect(url_for('admin_login'))
+        return redirect(url_for('main.dashboard'))
+    return redirect(url_for('main.admin_login'))
 
 def create_visualizations(filters=None):
     # Configure matplotlib to use a non-interactive backend
@@ -169,8 +232,11 @@ def create_visualizations(filters=None):
     matplotlib.use('Agg')  # Use Agg backend which is thread-safe
     import matplotlib.pyplot as plt
     import seaborn as sns
+    import numpy as np
+    import pandas as pd
     
     charts = {}
+    chart_started = time.perf_counter()
     
     try:
         # Chart 2: Fee type-wise Payment Status by Batch Year - IMPROVED IMPLEMENTATION
@@ -183,9 +249,9 @@ def create_visualizations(filters=None):
             # ...existing code...
         
         except Exception as e:
-            app.logger.error(f"Error generating payment status chart: {str(e)}")
+            current_app.logger.error(f"Error generating payment status chart: {str(e)}")
             import traceback
-            app.logger.error(traceback.format_exc())
+            current_app.logger.error(traceback.format_exc())
             plt.text(0.5, 0.5, f'Error: {str(e)}', 
                     ha='center', va='center', fontsize=14, transform=plt.gca().transAxes)
             plt.gca().set_axis_off()
@@ -199,7 +265,7 @@ def create_visualizations(filters=None):
             fee_status_data = get_payment_status_by_fee_type()
             
             # Debug logging
-            app.logger.info(f"Fee status data: {fee_status_data}")
+            current_app.logger.debug("Fee status data: %s", fee_status_data)
             
             # Get all batch years
             all_batch_years = []
@@ -302,9 +368,9 @@ def create_visualizations(filters=None):
                 plt.tight_layout()
             
         except Exception as e:
-            app.logger.error(f"Error generating payment status chart: {str(e)}")
+            current_app.logger.error(f"Error generating payment status chart: {str(e)}")
             import traceback
-            app.logger.error(traceback.format_exc())
+            current_app.logger.error(traceback.format_exc())
             plt.text(0.5, 0.5, f'Error: {str(e)}', 
                     ha='center', va='center', fontsize=14, transform=plt.gca().transAxes)
             plt.gca().set_axis_off()
@@ -313,6 +379,8 @@ def create_visualizations(filters=None):
         plt.savefig(buf, format='png', dpi=100)
         buf.seek(0)
         charts['batch_completion'] = base64.b64encode(buf.read()).decode('utf-8')
+        CHART_RENDER.observe(time.perf_counter() - chart_started, chart='batch_completion')
+        chart_started = time.perf_counter()
         plt.close('all')  # Close all figures
         
         # Chart 3: MODIFIED - Daily Fee Collection (Total per day - single bar instead of by fee type)
@@ -324,7 +392,7 @@ def create_visualizations(filters=None):
             date_data = df[~pd.isna(df['payment_date'])].copy()
             
             if date_data.empty:
-                app.logger.warning("No payment date data available for plotting daily chart")
+                current_app.logger.warning("No payment date data available for plotting daily chart")
                 plt.text(0.5, 0.5, 'No payment date data available for the selected filters', 
                         ha='center', va='center', fontsize=14, transform=plt.gca().transAxes)
                 plt.gca().set_axis_off()
@@ -332,7 +400,7 @@ def create_visualizations(filters=None):
                 # Convert payment_date to datetime if it's not already - with explicit error handling
                 if not pd.api.types.is_datetime64_any_dtype(date_data['payment_date']):
                     try:
-                        app.logger.info(f"Converting payment_date column to datetime. Current dtype: {date_data['payment_date'].dtype}")
+                        current_app.logger.info("Converting payment_date column to datetime. Current dtype: %s", date_data['payment_date'].dtype)
                         
                         # First attempt: Convert with pd.to_datetime with errors='coerce' to handle invalid dates
                         date_data['payment_date'] = pd.to_datetime(date_data['payment_date'], errors='coerce')
@@ -344,7 +412,7 @@ def create_visualizations(filters=None):
                             raise ValueError("All payment dates were invalid after conversion")
                             
                     except Exception as date_error:
-                        app.logger.error(f"Error converting payment dates: {str(date_error)}")
+                        current_app.logger.error(f"Error converting payment dates: {str(date_error)}")
                         plt.text(0.5, 0.5, f'Error processing payment dates: {str(date_error)}', 
                                 ha='center', va='center', fontsize=14, transform=plt.gca().transAxes)
                         plt.gca().set_axis_off()
@@ -384,7 +452,7 @@ def create_visualizations(filters=None):
                                     plt.title('Daily Fee Collection', fontsize=14, fontweight='bold')
                         
                         except Exception as date_filter_error:
-                            app.logger.error(f"Error applying date filters: {str(date_filter_error)}")
+                            current_app.logger.error(f"Error applying date filters: {str(date_filter_error)}")
                             # Continue with unfiltered data if there's an error with the date filtering
                     
                     # Show only the last 10 days with data
@@ -401,7 +469,8 @@ def create_visualizations(filters=None):
                     payments_per_day = date_data.groupby('payment_day')['paid_amount'].sum().reset_index()
                     
                     # Log the grouped data for debugging
-                    app.logger.info(f"Daily payments data: {payments_per_day.head(10).to_dict()}")
+                    if current_app.logger.isEnabledFor(logging.DEBUG):
+                        current_app.logger.debug("Daily payments data: %s", payments_per_day.head(10).to_dict())
                     
                     # Sort by date for chronological display
                     payments_per_day = payments_per_day.sort_values('payment_day')
@@ -436,9 +505,9 @@ def create_visualizations(filters=None):
                     plt.grid(axis='y', linestyle='--', alpha=0.6)
                     
                 except Exception as grouping_error:
-                    app.logger.error(f"Error grouping by date: {str(grouping_error)}")
+                    current_app.logger.error(f"Error grouping by date: {str(grouping_error)}")
                     import traceback
-                    app.logger.error(traceback.format_exc())
+                    current_app.logger.error(traceback.format_exc())
                     plt.text(0.5, 0.5, f'Error grouping payment data: {str(grouping_error)}', 
                             ha='center', va='center', fontsize=14, transform=plt.gca().transAxes)
                     plt.gca().set_axis_off()
@@ -446,9 +515,9 @@ def create_visualizations(filters=None):
             plt.tight_layout()
             
         except Exception as chart_error:
-            app.logger.error(f"Error creating daily fee collection chart: {str(chart_error)}")
+            current_app.logger.error(f"Error creating daily fee collection chart: {str(chart_error)}")
             import traceback
-            app.logger.error(traceback.format_exc())
+            current_app.logger.error(traceback.format_exc())
             plt.text(0.5, 0.5, f'Error creating chart: {str(chart_error)}', 
                     ha='center', va='center', fontsize=14, transform=plt.gca().transAxes)
             plt.gca().set_axis_off()
@@ -458,57 +527,44 @@ def create_visualizations(filters=None):
         plt.savefig(buf, format='png', dpi=100)
         buf.seek(0)
         charts['payments_over_time'] = base64.b64encode(buf.read()).decode('utf-8')
+        CHART_RENDER.observe(time.perf_counter() - chart_started, chart='payments_over_time')
+        chart_started = time.perf_counter()
         plt.close('all')  # Close all figurez
         
         plt.figure(figsize=(14, 8))  # Increased size for better visibility
         
-        # Get all batch years from the student table first
-        all_batch_years_query = db.session.query(Student.batch_year).distinct().order_by(Student.batch_year)
-        all_batch_years = [year[0] for year in all_batch_years_query.all()]
+        # Get all batch years from the batch dimension table first
+        batch_labels = dict(db.session.query(Batch.id, Batch.name))
+        all_batch_years = sorted(batch_labels.values())
         
         # Improved query for payment totals by batch year and fee type
-        # Use an explicit LEFT JOIN to ensure all batch years are included
         fee_totals_query = db.session.query(
-            Student.batch_year,
-            Payment.fee_type,
-            db.func.sum(Payment.amount_paid).label('total_paid')
+            Student.batch_id,
+            Payment.fee_type_id,
+            db.func.sum(Payment.amount_paid_paise).label('total_paid')
         ).join(
             Payment,
-            Payment.regd_no == Student.regd_no
+            Payment.student_id == Student.id
         ).group_by(
-            Student.batch_year,
-            Payment.fee_type
+            Student.batch_id,
+            Payment.fee_type_id
         ).all()
         
-        app.logger.info(f"Fee totals query returned {len(fee_totals_query)} records")
-        
-        # Create a DataFrame with all batch years and standard fee types
-        standard_fee_types = ['CRT', 'Phase 2', 'Phase 3']
-        all_combinations = []
-        
-        for batch_year in all_batch_years:
-            for fee_type in standard_fee_types:
-                all_combinations.append({
-                    'batch_year': batch_year,
-                    'fee_type': fee_type,
-                    'total_paid': 0.0  # Default to zero
-                })
+        current_app.logger.info("Fee totals query returned %d records", len(fee_totals_query))
         
-        base_df = pd.DataFrame(all_combinations)
+        # Totals keyed by (batch year, fee type label)
+        fee_type_labels = fee_type_registry.labels()
+        totals = {}
+        for batch_id, fee_type_id, total_paid in fee_totals_query:
+            key = (batch_labels.get(batch_id), fee_type_registry.label(fee_type_id))
+            totals[key] = totals.get(key, 0.0) + from_paise(total_paid)
         
-        # Process query results and update the DataFrame
-        for batch_year, fee_type, total_paid in fee_totals_query:
-            # Get the standardized fee type label
-            std_fee_type = get_standardized_fee_type_label(fee_type)
-            
-            # Only update if it's one of our standard fee types
-            if std_fee_type in standard_fee_types:
-                # Find the matching row in our DataFrame
-                mask = (base_df['batch_year'] == batch_year) & (base_df['fee_type'] == std_fee_type)
-                
-                # Add the payment amount to the existing value (to handle multiple records with same std fee type)
-                if any(mask):
-                    base_df.loc[mask, 'total_paid'] += float(total_paid)
+        # Create a DataFrame with all batch years and registered fee types
+        base_df = pd.DataFrame([
+            {'batch_year': batch_year, 'fee_type': label, 'total_paid': totals.get((batch_year, label), 0.0)}
+            for batch_year in all_batch_years
+            for label in fee_type_labels
+        ])
         
         # Create pivot table for plotting
         pivot_df = base_df.pivot(index='batch_year', columns='fee_type', values='total_paid')
@@ -517,26 +573,19 @@ def create_visualizations(filters=None):
         pivot_df = pivot_df.reindex(all_batch_years).reset_index()
         
         # Log the pivot table data for debugging
-        app.logger.info(f"Pivot DataFrame columns: {pivot_df.columns.tolist()}")
-        app.logger.info(f"Pivot DataFrame shape: {pivot_df.shape}")
-        app.logger.info(f"Pivot DataFrame head: {pivot_df.head().to_dict()}")
+        if current_app.logger.isEnabledFor(logging.INFO):
+            current_app.logger.info("Pivot DataFrame columns: %s", pivot_df.columns.tolist())
+        current_app.logger.info("Pivot DataFrame shape: %s", pivot_df.shape)
+        if current_app.logger.isEnabledFor(logging.DEBUG):
+            current_app.logger.debug("Pivot DataFrame head: %s", pivot_df.head().to_dict())
         
         # Set up the figure with adjusted size
         fig, ax = plt.subplots(figsize=(14, 8))
         
-        # Define bar properties
-        bar_width = 0.25
+        # Define bar properties - one bar per fee type, grouped around each batch year
+        bar_width = 0.75 / max(len(fee_type_labels), 1)
         index = np.arange(len(pivot_df))
-        
-        # Make sure all required columns exist
-        for fee_type in standard_fee_types:
-            if fee_type not in pivot_df.columns:
-                pivot_df[fee_type] = 0
-        
-        # Create grouped bars for each fee type with custom colors and error handling
-        crt_bars = ax.bar(index - bar_width, pivot_df['CRT'], bar_width, label='CRT', color='#4CAF50')
-        phase2_bars = ax.bar(index, pivot_df['Phase 2'], bar_width, label='Phase 2', color='#2196F3')
-        phase3_bars = ax.bar(index + bar_width, pivot_df['Phase 3'], bar_width, label='Phase 3', color='#FFC107')
+        colors = ['#4CAF50', '#2196F3', '#FFC107', '#9C27B0', '#FF5722', '#607D8B']
         
         # Add data labels to each bar
         def add_labels(bars):
@@ -547,9 +596,10 @@ def create_visualizations(filters=None):
                             f'₹{int(height):,}', ha='center', va='bottom', 
                             rotation=0, fontsize=9)
         
-        add_labels(crt_bars)
-        add_labels(phase2_bars)
-        add_labels(phase3_bars)
+        for position, label in enumerate(fee_type_labels):
+            offset = (position - (len(fee_type_labels) - 1) / 2) * bar_width
+            bars = ax.bar(index + offset, pivot_df[label], bar_width, label=label, color=colors[position % len(colors)])
+            add_labels(bars)
         
         # Set up axes, labels, and title
         ax.set_title('Fee Collection by Batch Year and Fee Type', fontsize=14, fontweight='bold')
@@ -566,16 +616,18 @@ def create_visualizations(filters=None):
         plt.savefig(buf, format='png', dpi=100)
         buf.seek(0)
         charts['total_fee'] = base64.b64encode(buf.read()).decode('utf-8')
+        CHART_RENDER.observe(time.perf_counter() - chart_started, chart='total_fee')
+        chart_started = time.perf_counter()
         plt.close('all') 
 
     except Exception as e:
-        app.logger.error(f"Error creating visualizations: {str(e)}")
+        current_app.logger.error(f"Error creating visualizations: {str(e)}")
         import traceback
-        app.logger.error(traceback.format_exc())
+        current_app.logger.error(traceback.format_exc())
         charts["error"] = str(e) 
     return charts 
 
-@app.route('/dashboard', methods=['GET', 'POST'])
+@bp.route('/dashboard', methods=['GET', 'POST'])
 def dashboard():
     # Get date range parameters for daily fee chart
     start_date = request.args.get('start_date')
@@ -589,144 +641,128 @@ def dashboard():
         filters['end_date'] = end_date
     
     try:
-        # Get summary statistics for dashboard cards
-        crt_data = get_fee_type_summary('CRT')
-        phase2_data = get_fee_type_summary('Phase 2')
-        phase3_data = get_fee_type_summary('Phase 3')
+        # Get summary statistics for dashboard cards, keyed by fee type label
+        fee_type_summaries = get_fee_type_summaries()
         total_data = get_total_summary()
         
         # Get payment status counts for summary
         payment_status_counts = {
-            'fully_paid': crt_data.get('fully_paid', 0) + phase2_data.get('fully_paid', 0) + phase3_data.get('fully_paid', 0),
-            'total_students': crt_data.get('total_students', 0) + phase2_data.get('total_students', 0) + phase3_data.get('total_students', 0),
-            'not_paid': crt_data.get('not_paid', 0) + phase2_data.get('not_paid', 0) + phase3_data.get('not_paid', 0)
+            key: sum(summary.get(key, 0) for summary in fee_type_summaries.values())
+            for key in ('fully_paid', 'total_students', 'not_paid')
         }
         
-        app.logger.info(f"CRT data: {crt_data}")
-        app.logger.info(f"Phase 2 data: {phase2_data}")
-        app.logger.info(f"Phase 3 data: {phase3_data}")
+        for label, summary in fee_type_summaries.items():
+            current_app.logger.debug("%s data: %s", label, summary)
         
         # Create visualizations with date filters
         try:
             charts = create_visualizations(filters)
-            app.logger.info(f"Charts generated: {list(charts.keys())}")
+            current_app.logger.info("Charts generated: %s", list(charts))
         except Exception as chart_error:
-            app.logger.error(f"Error creating charts: {str(chart_error)}")
+            current_app.logger.error(f"Error creating charts: {str(chart_error)}")
             import traceback
-            app.logger.error(traceback.format_exc())
+            current_app.logger.error(traceback.format_exc())
             charts = {"error": f"Failed to generate charts: {str(chart_error)}"}
         
         # Get filter options from database (still needed for other parts)
-        batch_years = [row[0] for row in db.session.query(Student.batch_year).distinct().all()]
+        batch_years = filter_options.get()['batch_years']
         return render_template('dashboard.html', 
-                            crt_data=crt_data, 
-                            phase2_data=phase2_data, 
-                            phase3_data=phase3_data, 
+                            fee_type_summaries=fee_type_summaries, 
                             total_data=total_data, 
                             payment_status_counts=payment_status_counts, 
                             charts=charts,
                             batch_years=batch_years,
                             )
     except Exception as e:
-        app.logger.error(f"Error loading dashboard: {str(e)}")
+        current_app.logger.error(f"Error loading dashboard: {str(e)}")
         import traceback
-        app.logger.error(traceback.format_exc())
+        current_app.logger.error(traceback.format_exc())
         flash(f"Error loading dashboard: {str(e)}", "error")
         return render_template('dashboard.html', error=str(e))
 
-def get_fee_type_summary(fee_type):
-    """Get summary statistics for a specific fee type"""
+def get_fee_type_summaries():
+    """Get summary statistics for every registered fee type, keyed by label"""
+    summaries = {}
+    for fee_type in fee_type_registry.all():
+        summaries[fee_type.label] = {
+            'total': 0, 'target_amount': 0, 'count': 0, 'total_students': 0,
+            'fully_paid': 0, 'partially_paid': 0, 'not_paid': 0
+        }
+    
     try:
-        normalized_type = normalize_fee_type(fee_type)
-        
-        # Get all students with this fee type and their fee amounts
-        fee_entries = db.session.query(
-            FeeMaster.regd_no, 
-            FeeMaster.amount
-        ).filter(
-            db.func.lower(FeeMaster.fee_type).like(f'%{normalized_type}%')
+        paid = paid_totals_subquery()
+        paid_paise = db.func.coalesce(paid.c.paid_paise, 0)
+        status = payment_status_case(paid_paise, FeeMaster.amount_paise)
+        
+        # Fee entries with their payment status, counted in SQL per fee type
+        fee_stats = db.session.query(
+            FeeMaster.fee_type_id,
+            db.func.count(FeeMaster.id).label('total_students'),
+            db.func.coalesce(db.func.sum(FeeMaster.amount_paise), 0).label('target_paise'),
+            status_count(status, 'Paid').label('fully_paid'),
+            status_count(status, 'Partially Paid').label('partially_paid'),
+            status_count(status, 'Not Paid').label('not_paid')
+        ).outerjoin(
+            paid, paid_for_fee(paid)
+        ).group_by(
+            FeeMaster.fee_type_id
         ).all()
         
-        # Get total students who should pay this fee
-        total_students = len(fee_entries)
-        total_fee_amount = sum(float(amount) for _, amount in fee_entries)
-        
-        # Create a mapping of registration numbers to fee amounts
-        student_fees = {regd_no: float(amount) for regd_no, amount in fee_entries}
-        
-        # Get all payment records for this fee type
-        payments = db.session.query(
-            Payment.regd_no,
-            db.func.sum(Payment.amount_paid).label('total_paid')
-        ).filter(
-            db.func.lower(Payment.fee_type).like(f'%{normalized_type}%')
+        # Everything collected per fee type, and how many students paid anything
+        collected = db.session.query(
+            paid.c.fee_type_id,
+            db.func.coalesce(db.func.sum(paid.c.paid_paise), 0).label('collected_paise'),
+            db.func.count(paid.c.student_id).label('count')
         ).group_by(
-            Payment.regd_no
+            paid.c.fee_type_id
         ).all()
         
-        # Create a mapping of registration numbers to paid amounts
-        student_payments = {regd_no: float(total_paid) for regd_no, total_paid in payments}
-        
-        # Calculate total collected amount
-        total_collected = sum(student_payments.values())
-        
-        # Count fully paid, partially paid, and not paid students
-        fully_paid_count = 0
-        partially_paid_count = 0
-        not_paid_count = 0
-        
-        # Check payment status for each student
-        for regd_no, fee_amount in student_fees.items():
-            paid_amount = student_payments.get(regd_no, 0)
-            
-            # Use small epsilon to avoid floating point precision issues
-            epsilon = 0.01
-            if paid_amount >= (fee_amount - epsilon):
-                fully_paid_count += 1
-            elif paid_amount > 0:
-                partially_paid_count += 1
-            else:
-                not_paid_count += 1
-        
-        return {
-            'total': total_collected,         # Total amount collected so far
-            'target_amount': total_fee_amount, # Total expected if everyone pays
-            'count': len(payments),           # Number of students who made any payment
-            'total_students': total_students, # Total students who should pay
-            'fully_paid': fully_paid_count,
-            'partially_paid': partially_paid_count,
-            'not_paid': not_paid_count
-        }
+        for row in fee_stats:
+            summary = summaries.get(fee_type_registry.label(row.fee_type_id))
+            if summary is not None:
+                summary['target_amount'] = from_paise(row.target_paise)   # Total expected if everyone pays
+                summary['total_students'] = row.total_students           # Total students who should pay
+                summary['fully_paid'] = row.fully_paid
+                summary['partially_paid'] = row.partially_paid
+                summary['not_paid'] = row.not_paid
+        for row in collected:
+            summary = summaries.get(fee_type_registry.label(row.fee_type_id))
+            if summary is not None:
+                summary['total'] = from_paise(row.collected_paise)        # Total amount collected so far
+                summary['count'] = row.count                             # Number of students who made any payment
+        return summaries
     except Exception as e:
-        app.logger.error(f"Error getting summary for {fee_type}: {str(e)}")
+        current_app.logger.error(f"Error getting fee type summaries: {str(e)}")
         import traceback
-        app.logger.error(traceback.format_exc())            
-        return {'total': 0, 'count': 0, 'total_students': 0, 'fully_paid': 0}
+        current_app.logger.error(traceback.format_exc())            
+        return summaries
 
 def get_total_summary():
     """Get total collection summary across all fee types"""
     try:
         # Get total amount collected
-        total_amount = db.session.query(
-            db.func.sum(Payment.amount_paid)
+        total_paise = db.session.query(
+            db.func.sum(Payment.amount_paid_paise)
         ).scalar() or 0
         
         # Get total count of unique students who paid
         student_count = db.session.query(
-            db.func.count(db.distinct(Payment.regd_no))
+            db.func.count(db.distinct(Payment.student_id))
         ).scalar() or 0
         
-        return {'total': total_amount, 'count': student_count}
+        return {'total': from_paise(total_paise), 'count': student_count}
     except Exception as e:
-        app.logger.error(f"Error getting total summary: {str(e)}")
+        current_app.logger.error(f"Error getting total summary: {str(e)}")
         return {'total': 0, 'count': 0}
 
-@app.route('/upload', methods=['GET', 'POST'])
+@bp.route('/upload', methods=['GET', 'POST'])
 def upload():
     if request.method == 'POST':
+        import pandas as pd
+        
         # Debugging - log request information
-        app.logger.info(f"Request files: {request.files}")
-        app.logger.info(f"Request form: {request.form}")
+        current_app.logger.info("Request files: %s", request.files)
+        current_app.logger.info("Request form: %s", request.form)
         
         # Check if file was uploaded
         if 'excel-file' not in request.files:
@@ -734,7 +770,7 @@ def upload():
             return redirect(request.url)
         
         file = request.files['excel-file']
-        app.logger.info(f"File received: {file.filename}, Content type: {file.content_type}")
+        current_app.logger.info("File received: %s, Content type: %s", file.filename, file.content_type)
         
         # If user submits an empty form
         if file.filename == '':
@@ -748,11 +784,12 @@ def upload():
             flash(f'Invalid file format. Please upload an Excel file (.xlsx, .xls) or CSV file. Got: {file_ext}', 'error')
             return redirect(request.url)
         
+        upload_started = time.perf_counter()
         try:
             # Create a temporary file to save the uploaded content
             temp_path = os.path.join(os.path.dirname(__file__), 'temp_upload' + file_ext)
             file.save(temp_path)
-            app.logger.info(f"Saved file temporarily to {temp_path}")
+            current_app.logger.info("Saved file temporarily to %s", temp_path)
             
             # Read the file based on extension
             if file_ext == '.csv':
@@ -762,10 +799,12 @@ def upload():
             
             # Remove the temporary file
             os.remove(temp_path)
+            note_rows(len(df))
             
             # Log dataframe info
-            app.logger.info(f"DataFrame loaded with shape: {df.shape}")
-            app.logger.info(f"DataFrame columns: {df.columns.tolist()}")
+            current_app.logger.info("DataFrame loaded with shape: %s", df.shape)
+            if current_app.logger.isEnabledFor(logging.INFO):
+                current_app.logger.info("DataFrame columns: %s", df.columns.tolist())
             
             # Fix column names - convert all to lowercase and strip spaces
             df.columns = [col.lower().strip() for col in df.columns]
@@ -796,145 +835,168 @@ def upload():
             if missing_columns:
                 flash(f"Missing required columns: {', '.join(missing_columns)}", 'error')
                 flash(f"Available columns: {', '.join(df.columns)}", 'error')
+                UPLOADS.inc(result='failed')
                 return redirect(request.url)
             
             # Process data
             records_processed = 0
             errors = []
             added_reg_numbers = set()
+            added_student_ids = set()
+            # Batch and branch name -> dimension id for this upload
+            batch_ids = {}
+            branch_ids = {}
             
             # Start a transaction for better performance
             try:
-                # Process each row
-                for index, row in df.iterrows():
-                    try:
-                        # Clean and normalize input data
-                        registration_number = str(row['regd_no']).strip()
-                        name = str(row['name']).strip()
-                        batch_year = str(row['batch_year']).strip()
-                        branch = str(row['branch']).strip()
-                        mobile = str(row['mobile']).strip() if not pd.isna(row['mobile']) else ""
-                        
-                        # Normalize fee_type and handle comma-separated types
-                        fee_type_raw = str(row['fee_type']).strip()
-                        fee_types = [normalize_fee_type(ft.strip()) for ft in fee_type_raw.split(',')]
-                        
-                        # Convert amount to float with validation
+                for start in range(0, len(df), UPLOAD_CHUNK_ROWS):
+                    chunk = df.iloc[start:start + UPLOAD_CHUNK_ROWS]
+                    students, fee_entries = upload_lookups(chunk['regd_no'].astype(str).str.strip())
+                    chunk_students = []
+                    
+                    # Process each row
+                    for index, row in chunk.iterrows():
                         try:
-                            total_fee_amount = float(row['amount'])
-                            if total_fee_amount <= 0:
-                                raise ValueError("Fee amount must be positive")
+                            # Clean and normalize input data
+                            registration_number = str(row['regd_no']).strip()
+                            name = str(row['name']).strip()
+                            batch_year = str(row['batch_year']).strip()
+                            branch = str(row['branch']).strip()
+                            mobile = str(row['mobile']).strip() if not pd.isna(row['mobile']) else ""
                             
-                            # If multiple fee types, amounts will be proportionally assigned later
-                            # Just store the total for now
-                            fee_amount_per_type = total_fee_amount
-                                
-                        except (ValueError, TypeError) as e:
-                            raise ValueError(f"Invalid fee amount: {row['amount']} - {str(e)}")
-                        
-                        # Optional fields
-                        batch = str(row.get('batch', '')).strip() if 'batch' in row else ""
-                        remarks = str(row.get('remarks', '')).strip() if 'remarks' in row else ""
-                        
-                        # Check if student exists
-                        student = Student.query.filter_by(regd_no=registration_number).first()
-                        
-                        # If student doesn't exist, create a new one
-                        if not student:
-                            student = Student(
-                                regd_no=registration_number,
-                                name=name,
-                                batch_year=batch_year,
-                                branch=branch,
-                                mobile=mobile
-                            )
-                            db.session.add(student)
-                            db.session.flush()  # Flush to get the student.id
-                            app.logger.info(f"Added new student: {registration_number} - {name}")
-                        else:
-                            # Update existing student information
-                            student.name = name
-                            student.batch_year = batch_year
-                            student.branch = branch
-                            student.mobile = mobile
-                            app.logger.info(f"Updated existing student: {registration_number}")
-                        
-                        # Process each fee type separately
-                        if len(fee_types) > 1:
-                            # For multiple fee types, divide the amount proportionally
-                            # Default to equal distribution
-                            fee_amount_per_type = round(total_fee_amount / len(fee_types), 2)
-                        
-                        for fee_type in fee_types:
-                            # Check if fee entry exists for this student and fee type
-                            fee_entry = FeeMaster.query.filter_by(
-                                regd_no=registration_number,
-                                fee_type=fee_type
-                            ).first()
+                            # Resolve comma-separated fee types to registry ids (new spellings are registered)
+                            fee_type_raw = str(row['fee_type']).strip()
+                            fee_type_ids = [fee_type_registry.resolve(ft) for ft in fee_type_raw.split(',') if ft.strip()]
+                            if not fee_type_ids:
+                                raise ValueError("Fee type is required")
+                            
+                            # Convert amount to integer paise with validation
+                            try:
+                                total_fee_paise = to_paise(row['amount'])
+                                if total_fee_paise <= 0:
+                                    raise ValueError("Fee amount must be positive")
+                            except (ValueError, TypeError) as e:
+                                raise ValueError(f"Invalid fee amount: {row['amount']} - {str(e)}")
+                            
+                            # Optional fields
+                            batch = str(row.get('batch', '')).strip() if 'batch' in row else ""
+                            remarks = str(row.get('remarks', '')).strip() if 'remarks' in row else ""
+                            
+                            batch_id = dimension_id(Batch, batch_year, batch_ids)
+                            branch_id = dimension_id(Branch, branch, branch_ids)
                             
-                            # If fee entry doesn't exist, create a new one
-                            if not fee_entry:
-                                fee_entry = FeeMaster(
+                            # Check if student exists
+                            student = students.get(registration_number)
+                            
+                            # If student doesn't exist, create a new one
+                            if not student:
+                                student = Student(
                                     regd_no=registration_number,
-                                    fee_type=fee_type,
-                                    amount=fee_amount_per_type,
-                                    remarks=f"{remarks} (Part of: {fee_type_raw})" if len(fee_types) > 1 else remarks
+                                    name=name,
+                                    batch_id=batch_id,
+                                    branch_id=branch_id,
+                                    mobile=mobile
                                 )
-                                db.session.add(fee_entry)
-                                app.logger.info(f"Added new fee entry for {registration_number}: {fee_type} - ₹{fee_amount_per_type}")
+                                db.session.add(student)
+                                students[registration_number] = student
+                                upload_log.debug("Added new student: %s - %s", registration_number, name, extra=UPLOAD_ROW)
                             else:
-                                # Update existing fee entry
-                                fee_entry.amount = fee_amount_per_type
-                                fee_entry.remarks = remarks
-                                app.logger.info(f"Updated existing fee entry for {registration_number}: {fee_type}")
+                                # Update existing student information
+                                student.name = name
+                                student.batch_id = batch_id
+                                student.branch_id = branch_id
+                                student.mobile = mobile
+                                upload_log.debug("Updated existing student: %s", registration_number, extra=UPLOAD_ROW)
+                            
+                            # For multiple fee types, divide the amount equally - the shares
+                            # are whole paise and always add up to the total
+                            fee_shares = split_paise(total_fee_paise, [1] * len(fee_type_ids))
                             
-                            # Ensure payment information is included (optional columns)
+                            # Optional payment columns, split in proportion to the fee shares
+                            paid_shares = None
                             if 'paid_amount' in df.columns and 'payment_date' in df.columns and pd.notna(row['paid_amount']):
-                                # Parse payment amount
-                                paid_amount = float(row['paid_amount'])
+                                paid_shares = split_paise(to_paise(row['paid_amount']), fee_shares)
+                            
+                            # Process each fee type separately
+                            for fee_type_id, fee_paise, paid_paise in zip(fee_type_ids, fee_shares, paid_shares or [0] * len(fee_type_ids)):
+                                fee_type = fee_type_registry.code(fee_type_id)
                                 
-                                # Calculate proportional payment based on fee amounts
-                                proportion = fee_amount_per_type / total_fee_amount
-                                paid_amount = round(paid_amount * proportion, 2)
+                                # Check if fee entry exists for this student and fee type
+                                fee_entry = fee_entries.get((registration_number, fee_type_id))
                                 
-                                if paid_amount > 0 and pd.notna(row['payment_date']):
-                                    # Parse payment date
-                                    payment_date = row['payment_date']
-                                    if isinstance(payment_date, str):
-                                        payment_date = datetime.strptime(payment_date, '%Y-%m-%d').date()
-                                    elif isinstance(payment_date, (pd.Timestamp, datetime)):
-                                        payment_date = payment_date.date()
-                                    
-                                    received_by = str(row.get('received_by', 'Excel Import')).strip() if 'received_by' in row else 'Excel Import'
-                                    
-                                    # Create payment record
-                                    payment = Payment(
-                                        batch_year=batch_year,
-                                        regd_no=registration_number,
+                                # If fee entry doesn't exist, create a new one
+                                if not fee_entry:
+                                    fee_entry = FeeMaster(
+                                        student=student,
+                                        fee_type_id=fee_type_id,
                                         fee_type=fee_type,
-                                        amount_paid=paid_amount,
-                                        date=payment_date,
-                                        received_by=received_by
+                                        amount_paise=fee_paise,
+                                        remarks=f"{remarks} (Part of: {fee_type_raw})" if len(fee_type_ids) > 1 else remarks
                                     )
-                                    db.session.add(payment)
-                                    app.logger.info(f"Added payment record for {registration_number}: {fee_type} - ₹{paid_amount}")
-                    
-                        # Add to the set
-                        added_reg_numbers.add(registration_number)
-                        records_processed += 1
+                                    db.session.add(fee_entry)
+                                    fee_entries[(registration_number, fee_type_id)] = fee_entry
+                                    upload_log.debug("Added new fee entry for %s: %s - ₹%s", registration_number, fee_type,
+                                                     from_paise(fee_paise), extra=UPLOAD_ROW)
+                                else:
+                                    # Update existing fee entry
+                                    fee_entry.amount_paise = fee_paise
+                                    fee_entry.remarks = remarks
+                                    upload_log.debug("Updated existing fee entry for %s: %s", registration_number, fee_type,
+                                                     extra=UPLOAD_ROW)
+                                
+                                # Ensure payment information is included (optional columns)
+                                if paid_shares is not None:
+                                    if paid_paise > 0 and pd.notna(row['payment_date']):
+                                        # Parse payment date
+                                        payment_date = row['payment_date']
+                                        if isinstance(payment_date, str):
+                                            payment_date = datetime.strptime(payment_date, '%Y-%m-%d').date()
+                                        elif isinstance(payment_date, (pd.Timestamp, datetime)):
+                                            payment_date = payment_date.date()
+                                        
+                                        received_by = str(row.get('received_by', 'Excel Import')).strip() if 'received_by' in row else 'Excel Import'
+                                        
+                                        # Create payment record
+                                        payment = Payment(
+                                            batch_id=batch_id,
+                                            student=student,
+                                            fee_type_id=fee_type_id,
+                                            fee_type=fee_type,
+                                            amount_paid_paise=paid_paise,
+                                            date=payment_date,
+                                            received_by=received_by
+                                        )
+                                        db.session.add(payment)
+                                        upload_log.debug("Added payment record for %s: %s - ₹%s", registration_number,
+                                                         fee_type, from_paise(paid_paise), extra=UPLOAD_ROW)
+                        
+                            # Add to the set
+                            added_reg_numbers.add(registration_number)
+                            chunk_students.append(student)
+                            records_processed += 1
+                        
+                        except Exception as e:
+                            errors.append(f"Warning on row {index + 2}: {str(e)}")
+                            upload_log.warning("Warning on row %d: %s", index + 2, e, extra=UPLOAD_ROW)
                     
-                    except Exception as e:
-                        errors.append(f"Warning on row {index + 2}: {str(e)}")
-                        app.logger.warning(f"Warning on row {index + 2}: {str(e)}")
+                    # New students get their ids here, in one flush for the chunk
+                    db.session.flush()
+                    added_student_ids.update(student.id for student in chunk_students)
                 
                 # Commit the transaction
                 db.session.commit()
             
             except Exception as e:
                 db.session.rollback()
-                app.logger.error(f"Error processing data: {str(e)}")
+                current_app.logger.error("Error processing data: %s", e)
                 flash(f"Error processing data: {str(e)}", 'error')
+                UPLOADS.inc(result='failed')
                 return redirect(request.url)
+
+            UPLOADS.inc(result='ok')
+            UPLOAD_ROWS.inc(records_processed)
+            UPLOAD_ROW_ERRORS.inc(len(errors))
+            UPLOAD_SECONDS.inc(time.perf_counter() - upload_started)
             
             # Show success message
             flash(f"Successfully processed {records_processed} records!", 'success')
@@ -942,17 +1004,26 @@ def upload():
                 for error in errors[:10]:  # Limit to first 10 errors
                     flash(error, 'warning')
             
-            # Redirect to student details page to see the added registration numbers
-            return redirect(url_for('student_details', reg_numbers=list(added_reg_numbers)))
+            # Redirect to student details page to see the added students, saved
+            # server-side under a short token so the URL stays small for any sheet
+            try:
+                selection = create_selection(added_student_ids)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                current_app.logger.error("Error saving uploaded students selection: %s", e)
+                return redirect(url_for('main.student_details'))
+            return redirect(url_for('main.student_details', selection=selection))
         
         except Exception as e:
-            app.logger.error(f"Error processing file: {str(e)}")
+            current_app.logger.error("Error processing file: %s", e)
             flash(f"Error processing file: {str(e)}", 'error')
+            UPLOADS.inc(result='failed')
             return redirect(request.url)
     
     return render_template('upload.html')
 
-@app.route('/payments', methods=['GET', 'POST'])
+@bp.route('/payments', methods=['GET', 'POST'])
 def payments():
     # Initialize empty payment history in case of errors
     payment_history = []
@@ -961,36 +1032,41 @@ def payments():
     regd_no = request.args.get('regd_no', '')
     fee_type = request.args.get('fee_type', '')
     
-    # Normalize fee type if provided
-    if fee_type:
-        fee_type = normalize_fee_type(fee_type)
+    # Show the registered code for any known spelling of the fee type
+    fee_type_id = fee_type_registry.lookup(fee_type) if fee_type else None
+    if fee_type_id is not None:
+        fee_type = fee_type_registry.code(fee_type_id)
     
     # If pre-populated, try to get student details
     student_name = ''
     batch_year = ''
     if regd_no:
         try:
-            student = Student.query.filter_by(regd_no=regd_no).first()
+            student = db.session.query(Student.name, Batch.name.label('batch_year')).join(
+                Batch, Batch.id == Student.batch_id
+            ).filter(Student.regd_no == regd_no).first()
             if student:
                 student_name = student.name
                 batch_year = student.batch_year
         except Exception as e:
-            app.logger.error(f"Error fetching student for pre-population: {str(e)}")
+            current_app.logger.error(f"Error fetching student for pre-population: {str(e)}")
     
     try:
         # Get recent payment history - use simpler query and handle null values
         recent_payments = db.session.query(
             Payment.id,
-            Payment.regd_no, 
+            Student.regd_no, 
             Student.name,
-            Payment.batch_year, 
-            Payment.fee_type, 
-            Payment.amount_paid, 
+            Batch.name.label('batch_year'), 
+            Payment.fee_type_id, 
+            Payment.amount_paid_paise, 
             Payment.date,
             Payment.received_by
         ).outerjoin(  # Changed to outer join to avoid failures if student record is missing
             Student, 
-            Payment.regd_no == Student.regd_no
+            Payment.student_id == Student.id
+        ).join(
+            Batch, Batch.id == Payment.batch_id
         ).order_by(
             Payment.date.desc()
         ).limit(10).all()
@@ -1001,8 +1077,8 @@ def payments():
                 'regd_no': payment.regd_no,
                 'student_name': payment.name if payment.name else "Unknown",
                 'batch_year': payment.batch_year,
-                'fee_type': get_standardized_fee_type_label(payment.fee_type),
-                'amount': payment.amount_paid,
+                'fee_type': fee_type_registry.label(payment.fee_type_id),
+                'amount': from_paise(payment.amount_paid_paise),
                 'date': payment.date.strftime('%Y-%m-%d') if payment.date else "Unknown",
                 'received_by': payment.received_by,
                 'status': 'Paid'
@@ -1010,8 +1086,8 @@ def payments():
     except Exception as e:
         # Log the error and use empty payment history
         import traceback
-        app.logger.error(f"Error retrieving payment history: {str(e)}")
-        app.logger.error(traceback.format_exc())
+        current_app.logger.error(f"Error retrieving payment history: {str(e)}")
+        current_app.logger.error(traceback.format_exc())
     
     if request.method == 'POST':
         try:
@@ -1026,21 +1102,26 @@ def payments():
             # Split combined fee types by pipe symbol
             fee_types = fee_type_combined.split('|') if fee_type_combined else []
             
-            # Normalize each fee type to ensure consistency
-            normalized_fee_types = []
+            # Resolve each spelling to its registry id, keeping the selection order
+            fee_type_ids = []
             for fee_type in fee_types:
                 fee_type = fee_type.strip()
                 if not fee_type:
                     continue
-                    
-                # Apply more consistent normalization
-                normalized_type = normalize_fee_type(fee_type)
-                normalized_fee_types.append(normalized_type)
-            
-            fee_types = normalized_fee_types
+                fee_type_id = fee_type_registry.lookup(fee_type)
+                if fee_type_id is None:
+                    flash(f'Unknown fee type: {fee_type}', 'error')
+                    return render_template('payments.html', 
+                                           payment_history=payment_history,
+                                           reg_no=regd_no,
+                                           fee_type=fee_type,
+                                           student_name=student_name,
+                                           batch_year=batch_year)
+                if fee_type_id not in fee_type_ids:
+                    fee_type_ids.append(fee_type_id)
             
             # Validate required fields
-            if not all([regd_number, batch_year, fee_types, payment_method, amount, payment_date, received_by]):
+            if not all([regd_number, batch_year, fee_type_ids, payment_method, amount, payment_date, received_by]):
                 flash('All fields are required.', 'error')
                 return render_template('payments.html', 
                                        payment_history=payment_history,
@@ -1049,47 +1130,53 @@ def payments():
                                        student_name=student_name,
                                        batch_year=batch_year)
             
-            # Simple validation for student existence
+            # Payments are recorded against the student's id, so the student must exist
             student = Student.query.filter_by(regd_no=regd_number).first()
-            student_name = student.name if student else "Unknown"
+            if not student:
+                flash(f'Student {regd_number} not found.', 'error')
+                return render_template('payments.html', 
+                                       payment_history=payment_history,
+                                       reg_no=regd_no,
+                                       fee_type=fee_type,
+                                       student_name=student_name,
+                                       batch_year=batch_year)
+            student_name = student.name
+            
+            # Convert amount to integer paise for distribution
+            total_paise = to_paise(amount)
+            # The batch comes from the student record, never from the free-text
+            # form field, so a typo can't create a batch row
+            batch_id = student.batch_id
             
-            # Convert amount to float for distribution
-            total_amount = float(amount)
+            # Convert date string to Python date object
+            try:
+                payment_date_obj = datetime.strptime(payment_date, '%Y-%m-%d').date()
+            except ValueError:
+                flash('Invalid date format. Please use YYYY-MM-DD format.', 'error')
+                return render_template('payments.html', 
+                                   payment_history=payment_history,
+                                   reg_no=regd_no,
+                                   fee_type=fee_type,
+                                   student_name=student_name,
+                                   batch_year=batch_year)
             
             # If multiple fee types, distribute amount proportionally based on fee amounts rather than remaining dues
-            if len(fee_types) > 1:
-                # Get fee info to calculate proportional distribution
-                student_fees = []
-                total_fee_amount = 0
+            if len(fee_type_ids) > 1:
+                # Fee amounts for the selected types, in one query
+                fee_amounts = {}
+                for entry in db.session.query(
+                    FeeMaster.fee_type_id,
+                    FeeMaster.amount_paise
+                ).filter(
+                    FeeMaster.student_id == student.id,
+                    FeeMaster.fee_type_id.in_(fee_type_ids)
+                ).order_by(FeeMaster.id):
+                    fee_amounts.setdefault(entry.fee_type_id, entry.amount_paise)
                 
-                for fee_type in fee_types:
-                    # Get fee master entry - use more flexible matching with LIKE
-                    fee_entry = db.session.query(FeeMaster).filter(
-                        FeeMaster.regd_no == regd_number,
-                        db.func.lower(FeeMaster.fee_type).like(f'%{fee_type.lower()}%')
-                    ).first()
-                    
-                    if fee_entry:
-                        # Get the fee amount
-                        fee_amount = float(fee_entry.amount)
-                        total_fee_amount += fee_amount
-                        
-                        # Get payments for this fee type
-                        payment = db.session.query(
-                            db.func.sum(Payment.amount_paid).label('total_paid')
-                        ).filter(
-                            db.func.lower(FeeMaster.fee_type).like(f'%{fee_type.lower()}%')
-                        ).first()
-                        
-                        # Get existing payments for this fee type
-                        paid_amount = payment.total_paid if payment and payment.total_paid else 0
-                        
-                        student_fees.append({
-                            'fee_type': fee_entry.fee_type,
-                            'amount': fee_amount,
-                            'paid': paid_amount,
-                            'remaining': max(0, fee_amount - paid_amount)
-                        })
+                student_fees = [
+                    {'fee_type_id': fee_type_id, 'amount_paise': fee_amounts[fee_type_id]}
+                    for fee_type_id in fee_type_ids if fee_type_id in fee_amounts
+                ]
                 
                 # If no fee types found, show error
                 if not student_fees:
@@ -1101,42 +1188,17 @@ def payments():
                                        student_name=student_name,
                                        batch_year=batch_year)
                 
-                # Calculate distribution based on original fee amounts (not remaining amounts)
-                total_paid_so_far = 0
-                for i, fee in enumerate(student_fees):
-                    if total_fee_amount > 0:
-                        # Calculate proportional amount based on original fee amount
-                        proportion = fee['amount'] / total_fee_amount
-                        fee_payment = round(total_amount * proportion, 2)
-                    else:
-                        # Equal distribution if couldn't determine proportion (shouldn't happen normally)
-                        fee_payment = round(total_amount / len(student_fees), 2)
-                    
-                    # Avoid rounding errors by assigning remaining amount to last fee
-                    if i == len(student_fees) - 1:
-                        fee_payment = round(total_amount - total_paid_so_far, 2)
-                    
-                    total_paid_so_far += fee_payment
-                    fee['paid_amount'] = fee_payment
-                    
-                    # Convert date string to Python date object
-                    try:
-                        payment_date_obj = datetime.strptime(payment_date, '%Y-%m-%d').date()
-                    except ValueError:
-                        flash('Invalid date format. Please use YYYY-MM-DD format.', 'error')
-                        return render_template('payments.html', 
-                                           payment_history=payment_history,
-                                           reg_no=regd_no,
-                                           fee_type=fee_type,
-                                           student_name=student_name,
-                                           batch_year=batch_year)
-                    
+                # Distribution based on original fee amounts (not remaining amounts), in whole
+                # paise - the last fee takes the remainder so nothing is lost to rounding
+                shares = split_paise(total_paise, [fee['amount_paise'] for fee in student_fees])
+                for fee, share in zip(student_fees, shares):
                     # Create payment record for this fee type
                     payment = Payment(
-                        batch_year=batch_year,
-                        regd_no=regd_number,
-                        fee_type=fee['fee_type'],
-                        amount_paid=fee['paid_amount'],
+                        batch_id=batch_id,
+                        student_id=student.id,
+                        fee_type_id=fee['fee_type_id'],
+                        fee_type=fee_type_registry.code(fee['fee_type_id']),
+                        amount_paid_paise=share,
                         date=payment_date_obj,
                         received_by=received_by
                     )
@@ -1144,36 +1206,12 @@ def payments():
                     db.session.add(payment)
             else:
                 # Single fee type - use the traditional flow
-                fee_type = fee_types[0] if fee_types else ""
-                
-                # Find exact fee type from database using case-insensitive LIKE
-                db_fee_entry = db.session.query(FeeMaster.fee_type).filter(
-                    FeeMaster.regd_no == regd_number,
-                    db.func.lower(FeeMaster.fee_type).like(f'%{fee_type.lower()}%')
-                ).first()
-                
-                # Use the exact fee type string from database if found
-                if db_fee_entry:
-                    fee_type = db_fee_entry.fee_type
-                
-                # Convert date string to Python date object
-                try:
-                    payment_date_obj = datetime.strptime(payment_date, '%Y-%m-%d').date()
-                except ValueError:
-                    flash('Invalid date format. Please use YYYY-MM-DD format.', 'error')
-                    return render_template('payments.html', 
-                                       payment_history=payment_history,
-                                       reg_no=regd_no,
-                                       fee_type=fee_type,
-                                       student_name=student_name,
-                                       batch_year=batch_year)
-                
-                # Create and add payment record
                 payment = Payment(
-                    batch_year=batch_year,
-                    regd_no=regd_number,
-                    fee_type=fee_type,
-                    amount_paid=float(amount),
+                    batch_id=batch_id,
+                    student_id=student.id,
+                    fee_type_id=fee_type_ids[0],
+                    fee_type=fee_type_registry.code(fee_type_ids[0]),
+                    amount_paid_paise=total_paise,
                     date=payment_date_obj,
                     received_by=received_by
                 )
@@ -1184,23 +1222,23 @@ def payments():
                 db.session.commit()
                 
                 # Show the number of fee types paid for in the flash message
-                if len(fee_types) > 1:
-                    flash(f'Payment for {len(fee_types)} fee types processed successfully!', 'success')
+                if len(fee_type_ids) > 1:
+                    flash(f'Payment for {len(fee_type_ids)} fee types processed successfully!', 'success')
                 else:
                     flash('Payment processed successfully!', 'success')
                 
                 # Redirect to student details page to see updated payment status
-                return redirect(url_for('student_details', reg_numbers=[regd_number], display_type='payment_details'))
+                return redirect(url_for('main.student_details', reg_numbers=[regd_number], display_type='payment_details'))
                 
             except Exception as e:
                 db.session.rollback()
-                app.logger.error(f"Error saving payment: {str(e)}")
+                current_app.logger.error(f"Error saving payment: {str(e)}")
                 flash(f'Error saving payment: {str(e)}', 'error')
             
         except Exception as e:
             import traceback
-            app.logger.error(f"Error processing payment: {str(e)}")
-            app.logger.error(traceback.format_exc())
+            current_app.logger.error(f"Error processing payment: {str(e)}")
+            current_app.logger.error(traceback.format_exc())
             flash(f'Error processing payment: {str(e)}', 'error')
     
     # Always return the template, even after errors
@@ -1211,10 +1249,11 @@ def payments():
                           student_name=student_name,
                           batch_year=batch_year)
 
-@app.route('/download_template')
+@bp.route('/download_template')
 
 def download_template():
     """Generate and provide a sample template for download in Excel or CSV format"""
+    import pandas as pd
     format_type = request.args.get('format', 'excel')  # Default to Excel if not specified
     
     try:
@@ -1289,17 +1328,13 @@ def download_template():
     
     except Exception as e:
         # Log the error for debugging
-        app.logger.error(f"Error generating template: {str(e)}")
+        current_app.logger.error(f"Error generating template: {str(e)}")
         flash(f"Could not generate template file: {str(e)}", "error")
-        return redirect(url_for('upload'))
+        return redirect(url_for('main.upload'))
 
-@app.route('/student_details', methods=['GET'])
+@bp.route('/student_details', methods=['GET'])
 @login_required
 def student_details():
-    # Initialize empty lists/values in case of database errors
-    batch_years = []
-    fee_types = []
-    branches = []
     student_records = []
     
     # Get filter parameters
@@ -1307,6 +1342,8 @@ def student_details():
     fee_type = request.args.get('fee_type')
     regd_no = request.args.get('regd_no', '')  # Add this line to get registration number filter
     reg_numbers = request.args.getlist('reg_numbers')
+    selection = request.args.get('selection', '')  # Students saved by an upload (see selections.py)
+    history = request.args.get('history') == '1'  # Read an archived batch from its archive file
     payment_status = request.args.get('payment_status')
     student_name = request.args.get('student_name', '')
     branch = request.args.get('branch', '')
@@ -1315,72 +1352,65 @@ def student_details():
     display_type = request.args.get('display_type', 'payment_details')  # Default to payment details
     
     # Add logging to track the request
-    app.logger.info(f"Student details request - batch_year: {batch_year}, fee_type: {fee_type}, "
-                    f"regd_no: {regd_no}, reg_numbers: {reg_numbers}, payment_status: {payment_status}, "
-                    f"student_name: {student_name}, branch: {branch}, display_type: {display_type}")
+    current_app.logger.info("Student details request - batch_year: %s, fee_type: %s, regd_no: %s, reg_numbers: %s, "
+                            "selection: %s, payment_status: %s, student_name: %s, branch: %s, display_type: %s",
+                            batch_year, fee_type, regd_no, reg_numbers, selection, payment_status,
+                            student_name, branch, display_type)
     
-    try:
-        # Get batch years - use a simpler query with error handling
-        batch_years_query = db.session.query(Student.batch_year).distinct()
-        batch_years = [year[0] for year in batch_years_query.all()]
-        if not batch_years:  # Fallback if no data
-            batch_years = ['2020-2024', '2021-2025', '2022-2026', '2023-2027', '2024-2028', '2025-2029', '2026-2030']
-    except Exception as e:
-        app.logger.error(f"Error fetching batch years: {str(e)}")
-        batch_years = ['2020-2024', '2021-2025', '2022-2026', '2023-2027', '2024-2028', '2025-2029', '2026-2030']  # Fallback
-    
-    try:
-        # Get fee types - simplified query
-        fee_types = [row[0] for row in db.session.query(FeeMaster.fee_type).distinct().all()]
-        if not fee_types:  # Fallback if no data
-            fee_types = ['CRT', 'Phase 2', 'Phase 3']
-    except Exception as e:
-        app.logger.error(f"Error fetching fee types: {str(e)}")
-        fee_types = ['CRT', 'Phase 2', 'Phase 3']  # Fallback
+    # Dropdown lists from the shared cache (no queries in the steady state)
+    options = filter_options.get()
+    batch_years = options['batch_years']
+    fee_types = options['fee_types']
     
     # Fixed branch list - always include these whether DB has data or not
     default_branches = ['CSE', 'IT', 'CSE-AI&DS', 'CSE-AI&ML', 'ECE', 'EEE', 'CE', 'ME']
     
-    try:
-        # Get branches from DB
-        db_branches = [row[0] for row in db.session.query(Student.branch).distinct().all()]
-        
-        # Combine DB branches with default branches, removing duplicates
-        branches = list(set(db_branches + default_branches))
-        branches.sort()  # Sort alphabetically
-    except Exception as e:
-        app.logger.error(f"Error fetching branches: {str(e)}")
-        branches = default_branches  # Fallback to default branches
-    
-    # Normalize fee type if provided
-    if fee_type:
-        fee_type = normalize_fee_type(fee_type)
+    # Combine DB branches with default branches, removing duplicates
+    branches = sorted(set(options['branches'] + default_branches))
     
     # Always query for records regardless of filters
+    history_stack = ExitStack()
     try:
+        if selection and not selection_exists(selection):
+            flash("The list of uploaded students has expired; showing all students.", "warning")
+            selection = ''
+        
+        # Archived batches live in their own file (see cold_storage.py), read only on request
+        cold_archive = archived_batch(batch_year)
+        history_session = None
+        if cold_archive is not None and history:
+            history_session = history_stack.enter_context(historical_session(cold_archive))
+            # Selections live in the hot database only, and archiving took the batch's
+            # students out of them
+            selection = ''
+        
         if display_type == 'student_details':
             # Query for student details only
-            query = db.session.query(
-                Student.batch_year,
+            query = join_student_names(db.session.query(
+                Batch.name.label('batch_year'),
                 Student.regd_no,
                 Student.name,
-                Student.branch,
+                Branch.name.label('branch'),
                 Student.mobile
-            )
+            ).select_from(Student))
             
             # Apply filters only if they are specified
             if batch_year:
-                query = query.filter(Student.batch_year == batch_year)
+                query = query.filter(Student.batch_id == id_of(Batch, batch_year))
             if regd_no:  # Add this filter for registration number
                 query = query.filter(Student.regd_no.like(f'%{regd_no}%'))
             if reg_numbers:
                 query = query.filter(Student.regd_no.in_(reg_numbers))
+            if selection:
+                query = join_selection(query, Student.id, selection)
             if student_name:
                 query = query.filter(Student.name.like(f'%{student_name}%'))
             if branch:
-                query = query.filter(Student.branch == branch)
+                query = query.filter(Student.branch_id == id_of(Branch, branch))
             
             # Execute the query to get the student data
+            if history_session is not None:
+                query = query.with_session(history_session)
             results = query.all()
             
             # Process the student results
@@ -1395,130 +1425,81 @@ def student_details():
                 })
             
         else:  # Default to payment_details
-            # Modified approach: Group by student first, then collect fee type information
-            # First, get all students matching our filters
-            student_query = db.session.query(
-                Student.batch_year,
+            # One query for every fee entry of the matching students, with what was paid against it
+            paid = paid_totals_subquery()
+            fee_query = join_student_names(db.session.query(
+                Batch.name.label('batch_year'),
                 Student.regd_no,
                 Student.name,
-                Student.branch
-            ).distinct()
+                Branch.name.label('branch'),
+                FeeMaster.fee_type_id,
+                FeeMaster.amount_paise,
+                FeeMaster.remarks,
+                db.func.coalesce(paid.c.paid_paise, 0).label('paid_paise')
+            ).select_from(Student)).join(
+                FeeMaster, FeeMaster.student_id == Student.id
+            ).outerjoin(
+                paid, paid_for_fee(paid)
+            )
             
             # Apply student-level filters
             if batch_year:
-                student_query = student_query.filter(Student.batch_year == batch_year)
+                fee_query = fee_query.filter(Student.batch_id == id_of(Batch, batch_year))
             if regd_no:  # Add this filter for registration number
-                student_query = student_query.filter(Student.regd_no.like(f'%{regd_no}%'))
+                fee_query = fee_query.filter(Student.regd_no.like(f'%{regd_no}%'))
             if reg_numbers:
-                student_query = student_query.filter(Student.regd_no.in_(reg_numbers))
+                fee_query = fee_query.filter(Student.regd_no.in_(reg_numbers))
+            if selection:
+                fee_query = join_selection(fee_query, Student.id, selection)
             if student_name:
-                student_query = student_query.filter(Student.name.like(f'%{student_name}%'))
+                fee_query = fee_query.filter(Student.name.like(f'%{student_name}%'))
             if branch:
-                student_query = student_query.filter(Student.branch == branch)
+                fee_query = fee_query.filter(Student.branch_id == id_of(Branch, branch))
+            if fee_type:
+                fee_query = fee_query.filter(FeeMaster.fee_type_id == fee_type_registry.lookup(fee_type))
+            
+            if history_session is not None:
+                fee_query = fee_query.with_session(history_session)
+            
+            # Group the fee entries by student, keeping the student order
+            records_by_regd_no = {}
+            for row in fee_query.order_by(Student.id, FeeMaster.id):
+                record = records_by_regd_no.get(row.regd_no)
+                if record is None:
+                    record = records_by_regd_no[row.regd_no] = {
+                        'batch_year': row.batch_year,
+                        'registration_number': row.regd_no,
+                        'name': row.name,
+                        'branch': row.branch,
+                        # Dictionary to hold fee type information for this student, keyed by label
+                        'fee_info': {
+                            label: {'amount': 0, 'paid': 0, 'status': 'Not Paid', 'remarks': ''}
+                            for label in fee_type_registry.labels()
+                        },
+                        'display_type': 'payment_details'
+                    }
+                
+                info = record['fee_info'].setdefault(
+                    fee_type_registry.label(row.fee_type_id),
+                    {'amount': 0, 'paid': 0, 'status': 'Not Paid', 'remarks': ''}
+                )
+                info['amount'] = from_paise(row.amount_paise)
+                info['remarks'] = row.remarks or ''
+                info['paid'] = from_paise(row.paid_paise)
                 
-            # Get all students matching our criteria
-            students = student_query.all()
+                # Amounts are integer paise, so an exact comparison is safe
+                if row.paid_paise >= row.amount_paise:
+                    info['status'] = 'Paid'
+                elif row.paid_paise > 0:
+                    info['status'] = 'Partially Paid'
+                else:
+                    info['status'] = 'Not Paid'
             
-            # For each student, get their fee and payment information
-            for student in students:
-                try:
-                    # Dictionary to hold fee type information for this student - using safer string keys
-                    fee_info = {
-                        'CRT': {'amount': 0, 'paid': 0, 'status': 'Not Paid', 'remarks': ''},
-                        'Phase 2': {'amount': 0, 'paid': 0, 'status': 'Not Paid', 'remarks': ''},
-                        'Phase 3': {'amount': 0, 'paid': 0, 'status': 'Not Paid', 'remarks': ''}
-                    }
-                    
-                    # Debug log
-                    app.logger.debug(f"Processing student: {student.regd_no}, Initial fee_info: {fee_info}")
-                    
-                    # Get all fee types for this student from FeeMaster
-                    fee_entries = db.session.query(
-                        FeeMaster.fee_type,
-                        FeeMaster.amount,
-                        FeeMaster.remarks
-                    ).filter(FeeMaster.regd_no == student.regd_no).all()
-                    
-                    # Skip student if they have no fee entries matching filter
-                    if fee_type and not any(fee_type.lower() in entry.fee_type.lower() for entry in fee_entries):
-                        continue
-                    
-                    # Process each fee entry
-                    for entry in fee_entries:
-                        std_fee_type = get_standardized_fee_type_label(entry.fee_type)
-                        
-                        # Skip if we're filtering by fee type and this doesn't match
-                        if fee_type and fee_type.lower() not in entry.fee_type.lower():
-                            continue
-                            
-                        if std_fee_type in fee_info:
-                            fee_info[std_fee_type]['amount'] = entry.amount
-                            fee_info[std_fee_type]['remarks'] = entry.remarks or ''
-                            
-                            # IMPROVED PAYMENT QUERY: Use normalized fee type matching for reliable results
-                            # First, get all possible normalized versions of this fee type
-                            normalized_entry_type = normalize_fee_type(entry.fee_type)
-                            fee_type_label = get_standardized_fee_type_label(entry.fee_type)
-                            
-                            app.logger.debug(f"FEE TYPE DEBUG - Original: '{entry.fee_type}', Normalized: '{normalized_entry_type}', Label: '{fee_type_label}'")
-                            
-                            # Get payment info for this fee type with more flexible matching
-                            payment = db.session.query(
-                                db.func.sum(Payment.amount_paid).label('total_paid')
-                            ).filter(
-                                Payment.regd_no == student.regd_no,
-                                # Use a broader matching approach with LIKE to match fee types
-                                db.func.lower(Payment.fee_type).like(f'%{normalized_entry_type}%')
-                            ).first()
-                            
-                            # More robust handling of the payment value
-                            total_paid = payment.total_paid if payment and payment.total_paid else 0
-                            fee_info[std_fee_type]['paid'] = total_paid
-                            
-                            # Enhanced debug logging
-                            app.logger.debug(f"Student: {student.regd_no}, Fee Type: {std_fee_type}")
-                            app.logger.debug(f"Amount (type {type(entry.amount)}): {entry.amount}")
-                            app.logger.debug(f"Total Paid (type {type(total_paid)}): {total_paid}")
-                            
-                            # Convert values to float with proper error handling
-                            try:
-                                entry_amount = float(entry.amount)
-                                paid_amount = float(total_paid)
-                                
-                                # Avoid floating point precision issues with a small epsilon
-                                if paid_amount >= (entry_amount - 0.01):
-                                    fee_info[std_fee_type]['status'] = 'Paid'
-                                    app.logger.debug(f"✅ Status set to PAID: {paid_amount} >= {entry_amount}")
-                                elif paid_amount > 0:
-                                    fee_info[std_fee_type]['status'] = 'Partially Paid'
-                                    app.logger.debug(f"⚠️ Status set to PARTIALLY PAID: 0 < {paid_amount} < {entry_amount}")
-                                else:
-                                    fee_info[std_fee_type]['status'] = 'Not Paid'
-                                    app.logger.debug(f"❌ Status set to NOT PAID: {paid_amount} <= 0")
-                            except (ValueError, TypeError) as e:
-                                app.logger.error(f"Error converting payment values to float: {str(e)}")
-                                # Default to Not Paid on conversion error, but log it
-                                fee_info[std_fee_type]['status'] = 'Not Paid'
-                    
-                    # Only include students with at least one fee type that's not zero amount
-                    has_fee_data = any(info['amount'] > 0 for info in fee_info.values())
-                    if not has_fee_data:
-                        continue
-                    
-                    # Add student record with fee information for all types
-                    student_records.append({
-                        'batch_year': student.batch_year,
-                        'registration_number': student.regd_no,
-                        'name': student.name,
-                        'branch': student.branch,
-                        'fee_info': fee_info,
-                        'display_type': 'payment_details'
-                    })
-                    
-                except Exception as student_error:
-                    app.logger.error(f"Error processing student {student.regd_no}: {str(student_error)}")
-                    import traceback
-                    app.logger.error(traceback.format_exc())
+            # Only include students with at least one fee type that's not zero amount
+            student_records = [
+                record for record in records_by_regd_no.values()
+                if any(info['amount'] > 0 for info in record['fee_info'].values())
+            ]
             
             # Apply payment status filter if specified
             if payment_status:
@@ -1537,7 +1518,7 @@ def student_details():
             flash("No student records found matching your criteria", "warning")
         
         # Debug final output
-        app.logger.debug(f"Final student_records count: {len(student_records)}")
+        current_app.logger.debug("Final student_records count: %d", len(student_records))
         
         # Render the template with all data
         return render_template('student_details.html', 
@@ -1552,16 +1533,20 @@ def student_details():
                               selected_student_name=student_name, 
                               selected_branch=branch, 
                               selected_display_type=display_type,  # Add the new parameter
-                              highlight_new=len(reg_numbers) > 0)  # Highlight if we came from upload with specific reg_numbers
+                              highlight_new=bool(reg_numbers or selection),  # Highlight if we came from upload with specific students
+                              cold_archive=cold_archive,
+                              showing_history=history_session is not None)
     
     except Exception as e:
-        app.logger.error(f"Error retrieving student details: {str(e)}")
+        current_app.logger.error("Error retrieving student details: %s", e)
         import traceback
-        app.logger.error(traceback.format_exc())
+        current_app.logger.error(traceback.format_exc())
         flash(f"Error retrieving student details: {str(e)}", "error")
         return render_template('student_details.html', error=str(e))
+    finally:
+        history_stack.close()
 
-@app.route('/unpaid_students', methods=['GET'])
+@bp.route('/unpaid_students', methods=['GET'])
 def unpaid_students():
     """Retrieve students with unpaid fees based on filters"""
     # Get filter parameters
@@ -1578,121 +1563,83 @@ def unpaid_students():
     
     try:
         # Get filter options
-        batch_years = [year[0] for year in db.session.query(Student.batch_year).distinct().order_by(Student.batch_year).all()]
-        fee_types = ['CRT', 'Phase 2', 'Phase 3']  # Standard fee types
-        branches = [branch[0] for branch in db.session.query(Student.branch).distinct().order_by(Student.branch).all()]
-        
-        # Normalize fee type if provided
-        normalized_fee_type = normalize_fee_type(fee_type) if fee_type else None
-        
-        # Base query to get all students
-        student_query = db.session.query(
+        options = filter_options.get()
+        batch_years = options['batch_years']
+        fee_types = options['fee_types']
+        branches = options['branches']
+        
+        # Fee entries with what was paid against them, filtered by payment status in SQL
+        paid = paid_totals_subquery()
+        paid_paise = db.func.coalesce(paid.c.paid_paise, 0)
+        fee_query = join_student_names(db.session.query(
             Student.regd_no,
             Student.name,
-            Student.batch_year,
-            Student.branch,
-            Student.mobile
+            Batch.name.label('batch_year'),
+            Branch.name.label('branch'),
+            Student.mobile,
+            FeeMaster.fee_type_id,
+            FeeMaster.amount_paise,
+            FeeMaster.remarks,
+            paid_paise.label('paid_paise')
+        ).select_from(Student)).join(
+            FeeMaster, FeeMaster.student_id == Student.id
+        ).outerjoin(
+            paid, paid_for_fee(paid)
         )
         
         # Apply filters to student query
         if batch_year:
-            student_query = student_query.filter(Student.batch_year == batch_year)
+            fee_query = fee_query.filter(Student.batch_id == id_of(Batch, batch_year))
         if branch:
-            student_query = student_query.filter(Student.branch == branch)
-        
-        students = student_query.all()
+            fee_query = fee_query.filter(Student.branch_id == id_of(Branch, branch))
+        if fee_type:
+            fee_query = fee_query.filter(FeeMaster.fee_type_id == fee_type_registry.lookup(fee_type))
+        
+        # Check if this student matches our payment status filter
+        if payment_status == 'not_paid':
+            fee_query = fee_query.filter(paid_paise == 0)
+        elif payment_status == 'partially_paid':
+            fee_query = fee_query.filter(paid_paise > 0, paid_paise < FeeMaster.amount_paise)
+        elif payment_status == 'all':
+            fee_query = fee_query.filter(paid_paise < FeeMaster.amount_paise)
+        else:
+            fee_query = fee_query.filter(db.false())
         
-        # Key is student registration number + standardized fee type, value is the student record
+        # Key is student registration number + fee type label, value is the student record
         unpaid_students_dict = {}
-    
-        for student in students:
-            # Track which standardized fee types have been processed for this student
-            processed_std_fee_types = set()
+        
+        for row in fee_query.order_by(Student.id, FeeMaster.id):
+            std_fee_type = fee_type_registry.label(row.fee_type_id)
             
-            # Determine which fee types to check
-            fee_types_to_check = [normalize_fee_type(fee_type)] if fee_type else [normalize_fee_type(ft) for ft in fee_types]
+            # Create a unique key using registration number and fee type label;
+            # the first fee entry of a type wins
+            key = f"{row.regd_no}_{std_fee_type}"
+            if key in unpaid_students_dict:
+                continue
             
-            for normalized_type in fee_types_to_check:
-                # Safely retrieve fee entries for this normalized type
-                fee_entries = db.session.query(
-                    FeeMaster.fee_type,
-                    FeeMaster.amount,
-                    FeeMaster.remarks
-                ).filter(
-                    FeeMaster.regd_no == student.regd_no,
-                    db.func.lower(FeeMaster.fee_type).like(f'%{normalized_type}%')
-                ).all()
-                
-                # Process each fee entry
-                for fee_entry in fee_entries:
-                    # Get standardized fee type label
-                    std_fee_type = get_standardized_fee_type_label(fee_entry.fee_type)
-                    
-                    # Skip if we've already processed this standardized fee type for this student
-                    if std_fee_type in processed_std_fee_types:
-                        continue
-                    
-                    # Mark as processed
-                    processed_std_fee_types.add(std_fee_type)
-                    
-                    # Get paid amount for this fee type
-                    payment = db.session.query(
-                        db.func.sum(Payment.amount_paid).label('total_paid')
-                    ).filter(
-                        db.func.lower(Payment.fee_type).like(f'%{normalized_type}%')
-                    ).first()
-                    
-                    # Set default paid amount to 0 if no payment exists
-                    paid_amount = payment.total_paid if payment and payment.total_paid else 0
-                    
-                    # Convert to float to ensure proper math operations
-                    try:
-                        fee_amount = float(fee_entry.amount)
-                        paid_amount = float(paid_amount)
-                    except (ValueError, TypeError):
-                        app.logger.warning(f"Invalid amount value for student {student.regd_no}, fee type {fee_entry.fee_type}")
-                        fee_amount = 0
-                        paid_amount = 0
-                    
-                    # Determine payment status
-                    is_not_paid = paid_amount == 0
-                    is_partially_paid = 0 < paid_amount < fee_amount
-                    
-                    # Check if this student matches our payment status filter
-                    should_include = (
-                        (payment_status == 'not_paid' and is_not_paid) or 
-                        (payment_status == 'partially_paid' and is_partially_paid) or
-                        (payment_status == 'all' and (is_not_paid or is_partially_paid))
-                    )
-                    
-                    if should_include:
-                        # Create a unique key using registration number and standardized fee type
-                        key = f"{student.regd_no}_{std_fee_type}"
-                        
-                        # Create student record
-                        student_record = {
-                            'regd_no': student.regd_no,
-                            'name': student.name,
-                            'batch_year': student.batch_year,
-                            'branch': student.branch,
-                            'mobile': student.mobile,
-                            'fee_type': std_fee_type,
-                            'total_amount': fee_amount,
-                            'paid_amount': paid_amount,
-                            'remaining': fee_amount - paid_amount,
-                            'payment_status': 'Partially Paid' if paid_amount > 0 else 'Not Paid',
-                            'remarks': fee_entry.remarks or ''
-                        }
-                        unpaid_students_dict[key] = student_record
+            unpaid_students_dict[key] = {
+                'regd_no': row.regd_no,
+                'name': row.name,
+                'batch_year': row.batch_year,
+                'branch': row.branch,
+                'mobile': row.mobile,
+                'fee_type': std_fee_type,
+                'total_amount': from_paise(row.amount_paise),
+                'paid_amount': from_paise(row.paid_paise),
+                'remaining': from_paise(row.amount_paise - row.paid_paise),
+                'payment_status': 'Partially Paid' if row.paid_paise > 0 else 'Not Paid',
+                'remarks': row.remarks or ''
+            }
         
         # Convert dictionary to list
         unpaid_students_list = list(unpaid_students_dict.values())
+        note_rows(len(unpaid_students_list))
         
         # Sort by batch_year, registration number, and fee type
         unpaid_students_list.sort(key=lambda x: (x['batch_year'], x['regd_no'], x['fee_type']))
         
         # Debug logging
-        app.logger.info(f"Found {len(unpaid_students_list)} records with payment status: {payment_status}")
+        current_app.logger.info("Found %d records with payment status: %s", len(unpaid_students_list), payment_status)
         
         # If no students found, show message (unless downloading)
         if not unpaid_students_list and not (download_excel or download_csv):
@@ -1716,10 +1663,10 @@ def unpaid_students():
                             selected_payment_status=payment_status)
                             
     except Exception as e:
-        app.logger.error(f"Error retrieving unpaid students: {str(e)}")
+        current_app.logger.error(f"Error retrieving unpaid students: {str(e)}")
         import traceback
         traceback_str = traceback.format_exc()
-        app.logger.error(traceback_str)
+        current_app.logger.error(traceback_str)
         flash(f"Error retrieving unpaid students: {str(e)}", "error")
         # Include debug info in the template for development
         return render_template('unpaid_students.html', 
@@ -1728,13 +1675,75 @@ def unpaid_students():
                               batch_years=[],
                               fee_types=[],
                               branches=[],
-                              debug_info=traceback_str if app.config.get('DEBUG', False) else None)
+                              debug_info=traceback_str if current_app.config.get('DEBUG', False) else None)
+
+REPORT_COLUMNS = ['Registration No', 'Name', 'Batch Year', 'Branch',
+                  'Mobile', 'Fee Type', 'Total Amount', 'Payment Status', 'Remarks']
+
+def _report_filename(batch_year, branch, payment_status, extension):
+    """Download name of an unpaid students report, e.g. Unpaid_Students_Batch2022-2026_CSE_NotPaid_<time>.csv"""
+    # Generate timestamp for filename
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    
+    # Create filter description for filename
+    filter_desc = []
+    if batch_year:
+        filter_desc.append(f"Batch{batch_year}")
+    if branch:
+        filter_desc.append(f"{branch}")
+    if payment_status != 'all':
+        status_label = "NotPaid" if payment_status == 'not_paid' else "PartiallyPaid"
+        filter_desc.append(status_label)
+    
+    filter_str = "_".join(filter_desc) if filter_desc else "All"
+    return f"Unpaid_Students_{filter_str}_{timestamp}.{extension}"
+
+def generate_excel_report(unpaid_students_list, batch_year, branch, payment_status):
+    """Generate Excel report of unpaid students, with the same columns as the CSV report"""
+    import xlsxwriter
+    
+    output = BytesIO()
+    # Rows are written straight to the file instead of being kept for the whole sheet
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    worksheet = workbook.add_worksheet('Unpaid Students')
+    header_format = workbook.add_format({
+        'bold': True,
+        'text_wrap': True,
+        'valign': 'top',
+        'fg_color': '#D7E4BC',
+        'border': 1
+    })
+    money_format = workbook.add_format({'num_format': '#,##0.00'})
+    worksheet.set_column(0, len(REPORT_COLUMNS) - 1, 15)
+    worksheet.set_column(6, 6, 15, money_format)
+    worksheet.write_row(0, 0, REPORT_COLUMNS, header_format)
+    
+    for row_num, student in enumerate(unpaid_students_list, start=1):
+        worksheet.write_row(row_num, 0, [
+            student['regd_no'],
+            student['name'],
+            student['batch_year'],
+            student['branch'],
+            student['mobile'] or '',
+            student['fee_type'],
+            student['total_amount'],
+            student['payment_status'],
+            student['remarks']
+        ])
+    workbook.close()
+    output.seek(0)
+    
+    return send_file(
+        output,
+        mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        as_attachment=True,
+        download_name=_report_filename(batch_year, branch, payment_status, 'xlsx')
+    )
 
 def generate_csv_report(unpaid_students_list, batch_year, branch, payment_status):
     """Generate CSV report of unpaid students"""
     import csv
     from io import StringIO
-    from datetime import datetime
     from flask import Response
     
     # Create a string buffer to write CSV data
@@ -1742,8 +1751,7 @@ def generate_csv_report(unpaid_students_list, batch_year, branch, payment_status
     writer = csv.writer(output)
     
     # Write header row
-    writer.writerow(['Registration No', 'Name', 'Batch Year', 'Branch', 
-                     'Mobile', 'Fee Type', 'Total Amount', 'Payment Status', 'Remarks'])
+    writer.writerow(REPORT_COLUMNS)
     
     # Write data rows
     for student in unpaid_students_list:
@@ -1759,23 +1767,7 @@ def generate_csv_report(unpaid_students_list, batch_year, branch, payment_status
             student['remarks']
         ])
     
-    # Generate timestamp for filename
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    
-    # Create filter description for filename
-    filter_desc = []
-    if batch_year:
-        filter_desc.append(f"Batch{batch_year}")
-    if branch:
-        filter_desc.append(f"{branch}")
-    if payment_status != 'all':
-        status_label = "NotPaid" if payment_status == 'not_paid' else "PartiallyPaid"
-        filter_desc.append(status_label)
-    
-    filter_str = "_".join(filter_desc) if filter_desc else "All"
-    
-    # Create filename
-    filename = f"Unpaid_Students_{filter_str}_{timestamp}.csv"
+    filename = _report_filename(batch_year, branch, payment_status, 'csv')
     
     # Create response with CSV data
     return Response(
@@ -1784,14 +1776,54 @@ def generate_csv_report(unpaid_students_list, batch_year, branch, payment_status
         headers={"Content-disposition": f"attachment; filename={filename}"}
     )
 
-@app.route('/logout')
+@bp.route('/export/snapshot', methods=['GET'])
+@login_required
+def export_snapshot():
+    """Download a zipped columnar snapshot of the whole fee ledger"""
+    import tempfile
+    import zipfile
+    from export_snapshot import write_snapshot, SNAPSHOT_FORMATS
+
+    file_format = request.args.get('format', 'parquet')
+    if file_format not in SNAPSHOT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {file_format}'}), 400
+
+    try:
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        # The archive is spooled to disk so large snapshots never sit in memory
+        archive = tempfile.TemporaryFile()
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            manifest = write_snapshot(snapshot_dir, file_format)
+            # Parquet/Arrow files are already compressed, so store them as-is
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_STORED) as zf:
+                zf.write(os.path.join(snapshot_dir, 'manifest.json'), 'manifest.json')
+                for info in manifest['files'].values():
+                    zf.write(os.path.join(snapshot_dir, info['path']), info['path'])
+        archive.seek(0)
+        note_rows(sum(info['rows'] for info in manifest['files'].values()))
+
+        current_app.logger.info("Snapshot export (%s): %s", file_format,
+                                ", ".join(f"{name}={info['rows']}" for name, info in manifest['files'].items()))
+        return send_file(
+            archive,
+            mimetype='application/zip',
+            as_attachment=True,
+            download_name=f'fee_ledger_snapshot_{timestamp}.zip'
+        )
+    except Exception as e:
+        current_app.logger.error(f"Error exporting snapshot: {str(e)}")
+        import traceback
+        current_app.logger.error(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash('You have been logged out', 'info')
-    return redirect(url_for('admin_login'))
+    return redirect(url_for('main.admin_login'))
 
-@app.route('/chart-debug')
+@bp.route('/chart-debug')
 def chart_debug():
     """Helper route to debug chart generation"""
     try:
@@ -1815,7 +1847,7 @@ def chart_debug():
             "traceback": traceback.format_exc()
         })
 
-@app.route('/update_remarks', methods=['POST'])
+@bp.route('/update_remarks', methods=['POST'])
 @login_required
 def update_remarks():
     """Update remarks for a student's fee entry"""
@@ -1837,13 +1869,12 @@ def update_remarks():
         
         # If fee_type is 'all', update remarks for all fee types for this student
         if fee_type == 'all':
-            fee_entries = FeeMaster.query.filter_by(regd_no=reg_no).all()
+            fee_entries = FeeMaster.query.filter(FeeMaster.student_id == student_id_of(reg_no)).all()
         else:
-            # If specific fee type, use the normalized fee type for matching
-            normalized_fee_type = normalize_fee_type(fee_type)
+            # If specific fee type, match it through the registry
             fee_entries = FeeMaster.query.filter(
-                FeeMaster.regd_no == reg_no,
-                db.func.lower(FeeMaster.fee_type).like(f'%{normalized_fee_type}%')
+                FeeMaster.student_id == student_id_of(reg_no),
+                FeeMaster.fee_type_id == fee_type_registry.lookup(fee_type)
             ).all()
         
         if not fee_entries:
@@ -1858,21 +1889,31 @@ def update_remarks():
         return jsonify({'success': True})
     except Exception as e:
         db.session.rollback()
-        app.logger.error(f"Error updating remarks: {str(e)}")
+        current_app.logger.error(f"Error updating remarks: {str(e)}")
         import traceback
-        app.logger.error(traceback.format_exc())
+        current_app.logger.error(traceback.format_exc())
         return jsonify({'success': False, 'error': str(e)})
 
-@app.errorhandler(404)
+@bp.app_errorhandler(404)
 def page_not_found(e):
     return render_template('404.html'), 404
 
-@app.errorhandler(500)
+@bp.app_errorhandler(500)
 def internal_server_error(e):
-    app.logger.error(f"500 error: {str(e)}")
+    current_app.logger.error(f"500 error: {str(e)}")
     return render_template('500.html'), 500
 
-@app.route('/api/students', methods=['GET'])
+@bp.route('/metrics')
+def prometheus_metrics():
+    """Prometheus scrape endpoint (see metrics.py); FEE_METRICS_TOKEN makes it require a bearer token"""
+    if not current_app.config['METRICS']:
+        return render_template('404.html'), 404
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        return Response('Unauthorized\n', status=401, mimetype='text/plain')
+    return Response(render_metrics(), content_type=METRICS_CONTENT_TYPE)
+
+@bp.route('/api/students', methods=['GET'])
 @login_required
 def api_students():
     """API endpoint to search for students by registration number or name"""
@@ -1881,17 +1922,8 @@ def api_students():
         return jsonify([])
     
     try:
-        # Search for students matching the query in either reg_no or name
-        students = db.session.query(
-            Student.regd_no,
-            Student.name,
-            Student.batch_year
-        ).filter(
-            db.or_(
-                Student.regd_no.like(f'%{query}%'),
-                Student.name.like(f'%{query}%')
-            )
-        ).limit(10).all()
+        # Trigram index lookup, prefix matches first (see student_search.py)
+        students = student_search.search(query, limit=10)
         
         # Convert to list of dicts
         result = [
@@ -1900,10 +1932,10 @@ def api_students():
         ]
         return jsonify(result)
     except Exception as e:
-        app.logger.error(f"Error searching for students: {str(e)}")
+        current_app.logger.error(f"Error searching for students: {str(e)}")
         return jsonify([])
 
-@app.route('/api/student-fees', methods=['GET'])
+@bp.route('/api/student-fees', methods=['GET'])
 @login_required
 def api_student_fees():
     """API endpoint to get fee information for a specific student"""
@@ -1912,118 +1944,118 @@ def api_student_fees():
         return jsonify([])
     
     try:
-        # Get all fee entries for this student
+        # All fee entries for this student with the total paid against each
+        student_id = student_id_of(regd_no)
+        paid = paid_totals_subquery(Payment.student_id == student_id)
         fee_entries = db.session.query(
-            FeeMaster.fee_type,
-            FeeMaster.amount,
-            FeeMaster.remarks
+            FeeMaster.fee_type_id,
+            FeeMaster.amount_paise,
+            FeeMaster.remarks,
+            db.func.coalesce(paid.c.paid_paise, 0).label('paid_paise')
+        ).outerjoin(
+            paid, paid.c.fee_type_id == FeeMaster.fee_type_id
         ).filter(
-            FeeMaster.regd_no == regd_no
-        ).all()
+            FeeMaster.student_id == student_id
+        ).order_by(FeeMaster.id).all()
         
         results = []
-        
-        # For each fee entry, get paid amount and calculate remaining
         for entry in fee_entries:
-            fee_type = entry.fee_type
-            normalized_type = normalize_fee_type(fee_type)
-            display_name = get_standardized_fee_type_label(fee_type)
-            
-            # Get total paid amount for this fee type
-            payment = db.session.query(
-                db.func.sum(Payment.amount_paid).label('total_paid')
-            ).filter(
-                db.func.lower(Payment.fee_type).like(f'%{normalized_type}%')
-            ).first()
-            
-            paid_amount = payment.total_paid if payment and payment.total_paid else 0
-            
             results.append({
-                'fee_type': fee_type,
-                'fee_type_display': display_name,
-                'amount': float(entry.amount),
-                'paid_amount': float(paid_amount),
+                'fee_type': fee_type_registry.code(entry.fee_type_id),
+                'fee_type_display': fee_type_registry.label(entry.fee_type_id),
+                'amount': from_paise(entry.amount_paise),
+                'paid_amount': from_paise(entry.paid_paise),
                 'remarks': entry.remarks or ''
             })
         
         return jsonify(results)
     except Exception as e:
-        app.logger.error(f"Error getting student fees: {str(e)}")
+        current_app.logger.error(f"Error getting student fees: {str(e)}")
         return jsonify([])
 
-@app.route('/debug-chart-data')
+@bp.route('/api/filter-options', methods=['GET'])
+@login_required
+def api_filter_options():
+    """Batch years, branches and fee types for filter dropdowns, cached per process"""
+    options = filter_options.get()
+    response = jsonify(options)
+    # Same lists give the same ETag in every worker, so browsers can revalidate cheaply
+    response.set_etag(options['version'])
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@bp.route('/api/student-index', methods=['GET'])
+@login_required
+def api_student_index():
+    """Size and freshness of this worker's in-memory registration number index"""
+    return jsonify(student_index.stats())
+
+@bp.route('/admin/query-stats', methods=['GET', 'POST'])
+@login_required
+def admin_query_stats():
+    """Query counts and SQL time per endpoint over this worker's recent requests; POST clears them"""
+    if request.method == 'POST':
+        query_report.reset()
+    return jsonify(query_report.summary())
+
+@bp.route('/admin/slow-requests')
+@login_required
+def admin_slow_requests():
+    """Newest slow-request records (see slow_log.py): route, args, per-statement SQL timings and query plans"""
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify({
+        'threshold_ms': current_app.config['SLOW_REQUEST_MS'] if current_app.config['QUERY_STATS'] else None,
+        'requests': recent_slow_requests(limit),
+    })
+
+@bp.route('/admin/profiles')
+@login_required
+def admin_profiles():
+    """Recent request profiles (add ?__profile=1 to a page to make one)"""
+    return render_template('profiles.html', profiles=recent_profiles(),
+                           sample_rate=current_app.config.get('PROFILE_SAMPLE_RATE', 0))
+
+@bp.route('/admin/profiles/<name>/<kind>')
+@login_required
+def admin_profile_file(name, kind):
+    """Download a profile's .prof (pstats), .collapsed (flamegraph) or .json file"""
+    path = profile_file(name, kind)
+    if path is None:
+        return render_template('404.html'), 404
+    return send_file(path, as_attachment=True, download_name=os.path.basename(path))
+
+@bp.route('/admin/memory')
 @login_required
-def debug_chart_data():
-    """Debug endpoint to show raw data behind charts"""
+def admin_memory_profiles():
+    """Recent memory profiles of uploads and exports (see memory_profile.py)"""
+    return render_template('memory_profiles.html', profiles=recent_memory_profiles(),
+                           enabled=current_app.config.get('MEMORY_PROFILE', False))
+
+@bp.route('/api/changes', methods=['GET'])
+@login_required
+def api_changes():
+    """Change feed of student, fee and payment rows as JSON Lines, paged by cursor"""
+    from change_feed import read_changes, to_json_lines, DEFAULT_PAGE_SIZE
+
     try:
-        # Query payments data similar to what's used in charts
-        payments_query = db.session.query(
-            Student.batch_year,
-            Payment.fee_type,
-            db.func.sum(Payment.amount_paid).label('total_paid')
-        ).join(
-            Student, 
-            Payment.regd_no == Student.regd_no
-        ).filter(
-            Student.batch_year == '2023-2027',
-            db.func.lower(Payment.fee_type).like('%crt%')
-        ).group_by(
-            Student.batch_year,
-            Payment.fee_type
-        ).all()
-        
-        # Format the results for display
-        results = []
-        for row in payments_query:
-            std_fee_type = get_standardized_fee_type_label(row.fee_type)
-            results.append({
-                'batch_year': row.batch_year,
-                'fee_type': row.fee_type,
-                'standardized_fee_type': std_fee_type,
-                'amount_paid': float(row.total_paid)
-            })
-        
-        # Also include the individual payments that make up these totals
-        detailed_payments = db.session.query(
-            Student.batch_year,
-            Student.regd_no,
-            Student.name,
-            Payment.fee_type,
-            Payment.amount_paid,
-            Payment.date
-        ).join(
-            Student,
-            Payment.regd_no == Student.regd_no
-        ).filter(
-            Student.batch_year == '2023-2027',
-            db.func.lower(Payment.fee_type).like('%crt%')
-        ).order_by(
-            Payment.date
-        ).all()
-        
-        payment_details = [
-            {
-                'batch_year': p.batch_year,
-                'regd_no': p.regd_no,
-                'name': p.name,
-                'fee_type': p.fee_type,
-                'amount': float(p.amount_paid),
-                'date': p.date.strftime('%Y-%m-%d') if p.date else "Unknown"
-            }
-            for p in detailed_payments
-        ]
-        
-        return render_template('debug_chart.html', 
-                              summary_data=results, 
-                              payment_details=payment_details)
-        
+        since = int(request.args.get('since', 0))
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'since and limit must be integers'}), 400
+
+    try:
+        changes, next_cursor, has_more = read_changes(since, limit)
+        response = Response(to_json_lines(changes), mimetype='application/x-ndjson')
+        # Clients resume from X-Next-Cursor until X-Has-More is false
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+        response.headers['X-Has-More'] = 'true' if has_more else 'false'
+        return response
     except Exception as e:
-        app.logger.error(f"Error in debug chart data: {str(e)}")
-        import traceback
-        app.logger.error(traceback.format_exc())
-        return jsonify({'error': str(e), 'traceback': traceback.format_exc()})
+        current_app.logger.error(f"Error reading change feed: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
-@app.route('/api/calculate-distribution', methods=['POST'])
+@bp.route('/api/calculate-distribution', methods=['POST'])
 @login_required
 def calculate_distribution():
     """Calculate how a payment amount would be distributed"""
@@ -2035,96 +2067,82 @@ def calculate_distribution():
         
         regd_no = data.get('regd_no')
         fee_types = data.get('fee_types', [])
-        total_amount = float(data.get('amount', 0))
+        total_paise = to_paise(data.get('amount', 0))
         
         if not regd_no or not fee_types:
             return jsonify({'error': 'Missing required parameters'}), 400
         
+        # Registry ids of the selected fee types, in the order they were selected
+        fee_type_ids = []
+        for fee_type in fee_types:
+            fee_type_id = fee_type_registry.lookup(fee_type)
+            if fee_type_id is not None and fee_type_id not in fee_type_ids:
+                fee_type_ids.append(fee_type_id)
+        
+        # Fee master entries with existing payments for the selected fee types, in one query
+        student_id = student_id_of(regd_no)
+        paid = paid_totals_subquery(Payment.student_id == student_id)
+        fee_entries = {}
+        for entry in db.session.query(
+            FeeMaster.fee_type_id,
+            FeeMaster.amount_paise,
+            db.func.coalesce(paid.c.paid_paise, 0).label('paid_paise')
+        ).outerjoin(
+            paid, paid.c.fee_type_id == FeeMaster.fee_type_id
+        ).filter(
+            FeeMaster.student_id == student_id,
+            FeeMaster.fee_type_id.in_(fee_type_ids)
+        ).order_by(FeeMaster.id):
+            fee_entries.setdefault(entry.fee_type_id, entry)
+        
         # Get fee details for the selected fee types
         fee_details = []
-        total_fee_amount = 0
-        
-        for fee_type in fee_types:
-            normalized_type = normalize_fee_type(fee_type)
-            
-            # Get fee master entry
-            fee_entry = db.session.query(
-                FeeMaster.fee_type,
-                FeeMaster.amount
-            ).filter(
-                FeeMaster.regd_no == regd_no,
-                db.func.lower(FeeMaster.fee_type).like(f'%{normalized_type}%')
-            ).first()
-            
+        for fee_type_id in fee_type_ids:
+            fee_entry = fee_entries.get(fee_type_id)
             if fee_entry:
-                fee_amount = float(fee_entry.amount)
-                total_fee_amount += fee_amount
-                
-                # Get existing payments
-                payment = db.session.query(
-                    db.func.sum(Payment.amount_paid).label('total_paid')
-                ).filter(
-                    Payment.regd_no == regd_no,
-                    db.func.lower(Payment.fee_type).like(f'%{normalized_type}%')
-                ).first()
-                
-                paid_amount = payment.total_paid if payment and payment.total_paid else 0
-                
                 fee_details.append({
-                    'fee_type': fee_entry.fee_type,
-                    'display_name': get_standardized_fee_type_label(fee_entry.fee_type),
-                    'amount': fee_amount,
-                    'paid': float(paid_amount),
-                    'remaining': max(0, fee_amount - float(paid_amount))
+                    'fee_type': fee_type_registry.code(fee_type_id),
+                    'display_name': fee_type_registry.label(fee_type_id),
+                    'amount_paise': fee_entry.amount_paise,
+                    'paid_paise': fee_entry.paid_paise
                 })
         
-        # Calculate distribution based on original fee amounts, not remaining amounts
-        distribution = []
-        total_distributed = 0
+        # Calculate distribution based on original fee amounts, not remaining amounts.
+        # Shares are whole paise and the last one takes the remainder.
+        total_fee_paise = sum(fee['amount_paise'] for fee in fee_details)
+        shares = split_paise(total_paise, [fee['amount_paise'] for fee in fee_details])
         
-        for i, fee in enumerate(fee_details):
-            if total_fee_amount > 0:
-                proportion = fee['amount'] / total_fee_amount
-                distributed_amount = round(total_amount * proportion, 2)
-            else:
-                # Equal distribution as fallback
-                distributed_amount = round(total_amount / len(fee_details), 2)
-            
-            # Last item gets the remainder to avoid rounding issues
-            if i == len(fee_details) - 1:
-                distributed_amount = round(total_amount - total_distributed, 2)
-                
-            total_distributed += distributed_amount
-            
+        distribution = []
+        for fee, share in zip(fee_details, shares):
             distribution.append({
                 'fee_type': fee['fee_type'],
                 'display_name': fee['display_name'],
-                'original_amount': fee['amount'],
-                'paid_amount': fee['paid'],
-                'remaining': fee['remaining'],
-                'proportion': fee['amount'] / total_fee_amount if total_fee_amount > 0 else 0,
-                'distribution': distributed_amount
+                'original_amount': from_paise(fee['amount_paise']),
+                'paid_amount': from_paise(fee['paid_paise']),
+                'remaining': from_paise(max(0, fee['amount_paise'] - fee['paid_paise'])),
+                'proportion': fee['amount_paise'] / total_fee_paise if total_fee_paise > 0 else 0,
+                'distribution': from_paise(share)
             })
         
         return jsonify({
             'success': True,
-            'total_amount': total_amount,
-            'total_fee_amount': total_fee_amount,
+            'total_amount': from_paise(total_paise),
+            'total_fee_amount': from_paise(total_fee_paise),
             'distribution': distribution
         })
         
     except Exception as e:
-        app.logger.error(f"Error calculating distribution: {str(e)}")
+        current_app.logger.error(f"Error calculating distribution: {str(e)}")
         import traceback
-        app.logger.error(traceback.format_exc())
+        current_app.logger.error(traceback.format_exc())
         return jsonify({'error': str(e)}), 500
     
 
-@app.route('/admin/login', methods=['GET', 'POST'])
+@bp.route('/admin/login', methods=['GET', 'POST'])
 def admin_login():
     # If already logged in, redirect to dashboard
     if current_user.is_authenticated:
-        return redirect(url_for('dashboard'))
+        return redirect(url_for('main.dashboard'))
         
     if request.method == 'POST':
         username = request.form.get('username')
@@ -2140,13 +2158,13 @@ def admin_login():
             db.session.commit()
             
             flash('Admin login successful', 'success')
-            return redirect(url_for('dashboard'))
+            return redirect(url_for('main.dashboard'))
         else:
             flash('Invalid admin credentials', 'danger')
     
     return render_template('admin_login.html')  # Fix the template name - there was a typo with "admin_login=.html"'
 
-@app.route('/api/registrations-by-batch', methods=['GET'])
+@bp.route('/api/registrations-by-batch', methods=['GET'])
 @login_required
 def get_registrations_by_batch():
     """API endpoint to get all registration numbers for a specific batch year"""
@@ -2155,15 +2173,8 @@ def get_registrations_by_batch():
         if not batch_year:
             return jsonify([])
         
-        # Query students by batch year
-        students = db.session.query(
-            Student.regd_no,
-            Student.name
-        ).filter(
-            Student.batch_year == batch_year
-        ).order_by(
-            Student.name
-        ).all()
+        # Students of the batch ordered by name, from the in-memory index
+        students = student_index.batch(batch_year)
         
         # Convert to list of dicts
         result = [
@@ -2173,10 +2184,10 @@ def get_registrations_by_batch():
         
         return jsonify(result)
     except Exception as e:
-        app.logger.error(f"Error fetching registration numbers: {str(e)}")
+        current_app.logger.error(f"Error fetching registration numbers: {str(e)}")
         return jsonify([])
 
-@app.route('/delete_paid_students', methods=['GET', 'POST'])
+@bp.route('/delete_paid_students', methods=['GET', 'POST'])
 @login_required
 def delete_paid_students():
     if request.method == 'POST':
@@ -2188,101 +2199,74 @@ def delete_paid_students():
             
             if not confirm:
                 flash('Please confirm deletion by checking the confirmation box.', 'warning')
-                return redirect(url_for('delete_paid_students'))
+                return redirect(url_for('main.delete_paid_students'))
             
-            # Step 1: Find all fee master entries for fully paid students
-            fee_entries_query = FeeMaster.query
-            
-            # Apply batch year filter if provided
+            # Resolve the filters to ids; an unknown name matches nothing
+            batch_id = fee_type_id = None
             if batch_year:
-                fee_entries_query = fee_entries_query.join(
-                    Student, 
-                    FeeMaster.regd_no == Student.regd_no
-                ).filter(Student.batch_year == batch_year)
-            
-            # Apply fee type filter if provided
+                batch_id = db.session.query(Batch.id).filter(Batch.name == batch_year).scalar() or -1
             if fee_type:
-                normalized_fee_type = normalize_fee_type(fee_type)
-                fee_entries_query = fee_entries_query.filter(
-                    db.func.lower(FeeMaster.fee_type).like(f'%{normalized_fee_type}%')
-                )
-            
-            # Get all fee entries
-            fee_entries = fee_entries_query.all()
-            
-            # Track which entries are fully paid
-            fully_paid_entries = []
-            
-            for entry in fee_entries:
-                fee_amount = float(entry.amount)
-                
-                # Get payment info for this entry
-                payment = db.session.query(
-                    db.func.sum(Payment.amount_paid).label('total_paid')
-                ).filter(
-                    Payment.regd_no == entry.regd_no,
-                    db.func.lower(Payment.fee_type).like(f'%{normalize_fee_type(entry.fee_type)}%')
-                ).first()
-                
-                # Calculate total paid amount
-                paid_amount = float(payment.total_paid) if payment and payment.total_paid else 0
-                
-                # Check if fully paid (with small epsilon to handle floating point comparison)
-                if paid_amount >= (fee_amount - 0.01):
-                    fully_paid_entries.append(entry)
-            
-            if not fully_paid_entries:
-                flash('No fully paid student records found matching the criteria.', 'info')
-                return redirect(url_for('delete_paid_students'))
+                fee_type_id = fee_type_registry.lookup(fee_type) or -1
             
-            # Count students to be deleted (unique registration numbers)
-            unique_reg_nos = set(entry.regd_no for entry in fully_paid_entries)
-            
-            # Begin deletion process within a transaction
-            deleted_entries = 0
-            deleted_payments = 0
+            # Move the fully paid (student, fee type) pairs to the archive tables in a few
+            # set-based statements (see archive.py); nothing is deleted for good
             try:
-                # Step 2: Delete related payment records
-                for entry in fully_paid_entries:
-                    # Delete payment records for this student and fee type
-                    payment_result = db.session.query(Payment).filter(
-                        Payment.regd_no == entry.regd_no,
-                        db.func.lower(Payment.fee_type).like(f'%{normalize_fee_type(entry.fee_type)}%')
-                    ).delete(synchronize_session=False)
-                    
-                    deleted_payments += payment_result
-                
-                # Step 3: Delete fee master entries
-                for entry in fully_paid_entries:
-                    db.session.delete(entry)
-                    deleted_entries += 1
+                archived = archive_fully_paid(batch_year, fee_type, batch_id=batch_id, fee_type_id=fee_type_id)
+                if archived is None:
+                    flash('No fully paid student records found matching the criteria.', 'info')
+                    return redirect(url_for('main.delete_paid_students'))
                 
-                # Commit changes
                 db.session.commit()
                 
                 # Success message with deletion counts
-                flash(f'Successfully deleted {deleted_entries} fee records and {deleted_payments} payment records '
-                      f'for {len(unique_reg_nos)} fully paid students.', 'success')
+                flash(f'Archived {archived.fee_entries} fee records and {archived.payments} payment records '
+                      f'for {archived.students} fully paid students (archive #{archived.id}, restorable from this page).', 'success')
                 
-                return redirect(url_for('dashboard'))
+                return redirect(url_for('main.dashboard'))
                 
             except Exception as e:
                 db.session.rollback()
-                app.logger.error(f"Error deleting paid student data: {str(e)}")
+                current_app.logger.error(f"Error deleting paid student data: {str(e)}")
                 flash(f'Error deleting records: {str(e)}', 'error')
         
         except Exception as e:
-            app.logger.error(f"Error in delete_paid_students: {str(e)}")
+            current_app.logger.error(f"Error in delete_paid_students: {str(e)}")
             import traceback
-            app.logger.error(traceback.format_exc())
+            current_app.logger.error(traceback.format_exc())
             flash(f'An error occurred: {str(e)}', 'error')
     
     # Get batch years for the filter dropdown
-    batch_years = [year[0] for year in db.session.query(Student.batch_year).distinct().order_by(Student.batch_year).all()]
-    fee_types = ['CRT', 'Phase 2', 'Phase 3']
+    options = filter_options.get()
+    batch_years = options['batch_years']
+    fee_types = options['fee_types']
     
-    return render_template('delete_paid_students.html', batch_years=batch_years, fee_types=fee_types)
+    return render_template('delete_paid_students.html', batch_years=batch_years, fee_types=fee_types,
+                           archives=recent_archives())
+
+@bp.route('/delete_paid_students/restore/<int:archive_id>', methods=['POST'])
+@login_required
+def restore_paid_students(archive_id):
+    """Put an archived run of fully paid records back into the live tables"""
+    try:
+        restored, left = restore_archive(archive_id)
+        db.session.commit()
+        flash(f"Restored {restored['fee_master']} fee records and {restored['payment']} payment records "
+              f"from archive #{archive_id}.", 'success')
+        if any(left.values()):
+            flash(f"{left['fee_master']} fee records and {left['payment']} payment records of students "
+                  f"that no longer exist were left in archive #{archive_id}; restore it again once "
+                  f"the students are back.", 'warning')
+    except ValueError as e:
+        flash(str(e), 'warning')
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error restoring archive {archive_id}: {str(e)}")
+        import traceback
+        current_app.logger.error(traceback.format_exc())
+        flash(f'Error restoring records: {str(e)}', 'error')
+    return redirect(url_for('main.delete_paid_students'))
 
 
 if __name__ == '__main__':
+    app = create_app()
     app.run(debug=True)
\ No newline at end of file
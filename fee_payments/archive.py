@@ -0,0 +1,158 @@
+"""
+Archiving fully paid fee entries ("Delete Paid Records").
+
+At year end the fully paid (student, fee type) pairs are moved out of
+fee_master and payment so the live tables - and every dashboard query over
+them - only hold open balances. The work is set-based, a fixed number of
+statements however many students qualify:
+
+1. one aggregate finds the fully paid pairs into a TEMP table
+2. INSERT ... SELECT copies their fee entries and payments into
+   fee_master_archive / payment_archive under a new archive_batch id
+3. one DELETE ... WHERE EXISTS per live table removes them
+
+Nothing is lost: restore_archive() copies an archive run back (keeping the
+original ids when they are still free) and removes it from the archive.
+The change_log triggers see the deletes and re-inserts like any other write.
+"""
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models import db, FeeMaster, Payment, ArchiveBatch, fee_master_archive, payment_archive
+
+# Live table -> its archive copy
+ARCHIVED_TABLES = [
+    (FeeMaster.__table__, fee_master_archive),
+    (Payment.__table__, payment_archive),
+]
+
+PAIRS_DDL = text('''
+    CREATE TEMP TABLE IF NOT EXISTS archive_pair (
+        student_id INTEGER NOT NULL,
+        fee_type_id INTEGER NOT NULL,
+        PRIMARY KEY (student_id, fee_type_id)
+    ) WITHOUT ROWID
+''')
+
+# A pair is fully paid when what was paid covers its fee entry; amounts are
+# integer paise, so the comparison is exact
+FULLY_PAID_SQL = '''
+    INSERT OR IGNORE INTO archive_pair (student_id, fee_type_id)
+    SELECT f.student_id, f.fee_type_id
+    FROM fee_master f
+    JOIN student s ON s.id = f.student_id
+    LEFT JOIN (
+        SELECT student_id, fee_type_id, SUM(amount_paid_paise) AS paid_paise
+        FROM payment
+        GROUP BY student_id, fee_type_id
+    ) p ON p.student_id = f.student_id AND p.fee_type_id = f.fee_type_id
+    WHERE COALESCE(p.paid_paise, 0) >= f.amount_paise
+      {filters}
+'''
+
+IN_PAIRS = '''
+    EXISTS (SELECT 1 FROM archive_pair a
+            WHERE a.student_id = {alias}.student_id AND a.fee_type_id = {alias}.fee_type_id)
+'''
+
+
+def _columns(table):
+    return ', '.join(column.name for column in table.columns)
+
+
+def fully_paid_pairs(batch_id=None, fee_type_id=None):
+    """Fill the archive_pair TEMP table and return how many pairs qualify"""
+    filters = []
+    params = {}
+    if batch_id is not None:
+        filters.append("AND s.batch_id = :batch_id")
+        params['batch_id'] = batch_id
+    if fee_type_id is not None:
+        filters.append("AND f.fee_type_id = :fee_type_id")
+        params['fee_type_id'] = fee_type_id
+
+    db.session.execute(PAIRS_DDL)
+    db.session.execute(text("DELETE FROM archive_pair"))
+    return db.session.execute(text(FULLY_PAID_SQL.format(filters=' '.join(filters))), params).rowcount
+
+
+def archive_fully_paid(batch_year='', fee_type='', batch_id=None, fee_type_id=None):
+    """Move fully paid fee entries and their payments to the archive tables.
+
+    Returns the ArchiveBatch, or None when nothing qualifies. The caller
+    commits (or rolls back, which undoes the whole run).
+    """
+    pairs = fully_paid_pairs(batch_id, fee_type_id)
+    if not pairs:
+        return None
+
+    batch = ArchiveBatch(batch_year=batch_year or '', fee_type=fee_type or '')
+    db.session.add(batch)
+    db.session.flush()
+
+    counts = {}
+    for live, archive in ARCHIVED_TABLES:
+        columns = _columns(live)
+        in_pairs = IN_PAIRS.format(alias=live.name)
+        counts[live.name] = db.session.execute(text(
+            f"INSERT INTO {archive.name} (archive_id, {columns}) "
+            f"SELECT :archive_id, {columns} FROM {live.name} WHERE {in_pairs}"
+        ), {'archive_id': batch.id}).rowcount
+        db.session.execute(text(f"DELETE FROM {live.name} WHERE {in_pairs}"))
+
+    batch.students = db.session.execute(text("SELECT COUNT(DISTINCT student_id) FROM archive_pair")).scalar()
+    batch.fee_entries = counts['fee_master']
+    batch.payments = counts['payment']
+    db.session.execute(text("DELETE FROM archive_pair"))
+    return batch
+
+
+def restore_archive(archive_id):
+    """Copy an archive run back into the live tables and drop it from the archive.
+
+    Rows keep their original id unless a newer row has taken it. Rows of
+    students that no longer exist stay in the archive, and the run can be
+    restored again once they are back; it only counts as restored when
+    nothing is left. Returns ({table: restored rows}, {table: rows left in
+    the archive}); the caller commits.
+    """
+    batch = db.session.get(ArchiveBatch, archive_id)
+    if batch is None or batch.restored_at is not None:
+        raise ValueError(f"Archive {archive_id} does not exist or was already restored")
+
+    restored = {}
+    for live, archive in ARCHIVED_TABLES:
+        other_columns = [column.name for column in live.columns if column.name != 'id']
+        restorable = ("a.archive_id = :archive_id "
+                      "AND EXISTS (SELECT 1 FROM student s WHERE s.id = a.student_id)")
+        # Note the ids newer rows have taken before inserting anything
+        db.session.execute(text("DROP TABLE IF EXISTS temp.restore_taken"))
+        db.session.execute(text(
+            f"CREATE TEMP TABLE restore_taken AS SELECT a.id FROM {archive.name} a "
+            f"WHERE {restorable} AND EXISTS (SELECT 1 FROM {live.name} l WHERE l.id = a.id)"
+        ), {'archive_id': archive_id})
+        taken = "a.id IN (SELECT id FROM temp.restore_taken)"
+        restored[live.name] = 0
+        # Free ids first; the others then get new ids above every restored one
+        for new_id, condition in (('a.id', f"NOT {taken}"), ('NULL', taken)):
+            restored[live.name] += db.session.execute(text(
+                f"INSERT INTO {live.name} (id, {', '.join(other_columns)}) "
+                f"SELECT {new_id}, {', '.join('a.' + column for column in other_columns)} "
+                f"FROM {archive.name} a WHERE {restorable} AND {condition}"
+            ), {'archive_id': archive_id}).rowcount
+        db.session.execute(text(f"DELETE FROM {archive.name} AS a WHERE {restorable}"), {'archive_id': archive_id})
+
+    db.session.execute(text("DROP TABLE IF EXISTS temp.restore_taken"))
+    left = {
+        live.name: db.session.execute(text(f"SELECT COUNT(*) FROM {archive.name} WHERE archive_id = :archive_id"),
+                                      {'archive_id': archive_id}).scalar()
+        for live, archive in ARCHIVED_TABLES
+    }
+    if not any(left.values()):
+        batch.restored_at = datetime.utcnow()
+    return restored, left
+
+
+def recent_archives(limit=20):
+    return ArchiveBatch.query.order_by(ArchiveBatch.id.desc()).limit(limit).all()
@@ -0,0 +1,5 @@
+"""
+Benchmark scripts. Run them from the fee_payments directory, e.g.
+
+    python -m benchmarks.sqlite_profile
+"""
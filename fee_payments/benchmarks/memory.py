@@ -0,0 +1,125 @@
+"""
+Peak memory of the upload and export paths, per 10,000 rows.
+
+Serves a copy of a generated dataset (synthetic_data.py) through Flask's
+test client with MEMORY_PROFILE on (memory_profile.py) and makes:
+
+    upload               POST /upload with the first --rows rows of the dataset's sheet
+    unpaid_students csv  GET /unpaid_students?payment_status=all&download_csv=true
+    export_snapshot      GET /export/snapshot (Parquet)
+
+Each request is made once beforehand (with a 10-row sheet for the upload)
+so library imports and caches aren't counted. The run fails (exit status
+1) when a request's tracemalloc peak, scaled to 10,000 rows, is over its
+budget in PEAK_PER_10K_ROWS_MB. The budgets are about 1.5 times today's
+peaks; a change that makes a path hold noticeably more per row has to
+raise one deliberately. The peaks don't depend on --frames; more frames
+only fill in the "top app line" column, at the cost of a slower run.
+
+Usage:
+    python -m benchmarks.memory
+    python -m benchmarks.memory --students 100000 --rows 50000
+"""
+import io
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import time
+
+from benchmarks.routes import dataset, DEFAULT_DATA_DIR, _upload_sheet
+
+MB = 1024 * 1024
+
+# Most memory (tracemalloc peak) a request may hold per 10,000 rows it handles
+PEAK_PER_10K_ROWS_MB = {
+    'upload': 12,
+    'unpaid_students csv': 20,
+    'export_snapshot': 5,
+}
+
+
+def requests_to_make(sheet):
+    """(name, method, url, request kwargs)"""
+    return [
+        ('upload', 'POST', '/upload', {'data': {'excel-file': (io.BytesIO(sheet), 'memory.csv')},
+                                       'content_type': 'multipart/form-data'}),
+        ('unpaid_students csv', 'GET', '/unpaid_students?payment_status=all&download_csv=true', {}),
+        ('export_snapshot', 'GET', '/export/snapshot?format=parquet', {}),
+    ]
+
+
+def _wait_for_record(tail_records, path, count, timeout=10):
+    """The newest record once the log holds count records; a background thread writes them"""
+    deadline = time.time() + timeout
+    while True:
+        records = tail_records(path, count)
+        if len(records) >= count or time.time() > deadline:
+            return records[0]
+        time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000, help='Size of the generated dataset')
+    parser.add_argument('--rows', type=int, default=10000, help='Sheet rows in the measured upload')
+    parser.add_argument('--frames', type=int, default=1,
+                        help='Stack frames per traced allocation; more find the app line, but are slower')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Where generated datasets are cached')
+    args = parser.parse_args()
+
+    manifest = dataset(args.data_dir, args.students, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        # The upload writes to the database, so work on a copy
+        db_path = os.path.join(tmp, 'fee_payments.db')
+        shutil.copy(manifest['files']['database'], db_path)
+        os.environ.update({'FEE_SECRET_KEY': 'benchmark', 'FEE_SLOW_REQUEST_MS': '0'})
+        os.environ.pop('FEE_METRICS_DIR', None)
+        from synthetic_data import dataset_config
+        from app import create_app
+        from slow_log import tail_records
+
+        config = dataset_config(db_path)
+        config.MEMORY_PROFILE = True
+        config.MEMORY_PROFILE_FRAMES = args.frames
+        config.MEMORY_LOG_PATH = os.path.join(tmp, 'memory_profiles.jsonl')
+        config.PROFILE_DIR = os.path.join(tmp, 'profiles')
+        app = create_app(config)
+        client = app.test_client()
+        response = client.post('/admin/login', data={'username': 'admin', 'password': 'adminpass'})
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed with status {response.status_code}")
+
+        warm_up = requests_to_make(_upload_sheet(manifest, 10))
+        measured = requests_to_make(_upload_sheet(manifest, args.rows))
+        records = {}
+        for (name, method, url, kwargs), (_, _, _, warm_kwargs) in zip(measured, warm_up):
+            client.open(url, method=method, **warm_kwargs)
+            response = client.open(url, method=method, **kwargs)
+            if 'X-Memory-Peak' not in response.headers:
+                raise RuntimeError(f"{name} was not memory-profiled (status {response.status_code})")
+            records[name] = _wait_for_record(tail_records, config.MEMORY_LOG_PATH, len(records) * 2 + 2)
+
+    print(f"{args.students} students, {args.rows}-row upload")
+    print(f"{'request':<22} {'rows':>8} {'peak MB':>9} {'per 10k':>9} {'budget':>7} {'retained':>9}  top app line")
+    over = []
+    for name, record in records.items():
+        budget = PEAK_PER_10K_ROWS_MB[name]
+        per_10k = record['peak_per_10k_rows'] / MB if record['peak_per_10k_rows'] else None
+        app_sites = [site['app_site'] for site in record['top'] if site['app_site']]
+        print(f"{name:<22} {record['rows']!s:>8} {record['peak_bytes'] / MB:>9.1f} "
+              f"{per_10k if per_10k is not None else float('nan'):>9.1f} {budget:>7} "
+              f"{record['retained_bytes'] / MB:>9.1f}  {app_sites[0] if app_sites else ''}")
+        if per_10k is None or per_10k > budget:
+            over.append(name)
+
+    if over:
+        print(f"\nOver the peak memory budget per 10,000 rows: {', '.join(over)}")
+        sys.exit(1)
+    print("\nAll paths within their peak memory budget per 10,000 rows.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Check that logins work across gunicorn workers under concurrent load.
+
+Starts gunicorn with N workers on a scratch database and no FEE_SECRET_KEY
+(so the workers have to agree on the generated instance key), logs in
+several clients and fires authenticated requests at them. Every request
+must come back 200; a redirect to the login page means a worker rejected a
+session cookie signed by another worker. The access log is used to confirm
+that the requests really were spread over the workers.
+
+Usage:
+    python -m benchmarks.multiworker_sessions --workers 4 --clients 16 --requests 50
+"""
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode
+from collections import Counter
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBE_URL = '/api/students?query=a'
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(port, server, deadline=60):
+    start = time.time()
+    while time.time() - start < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError("gunicorn did not start in time")
+
+
+def _login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    body = urlencode({'username': 'admin', 'password': 'adminpass'})
+    conn.request('POST', '/admin/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+    response = conn.getresponse()
+    response.read()
+    cookie = response.getheader('Set-Cookie', '').split(';', 1)[0]
+    if response.status != 302 or not cookie:
+        raise RuntimeError(f"Login failed with status {response.status}")
+    return conn, cookie
+
+
+def _client(port, requests, results, lock):
+    statuses = Counter()
+    latencies = []
+    try:
+        conn, cookie = _login(port)
+        for _ in range(requests):
+            start = time.perf_counter()
+            conn.request('GET', PROBE_URL, headers={'Cookie': cookie, 'Connection': 'close'})
+            response = conn.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] += 1
+            # New connection per request so gunicorn can hand it to any worker
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    except Exception as e:
+        statuses[f"error: {e}"] += 1
+    with lock:
+        results['statuses'].update(statuses)
+        results['latencies'].extend(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16, help='Concurrent logged-in clients')
+    parser.add_argument('--requests', type=int, default=50, help='Authenticated requests per client')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        port = _free_port()
+        access_log = os.path.join(tmp, 'access.log')
+        env = dict(os.environ)
+        env.pop('FEE_SECRET_KEY', None)
+        env.update({
+            'FEE_DATABASE_URL': 'sqlite:///' + os.path.join(tmp, 'fee_payments.db'),
+            'FEE_SECRET_KEY_FILE': os.path.join(tmp, 'secret_key'),
+            'FEE_BIND': f"127.0.0.1:{port}",
+            'FEE_WORKERS': str(args.workers),
+            'FEE_ACCESS_LOG': access_log,
+        })
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+             '--access-logformat', '%(p)s %(s)s %(U)s', 'wsgi:app'],
+            cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            _wait_until_up(port, server)
+            results = {'statuses': Counter(), 'latencies': []}
+            lock = threading.Lock()
+            threads = [threading.Thread(target=_client, args=(port, args.requests, results, lock))
+                       for _ in range(args.clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        # Access log lines look like "<worker pid> <status> <path>"
+        served_by = Counter()
+        with open(access_log) as f:
+            for line in f:
+                pid, status, path = line.split()[:3]
+                if path == PROBE_URL.split('?')[0] and status == '200':
+                    served_by[pid.strip('<>')] += 1
+
+    statuses = results['statuses']
+    latencies = sorted(results['latencies'])
+    total = sum(statuses.values())
+    print(f"{total} requests in {elapsed:.2f}s ({total / elapsed:.1f}/s), "
+          f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.1f} ms" if latencies else "no requests completed")
+    print(f"status codes: {dict(statuses)}")
+    print(f"authenticated 200s per worker pid: {dict(served_by)}")
+
+    ok = statuses.get(200, 0) == args.clients * args.requests and len(served_by) == args.workers
+    print("OK: sessions are valid on every worker" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,296 @@
+"""
+Load test for a fee deadline day.
+
+Counter staff post payments and look students up while admins refresh the
+reports. This starts gunicorn on a copy of a generated dataset
+(synthetic_data.py), logs in --clients users and sends a mix of requests at
+a fixed --rate for --duration seconds:
+
+    payment        POST /payments for a random fee entry (one instalment)
+    autocomplete   GET /api/students with a registration number or name prefix
+    student_fees   GET /api/student-fees, as the payment form does after a pick
+    unpaid         GET /unpaid_students
+    dashboard      GET /dashboard
+
+Requests are sent at their scheduled time whether or not earlier ones have
+finished, like real users. Latency is measured from that time, so time spent
+waiting for a free client counts, and an overloaded server shows up as
+growing latency rather than a quietly lower request rate.
+
+A lock error is a request that failed with "database is locked": the
+payments page reports a failed commit in its flash message, and any
+logged error in the server output is counted too. Exits with status 1 if
+any request failed.
+
+Usage:
+    python -m benchmarks.payment_rush
+    python -m benchmarks.payment_rush --students 10000 --rate 40 --duration 60 --workers 8
+    python -m benchmarks.payment_rush --mix payment=80,autocomplete=20 --threads 4
+"""
+import os
+import sys
+import time
+import json
+import queue
+import random
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+from urllib.parse import urlencode, quote
+from collections import Counter, defaultdict
+
+from benchmarks.routes import dataset, DEFAULT_DATA_DIR
+from benchmarks.multiworker_sessions import _free_port, _wait_until_up, APP_DIR
+
+DEFAULT_MIX = 'payment=50,autocomplete=30,student_fees=10,unpaid=6,dashboard=4'
+LOCK_ERROR = b'database is locked'
+PERCENTILES = (50, 90, 95, 99)
+
+
+def parse_mix(text):
+    """{'payment': 50, ...} from "payment=50,autocomplete=30"; weights are relative"""
+    mix = {}
+    for part in text.split(','):
+        if not part.strip():
+            continue
+        kind, _, weight = part.partition('=')
+        if kind.strip() not in REQUESTS:
+            raise argparse.ArgumentTypeError(f"Unknown request kind {kind.strip()!r} "
+                                             f"(one of {', '.join(REQUESTS)})")
+        mix[kind.strip()] = float(weight or 1)
+    if not mix or sum(mix.values()) <= 0:
+        raise argparse.ArgumentTypeError("The mix needs at least one request kind with a positive weight")
+    return mix
+
+
+def load_fee_entries(db_path, limit=5000, seed=0):
+    """(regd_no, name, batch_year, fee type code) of up to limit random fee entries"""
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            "SELECT s.regd_no, s.name, b.name, f.fee_type FROM fee_master f "
+            "JOIN student s ON s.id = f.student_id JOIN batch b ON b.id = s.batch_id"
+        ).fetchall()
+    finally:
+        conn.close()
+    random.Random(seed).shuffle(rows)
+    return rows[:limit]
+
+
+def _payment(entry, rng):
+    regd_no, _, batch_year, fee_type = entry
+    body = urlencode({
+        'regd-number': regd_no, 'batch-year': batch_year, 'fee-type-combined': fee_type,
+        'payment-method': 'cash', 'payment-amount': str(rng.choice((500, 1000, 2500, 5000))),
+        'payment-date': time.strftime('%Y-%m-%d'), 'received-by': 'Load test',
+    })
+    return 'POST', '/payments', body
+
+
+def _autocomplete(entry, rng):
+    regd_no, name, _, _ = entry
+    # What has been typed so far: part of a registration number or of a name
+    text = regd_no[:rng.randint(4, len(regd_no))] if rng.random() < 0.7 else name.split()[0][:rng.randint(3, 5)]
+    return 'GET', f"/api/students?query={quote(text)}", None
+
+
+def _student_fees(entry, rng):
+    return 'GET', f"/api/student-fees?regd_no={quote(entry[0])}", None
+
+
+def _unpaid(entry, rng):
+    return 'GET', '/unpaid_students', None
+
+
+def _dashboard(entry, rng):
+    return 'GET', '/dashboard', None
+
+
+REQUESTS = {
+    'payment': _payment,
+    'autocomplete': _autocomplete,
+    'student_fees': _student_fees,
+    'unpaid': _unpaid,
+    'dashboard': _dashboard,
+}
+
+
+def _outcome(kind, status, body):
+    """'ok', 'lock' or 'error' for one response"""
+    if LOCK_ERROR in body:
+        return 'lock'
+    if kind == 'payment':
+        # A recorded payment redirects to the student's details; a failed one renders the form again
+        return 'ok' if status == 302 else 'error'
+    return 'ok' if status == 200 else 'error'
+
+
+def _login(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        conn.request('POST', '/admin/login', urlencode({'username': 'admin', 'password': 'adminpass'}),
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+    finally:
+        conn.close()
+    cookie = response.getheader('Set-Cookie', '').split(';', 1)[0]
+    if response.status != 302 or not cookie:
+        raise RuntimeError(f"Login failed with status {response.status}")
+    return cookie
+
+
+def _client(port, cookie, work, results, lock):
+    while True:
+        item = work.get()
+        if item is None:
+            return
+        due, kind, method, url, body = item
+        # Wait for the scheduled time; a late start is counted in the latency
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        headers = {'Cookie': cookie, 'Connection': 'close'}
+        if body is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        started = time.perf_counter()
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        try:
+            conn.request(method, url, body, headers)
+            response = conn.getresponse()
+            outcome = _outcome(kind, response.status, response.read())
+        except Exception as e:
+            outcome = f"error: {type(e).__name__}"
+        finally:
+            conn.close()
+        finished = time.perf_counter()
+        with lock:
+            results[kind].append((finished - due, finished - started, outcome))
+
+
+def _percentile(values, percent):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percent / 100), len(ordered) - 1)]
+
+
+def run(port, mix, entries, rate, duration, clients, seed):
+    """Send the mix at rate requests per second; returns ({kind: [(latency, service, outcome)]}, seconds)"""
+    rng = random.Random(seed)
+    kinds, weights = list(mix), list(mix.values())
+    cookies = [_login(port) for _ in range(clients)]
+
+    work = queue.Queue()
+    results = defaultdict(list)
+    lock = threading.Lock()
+    threads = [threading.Thread(target=_client, args=(port, cookie, work, results, lock), daemon=True)
+               for cookie in cookies]
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter() + 0.5
+    total = int(rate * duration)
+    for i in range(total):
+        kind = rng.choices(kinds, weights)[0]
+        method, url, body = REQUESTS[kind](rng.choice(entries), rng)
+        work.put((start + i / rate, kind, method, url, body))
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed, server_lock_errors):
+    """Print the summary; returns the number of failed requests"""
+    rows = [('all', [r for kind_results in results.values() for r in kind_results])]
+    rows += sorted(results.items())
+    print(f"{'request':<14} {'count':>6} {'rate/s':>7} " + ' '.join(f"{f'p{p} ms':>9}" for p in PERCENTILES)
+          + f" {'max ms':>9} {'service p50':>12} {'locks':>6} {'errors':>6}")
+    failed = 0
+    for kind, kind_results in rows:
+        if not kind_results:
+            continue
+        latencies = [latency * 1000 for latency, _, _ in kind_results]
+        service = [seconds * 1000 for _, seconds, _ in kind_results]
+        outcomes = Counter(outcome for _, _, outcome in kind_results)
+        errors = sum(count for outcome, count in outcomes.items() if outcome not in ('ok', 'lock'))
+        if kind == 'all':
+            failed = errors + outcomes['lock']
+        print(f"{kind:<14} {len(kind_results):>6} {len(kind_results) / elapsed:>7.1f} "
+              + ' '.join(f"{_percentile(latencies, p):>9.1f}" for p in PERCENTILES)
+              + f" {max(latencies):>9.1f} {_percentile(service, 50):>12.1f} {outcomes['lock']:>6} {errors:>6}")
+
+    everything = rows[0][1]
+    if everything:
+        lock_rate = sum(1 for _, _, outcome in everything if outcome == 'lock') / len(everything) * 100
+        print(f"\n{len(everything)} requests in {elapsed:.1f}s; lock error rate {lock_rate:.2f}%; "
+              f"'database is locked' in the server log {server_lock_errors} time(s)")
+        other = Counter(outcome for _, _, outcome in everything if outcome.startswith('error: '))
+        if other:
+            print(f"connection errors: {dict(other)}")
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=10000, help='Size of the generated dataset')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"Relative weights of the request kinds (default {DEFAULT_MIX})")
+    parser.add_argument('--rate', type=float, default=20.0, help='Requests per second')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds')
+    parser.add_argument('--clients', type=int, default=32, help='Logged-in users sending requests concurrently')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=1, help='Threads per gunicorn worker')
+    parser.add_argument('--json', help='Also write the raw results to this file')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Where generated datasets are cached')
+    args = parser.parse_args()
+
+    manifest = dataset(args.data_dir, args.students, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Payments are written, so work on a copy
+        db_path = os.path.join(tmp, 'fee_payments.db')
+        shutil.copy(manifest['files']['database'], db_path)
+        entries = load_fee_entries(db_path, seed=args.seed)
+
+        port = _free_port()
+        server_log = os.path.join(tmp, 'server.log')
+        env = dict(os.environ, **{
+            'FEE_DATABASE_URL': 'sqlite:///' + db_path,
+            'FEE_SECRET_KEY': 'load-test',
+            'FEE_BIND': f"127.0.0.1:{port}",
+            'FEE_WORKERS': str(args.workers),
+            'FEE_THREADS': str(args.threads),
+            'FEE_ACCESS_LOG': os.devnull,
+            'FEE_METRICS_DIR': os.path.join(tmp, 'metrics'),
+            'FEE_SLOW_LOG': os.path.join(tmp, 'slow_requests.jsonl'),
+            'FEE_PROFILE_DIR': os.path.join(tmp, 'profiles'),
+        })
+        print(f"{args.students} students, {args.workers} workers x {args.threads} threads, "
+              f"{args.rate:g} requests/s for {args.duration:g}s from {args.clients} clients", flush=True)
+        with open(server_log, 'w') as log:
+            server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+                                      cwd=APP_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            _wait_until_up(port, server)
+            results, elapsed = run(port, args.mix, entries, args.rate, args.duration, args.clients, args.seed)
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+        with open(server_log, 'rb') as f:
+            server_lock_errors = f.read().count(LOCK_ERROR)
+
+    failed = report(results, elapsed, server_lock_errors)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items() if k != 'json'}, 'elapsed': elapsed,
+                       'results': results}, f)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
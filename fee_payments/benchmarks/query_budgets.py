@@ -0,0 +1,249 @@
+"""
+SQL query budgets per endpoint.
+
+Every endpoint of the app has a budget: the most SQL statements one request
+may run. Each request below is made against a generated dataset of 10
+students and one of 1,000 (synthetic_data.py), and the run fails (exit
+status 1) when
+
+- a request runs more statements than its budget,
+- a request runs more statements on the bigger dataset than on the small
+  one - a loop over students, fee entries or payments that issues a query
+  per row, or
+- an endpoint of the app has no request here (so no budget).
+
+The upload is also made with two sheet sizes (UPLOAD_SHEETS) and fails
+when the bigger sheet runs more statements than the smaller one: it looks
+up students and fee entries, and flushes its writes, a chunk of rows at a
+time (UPLOAD_CHUNK_ROWS in app.py), and both sheets fit in one chunk.
+
+Counts are read from the Server-Timing header (query_stats.py) and include
+loading the logged-in admin. GET requests are made twice and the second
+is counted, so the budget doesn't depend on which cache (filter options,
+fee types, student index) an earlier request happened to fill; writes are
+made once. Budgets are exact counts today; raise one only together with
+the change that needs it.
+
+Usage:
+    python -m benchmarks.query_budgets
+    python -m benchmarks.query_budgets --sizes 10,1000,10000
+"""
+import io
+import os
+import re
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+from benchmarks.routes import dataset, DEFAULT_DATA_DIR
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+QUERIES_HEADER = re.compile(r'db;desc="(\d+) queries"')
+
+# Sheet rows of the two upload requests
+UPLOAD_SHEETS = (10, 20)
+
+# Endpoints that are not requested (nothing to count)
+NOT_BUDGETED = {'static'}
+
+
+def cases(sample):
+    """(endpoint, name, method, url, request kwargs, budget), in the order they are made.
+
+    Writes come after the reads, logout last. sample holds one generated
+    student: regd_no, batch_year and the fee type code of one of its fees.
+    """
+    regd_no, batch_year, fee_type = sample['regd_no'], sample['batch_year'], sample['fee_type']
+    payment = {'regd-number': regd_no, 'batch-year': batch_year, 'fee-type-combined': fee_type,
+               'payment-method': 'cash', 'payment-amount': '100', 'payment-date': '2025-01-15',
+               'received-by': 'Budget check'}
+    return [
+        ('main.index', 'index', 'GET', '/', {}, 1),
+        ('main.admin_login', 'admin_login', 'GET', '/admin/login', {}, 1),
+        ('main.dashboard', 'dashboard', 'GET', '/dashboard', {}, 11),
+        ('main.student_details', 'student_details', 'GET', '/student_details', {}, 2),
+        ('main.student_details', 'student_details batch_year', 'GET',
+         f'/student_details?batch_year={batch_year}', {}, 3),
+        ('main.student_details', 'student_details branch', 'GET', '/student_details?branch=CSE', {}, 2),
+        ('main.student_details', 'student_details fee_type', 'GET', '/student_details?fee_type=CRT', {}, 2),
+        ('main.student_details', 'student_details payment_status', 'GET',
+         '/student_details?payment_status=not_paid', {}, 2),
+        ('main.student_details', 'student_details regd_no', 'GET', f'/student_details?regd_no={regd_no}', {}, 2),
+        ('main.student_details', 'student_details display_type', 'GET',
+         '/student_details?display_type=student_details', {}, 2),
+        ('main.unpaid_students', 'unpaid_students', 'GET', '/unpaid_students', {}, 2),
+        ('main.unpaid_students', 'unpaid_students csv', 'GET',
+         '/unpaid_students?payment_status=all&download_csv=true', {}, 1),
+        ('main.payments', 'payments', 'GET', '/payments', {}, 2),
+        ('main.payments', 'payments regd_no', 'GET', f'/payments?regd_no={regd_no}', {}, 3),
+        # Registration number prefixes come from the in-memory index; the search
+        # query only runs when it has fewer matches than the limit
+        ('main.api_students', 'api_students regd_no', 'GET', f'/api/students?query={regd_no[:6]}', {}, 2),
+        ('main.api_students', 'api_students name', 'GET', '/api/students?query=kum', {}, 2),
+        ('main.api_student_fees', 'api_student_fees', 'GET', f'/api/student-fees?regd_no={regd_no}', {}, 2),
+        ('main.get_registrations_by_batch', 'registrations_by_batch', 'GET',
+         f'/api/registrations-by-batch?batch_year={batch_year}', {}, 1),
+        ('main.api_filter_options', 'api_filter_options', 'GET', '/api/filter-options', {}, 1),
+        ('main.api_student_index', 'api_student_index', 'GET', '/api/student-index', {}, 1),
+        ('main.api_changes', 'api_changes', 'GET', '/api/changes?since=0&limit=500', {}, 5),
+        ('main.chart_debug', 'chart_debug', 'GET', '/chart-debug', {}, 6),
+        ('main.download_template', 'download_template', 'GET', '/download_template', {}, 0),
+        # BEGIN of the snapshot's read transaction, plus one more read per
+        # export_snapshot.DEFAULT_CHUNK_SIZE rows past the first chunk
+        ('main.export_snapshot', 'export_snapshot', 'GET', '/export/snapshot?format=parquet', {}, 12),
+        ('main.delete_paid_students', 'delete_paid_students', 'GET', '/delete_paid_students', {}, 2),
+        ('main.upload', 'upload form', 'GET', '/upload', {}, 1),
+        ('main.admin_query_stats', 'admin_query_stats', 'GET', '/admin/query-stats', {}, 1),
+        ('main.admin_slow_requests', 'admin_slow_requests', 'GET', '/admin/slow-requests', {}, 1),
+        ('main.admin_profiles', 'admin_profiles', 'GET', '/admin/profiles', {}, 1),
+        ('main.admin_profile_file', 'admin_profile_file', 'GET', '/admin/profiles/missing/prof', {}, 1),
+        ('main.admin_memory_profiles', 'admin_memory_profiles', 'GET', '/admin/memory', {}, 1),
+        ('main.prometheus_metrics', 'metrics', 'GET', '/metrics', {}, 0),
+        # Writes
+        ('main.calculate_distribution', 'calculate_distribution', 'POST', '/api/calculate-distribution',
+         {'json': {'regd_no': regd_no, 'fee_types': [fee_type], 'amount': 100}}, 2),
+        ('main.payments', 'payments post', 'POST', '/payments', {'data': payment}, 4),
+        ('main.update_remarks', 'update_remarks', 'POST', '/update_remarks',
+         {'json': {'registration_number': regd_no, 'fee_type': 'all', 'remarks': 'Budget check'}}, 3),
+    ] + [
+        ('main.upload', f'upload {rows} rows', 'POST', '/upload', {'upload': rows}, 23)
+        for rows in UPLOAD_SHEETS
+    ] + [
+        ('main.delete_paid_students', 'delete_paid_students post', 'POST', '/delete_paid_students',
+         {'data': {'confirm': 'yes'}}, 13),
+        ('main.restore_paid_students', 'restore_paid_students', 'POST', '/delete_paid_students/restore/1', {}, 16),
+        ('main.admin_query_stats', 'admin_query_stats post', 'POST', '/admin/query-stats', {}, 1),
+        ('main.logout', 'logout', 'GET', '/logout', {}, 1),
+    ]
+
+
+def _upload_sheet(manifest, rows):
+    with open(manifest['files']['csv'], encoding='utf-8') as f:
+        lines = [line for _, line in zip(range(rows + 1), f)]
+    return ''.join(lines).encode('utf-8')
+
+
+def run_child(manifest_path):
+    """Count the statements of every case on one dataset and print them as JSON (own interpreter)"""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'fee_payments.db')
+        shutil.copy(manifest['files']['database'], db_path)
+        os.environ.update({'FEE_SECRET_KEY': 'benchmark', 'FEE_SLOW_REQUEST_MS': '0', 'FEE_QUERY_STATS': '1'})
+        os.environ.pop('FEE_METRICS_DIR', None)
+        from synthetic_data import dataset_config
+        from app import create_app
+        from models import db, Batch, Student, FeeMaster
+
+        config = dataset_config(db_path)
+        config.PROFILE_DIR = os.path.join(tmp, 'profiles')
+        app = create_app(config)
+        with app.app_context():
+            regd_no, batch_year, fee_type = db.session.query(Student.regd_no, Batch.name, FeeMaster.fee_type).join(
+                FeeMaster, FeeMaster.student_id == Student.id
+            ).join(Batch, Batch.id == Student.batch_id).order_by(Student.id).first()
+            sample = {'regd_no': regd_no, 'batch_year': batch_year, 'fee_type': fee_type}
+            endpoints = sorted({rule.endpoint for rule in app.url_map.iter_rules()} - NOT_BUDGETED)
+
+        client = app.test_client()
+        response = client.post('/admin/login', data={'username': 'admin', 'password': 'adminpass'})
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed with status {response.status_code}")
+
+        counts = {}
+        for endpoint, name, method, url, kwargs, _ in cases(sample):
+            if kwargs.get('upload'):
+                sheet = _upload_sheet(manifest, kwargs['upload'])
+                kwargs = {'data': {'excel-file': (io.BytesIO(sheet), 'budget.csv')},
+                          'content_type': 'multipart/form-data'}
+            if method == 'GET' and endpoint != 'main.logout':
+                # Warm-up: budgets are for a request served from warm caches
+                client.open(url, method=method, **kwargs)
+            response = client.open(url, method=method, **kwargs)
+            match = QUERIES_HEADER.search(response.headers.get('Server-Timing', ''))
+            counts[name] = {'queries': int(match.group(1)) if match else None, 'status': response.status_code}
+    print(json.dumps({'counts': counts, 'endpoints': endpoints, 'sample': sample}))
+
+
+def check(results):
+    """Problems found in {students: child output}"""
+    problems = []
+    sizes = sorted(results, key=int)
+    first = results[sizes[0]]
+    all_cases = cases(first['sample'])
+
+    covered = {endpoint for endpoint, *_ in all_cases}
+    for endpoint in first['endpoints']:
+        if endpoint not in covered:
+            problems.append(f"{endpoint}: no query budget (add a request for it to cases())")
+
+    for _, name, _, _, _, budget in all_cases:
+        counts = [results[size]['counts'][name]['queries'] for size in sizes]
+        if None in counts:
+            problems.append(f"{name}: no Server-Timing header (status "
+                            f"{[results[size]['counts'][name]['status'] for size in sizes]})")
+            continue
+        over = [f"{count} at {size}" for size, count in zip(sizes, counts) if count > budget]
+        if over:
+            problems.append(f"{name}: {', '.join(over)} students, budget {budget}")
+        if any(later > earlier for earlier, later in zip(counts, counts[1:])):
+            problems.append(f"{name}: grows with the data ({' -> '.join(map(str, counts))} for "
+                            f"{' -> '.join(sizes)} students)")
+
+    # Nor may the upload grow with the sheet
+    small, large = (f'upload {rows} rows' for rows in UPLOAD_SHEETS)
+    for size in sizes:
+        counts = results[size]['counts']
+        if counts[small]['queries'] is None or counts[large]['queries'] is None:
+            continue
+        if counts[large]['queries'] > counts[small]['queries']:
+            problems.append(f"upload: grows with the sheet ({counts[small]['queries']} -> "
+                            f"{counts[large]['queries']} for {' -> '.join(map(str, UPLOAD_SHEETS))} "
+                            f"rows at {size} students)")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='10,1000', help='Student counts, comma separated')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Where generated datasets are cached')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child)
+        return
+
+    results = {}
+    for students in [int(size) for size in args.sizes.split(',') if size.strip()]:
+        manifest = dataset(args.data_dir, students, args.seed)
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.query_budgets', '--child',
+             os.path.join(os.path.dirname(manifest['files']['database']), 'dataset.json')],
+            cwd=APP_DIR, stdout=subprocess.PIPE, text=True, check=True,
+        ).stdout
+        results[str(students)] = json.loads(output.strip().splitlines()[-1])
+
+    sizes = sorted(results, key=int)
+    budgets = {name: budget for _, name, *_, budget in cases(results[sizes[0]]['sample'])}
+    print(f"{'request':<32} {'budget':>6} " + ' '.join(f"{size + ' st.':>9}" for size in sizes))
+    for name, budget in budgets.items():
+        print(f"{name:<32} {budget:>6} " + ' '.join(
+            f"{results[size]['counts'][name]['queries']!s:>9}" for size in sizes))
+
+    problems = check(results)
+    if problems:
+        print(f"\n{len(problems)} problem(s):")
+        for problem in problems:
+            print(f"  {problem}")
+        sys.exit(1)
+    print(f"\nAll {len(budgets)} requests within budget and independent of dataset size.")
+
+
+if __name__ == '__main__':
+    main()
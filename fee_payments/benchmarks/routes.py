@@ -0,0 +1,273 @@
+"""
+Route latency and query counts on generated datasets, checked against a
+stored baseline.
+
+For each dataset size a synthetic database is generated (synthetic_data.py,
+cached under --data-dir) and a copy of it is served by the app through
+Flask's test client, in a fresh interpreter so no per-process cache is
+carried over from another size. Every route is requested once to warm up
+and then --repeat times; the median time and the query count (from the
+Server-Timing header, see query_stats.py) are recorded.
+
+Every response is checked first: a route that answers with an error
+status, a content type other than the one it should serve, or (for the
+upload) a redirect back to the form stops the run rather than having its
+error page timed.
+
+The run fails (exit status 1) when a route's median is more than
+--tolerance percent above the baseline (and at least --min-ms slower), or
+when it runs more queries than the baseline. Baselines depend on the
+machine; record your own with --update-baseline before comparing.
+
+The unpaginated student_details pages take tens of seconds at 100k
+students, so that size isn't run by default; use --repeat 1 for it.
+
+Usage:
+    python -m benchmarks.routes                              # compare with baselines/routes.json
+    python -m benchmarks.routes --sizes 1000,10000 --update-baseline
+    python -m benchmarks.routes --sizes 100000 --repeat 1
+    python -m benchmarks.routes --routes dashboard,upload --tolerance 30
+"""
+import io
+import os
+import re
+import sys
+import csv
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import time
+from datetime import datetime
+from urllib.parse import urlparse
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'routes.json')
+DEFAULT_DATA_DIR = os.path.join(tempfile.gettempdir(), 'fee_payments_datasets')
+
+QUERIES_HEADER = re.compile(r'db;desc="(\d+) queries"')
+
+HTML = 'text/html'
+JSON = 'application/json'
+CSV = 'text/csv'
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def routes(manifest, sample):
+    """(name, method, url, expected) of every benchmarked request; sample is one generated student.
+
+    expected is the content type a working GET serves, or for a form post
+    the path it redirects to on success.
+    """
+    batch_year = manifest['batches'][0]
+    return [
+        ('dashboard', 'GET', '/dashboard', HTML),
+        ('student_details', 'GET', '/student_details', HTML),
+        ('student_details batch_year', 'GET', f'/student_details?batch_year={batch_year}', HTML),
+        ('student_details branch', 'GET', '/student_details?branch=CSE', HTML),
+        ('student_details fee_type', 'GET', '/student_details?fee_type=CRT', HTML),
+        ('student_details payment_status', 'GET', '/student_details?payment_status=not_paid', HTML),
+        ('student_details regd_no', 'GET', f"/student_details?regd_no={sample['regd_no']}", HTML),
+        ('student_details student_name', 'GET', f"/student_details?student_name={sample['name'].split()[0]}",
+         HTML),
+        ('student_details display_type', 'GET', '/student_details?display_type=student_details', HTML),
+        ('unpaid_students', 'GET', '/unpaid_students', HTML),
+        ('unpaid_students csv', 'GET', '/unpaid_students?payment_status=all&download_csv=true', CSV),
+        ('unpaid_students excel', 'GET', '/unpaid_students?payment_status=all&download_excel=true', XLSX),
+        ('api_students regd_no', 'GET', f"/api/students?query={sample['regd_no'][:6]}", JSON),
+        ('api_students name', 'GET', f"/api/students?query={sample['name'].split()[1][:4]}", JSON),
+        ('api_student_fees', 'GET', f"/api/student-fees?regd_no={sample['regd_no']}", JSON),
+        ('upload', 'POST', '/upload', '/student_details'),
+    ]
+
+
+def dataset(data_dir, students, seed):
+    """Manifest of a cached generated dataset, generating it on first use"""
+    from synthetic_data import generate_dataset
+
+    out_dir = os.path.join(data_dir, f"{students}-seed{seed}")
+    manifest_path = os.path.join(out_dir, 'dataset.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            return json.load(f)
+    if os.path.exists(out_dir):
+        # Left over from an interrupted run
+        shutil.rmtree(out_dir)
+    print(f"Generating {students} students in {out_dir} ...", flush=True)
+    return generate_dataset(out_dir, students, seed, formats=('csv',))
+
+
+def _upload_sheet(manifest, rows):
+    """The first rows of the dataset's upload sheet, as CSV bytes"""
+    with open(manifest['files']['csv'], newline='', encoding='utf-8') as f:
+        lines = [line for _, line in zip(range(rows + 1), csv.reader(f))]
+    out = io.StringIO()
+    csv.writer(out).writerows(lines)
+    return out.getvalue().encode('utf-8')
+
+
+def _check(name, response, expected):
+    """Raise unless the response is what the route serves when it works"""
+    if expected.startswith('/'):
+        # Form posts redirect to the form again when they fail
+        location = urlparse(response.location or '').path
+        if response.status_code in (302, 303) and location == expected:
+            return
+        problem = f"status {response.status_code}, redirect to {location or 'nowhere'} instead of {expected}"
+    else:
+        if 200 <= response.status_code < 300 and response.mimetype == expected:
+            return
+        problem = f"status {response.status_code}, {response.mimetype} instead of {expected}"
+    raise RuntimeError(f"{name}: {problem}; not timing a route that fails")
+
+
+def _measure(client, name, method, url, expected, repeat, upload=None):
+    def request():
+        if method == 'POST':
+            data = {'excel-file': (io.BytesIO(upload), 'benchmark.csv')}
+            return client.post(url, data=data, content_type='multipart/form-data')
+        return client.get(url)
+
+    response = request()  # warm-up
+    _check(name, response, expected)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = request()
+        timings.append((time.perf_counter() - start) * 1000)
+        _check(name, response, expected)
+    match = QUERIES_HEADER.search(response.headers.get('Server-Timing', ''))
+    return {
+        'median_ms': round(statistics.median(timings), 2),
+        'min_ms': round(min(timings), 2),
+        'max_ms': round(max(timings), 2),
+        'queries': int(match.group(1)) if match else None,
+        'status': response.status_code,
+        'bytes': len(response.data),
+    }
+
+
+def run_child(manifest_path, repeat, upload_rows, only):
+    """Serve one dataset and print the results as JSON (runs in its own interpreter)"""
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    with tempfile.TemporaryDirectory() as tmp:
+        # The upload writes to the database, so work on a copy
+        db_path = os.path.join(tmp, 'fee_payments.db')
+        shutil.copy(manifest['files']['database'], db_path)
+        os.environ.update({'FEE_SECRET_KEY': 'benchmark', 'FEE_SLOW_REQUEST_MS': '0', 'FEE_METRICS': '0',
+                           'FEE_QUERY_STATS': '1'})
+        os.environ.pop('FEE_METRICS_DIR', None)
+        from synthetic_data import dataset_config
+        from app import create_app
+        from models import db, Student
+
+        config = dataset_config(db_path)
+        config.PROFILE_DIR = os.path.join(tmp, 'profiles')
+        app = create_app(config)
+        with app.app_context():
+            student = db.session.query(Student).order_by(Student.id).offset(manifest['students'] // 2).first()
+            sample = {'regd_no': student.regd_no, 'name': student.name}
+        client = app.test_client()
+        response = client.post('/admin/login', data={'username': 'admin', 'password': 'adminpass'})
+        if response.status_code != 302:
+            raise RuntimeError(f"Login failed with status {response.status_code}")
+
+        upload = _upload_sheet(manifest, upload_rows)
+        results = {}
+        # Upload last: it changes the data the other routes read
+        for name, method, url, expected in routes(manifest, sample):
+            if only and name.split()[0] not in only and name not in only:
+                continue
+            results[name] = _measure(client, name, method, url, expected, repeat,
+                                     upload if method == 'POST' else None)
+            print(f"  {name:<32} {results[name]['median_ms']:>10.1f} ms {results[name]['queries']!s:>6} queries",
+                  file=sys.stderr, flush=True)
+    print(json.dumps(results))
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """Lines describing regressions of results against baseline"""
+    regressions = []
+    for size, routes_results in results.items():
+        for name, result in routes_results.items():
+            base = baseline.get(size, {}).get(name)
+            if base is None:
+                continue
+            slower = result['median_ms'] - base['median_ms']
+            if slower > min_ms and result['median_ms'] > base['median_ms'] * (1 + tolerance / 100):
+                regressions.append(f"{size} students, {name}: {result['median_ms']:.1f} ms "
+                                   f"(baseline {base['median_ms']:.1f} ms, +{slower / base['median_ms'] * 100:.0f}%)")
+            if base.get('queries') is not None and (result['queries'] or 0) > base['queries']:
+                regressions.append(f"{size} students, {name}: {result['queries']} queries "
+                                   f"(baseline {base['queries']})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1000,10000', help='Student counts, comma separated (e.g. 1000,10000,100000)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='Timed requests per route (after one warm-up)')
+    parser.add_argument('--routes', default='', help='Only these routes (names or endpoints), comma separated')
+    parser.add_argument('--upload-rows', type=int, default=500, help='Sheet rows per benchmarked upload')
+    parser.add_argument('--tolerance', type=float, default=20.0, help='Allowed slowdown, percent')
+    parser.add_argument('--min-ms', type=float, default=5.0, help='Slowdowns smaller than this never fail')
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update-baseline', action='store_true', help='Save the results as the new baseline')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR, help='Where generated datasets are cached')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    only = {name.strip() for name in args.routes.split(',') if name.strip()}
+    if args.child:
+        run_child(args.child, args.repeat, args.upload_rows, only)
+        return
+
+    results = {}
+    for students in [int(size) for size in args.sizes.split(',') if size.strip()]:
+        manifest = dataset(args.data_dir, students, args.seed)
+        print(f"{students} students ({manifest['fee_entries']} fee entries, {manifest['payments']} payments)",
+              flush=True)
+        output = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.routes', '--child',
+             os.path.join(os.path.dirname(manifest['files']['database']), 'dataset.json'),
+             '--repeat', str(args.repeat), '--upload-rows', str(args.upload_rows), '--routes', args.routes],
+            cwd=APP_DIR, stdout=subprocess.PIPE, text=True, check=True,
+        ).stdout
+        results[str(students)] = json.loads(output.strip().splitlines()[-1])
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    if args.update_baseline:
+        recorded = {'at': datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                    'machine': platform.machine(), 'cpus': os.cpu_count(), 'repeat': args.repeat, 'seed': args.seed}
+        for size, routes_results in results.items():
+            baseline.setdefault(size, {}).update(routes_results)
+            baseline.setdefault('recorded', {})[size] = recorded
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance, args.min_ms)
+    if not baseline:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+    elif regressions:
+        print(f"{len(regressions)} regression(s) beyond {args.tolerance:g}%:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    else:
+        print(f"No regressions beyond {args.tolerance:g}% against {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""
+Reader throughput during a concurrent bulk upload, with and without the
+SQLite PRAGMA profile from sqlite_tuning.py.
+
+A writer thread loads students and fee entries in one large transaction (like
+an Excel upload), another writer records small payments, and reader threads
+run a dashboard-style aggregate. Each run reports completed reads, read
+latency and how many operations failed with "database is locked".
+
+Usage:
+    python -m benchmarks.sqlite_profile --students 20000 --readers 4
+"""
+import os
+import time
+import argparse
+import tempfile
+import threading
+from datetime import date
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+from models import db
+from sqlite_tuning import DEFAULT_SQLITE_PRAGMAS, install_sqlite_profile
+
+FEE_TYPES = ['CRT Fee', 'Bus Fee', 'Hostel Fee']
+BATCHES = ['2021', '2022', '2023', '2024']
+BRANCHES = ['CSE', 'ECE']
+
+DASHBOARD_SQL = text('''
+    SELECT s.batch_id, f.fee_type_id, COUNT(*), SUM(f.amount_paise)
+    FROM fee_master f JOIN student s ON s.id = f.student_id
+    GROUP BY s.batch_id, f.fee_type_id
+''')
+
+INSERT_STUDENT_SQL = text(
+    "INSERT INTO student (regd_no, name, batch_id, branch_id) VALUES (:r, :n, :b, :br)"
+)
+INSERT_FEE_SQL = text(
+    "INSERT INTO fee_master (student_id, fee_type_id, fee_type, amount_paise) VALUES (:s, :t, :tn, :a)"
+)
+
+
+def _student(regd_no, name, i, branch):
+    # Dimension ids are 1-based in the order they are seeded
+    return {'r': regd_no, 'n': name, 'b': 1 + i % len(BATCHES), 'br': 1 + BRANCHES.index(branch)}
+
+
+def _make_engine(path, pragmas):
+    # Same bare URI as the app, so the unprofiled run keeps the pysqlite 5s lock timeout
+    engine = create_engine(f"sqlite:///{path}")
+    install_sqlite_profile(engine, pragmas)
+    return engine
+
+
+def _seed(engine, students):
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO batch (name) VALUES (:n)"), [{'n': name} for name in BATCHES])
+        conn.execute(text("INSERT INTO branch (name) VALUES (:n)"), [{'n': name} for name in BRANCHES])
+        conn.execute(text("INSERT INTO fee_type (code, label) VALUES (:n, :n)"), [{'n': name} for name in FEE_TYPES])
+        conn.execute(INSERT_STUDENT_SQL, [
+            _student(f"SEED{i:06d}", f"Seed {i}", i, 'CSE') for i in range(students)
+        ])
+        conn.execute(INSERT_FEE_SQL, [
+            {'s': i + 1, 't': 1 + i % 3, 'tn': FEE_TYPES[i % 3], 'a': 500000}
+            for i in range(students)
+        ])
+
+
+def _bulk_upload(engine, students, stats):
+    """One long transaction, the way an upload commits"""
+    start = time.perf_counter()
+    try:
+        with engine.begin() as conn:
+            for i in range(students):
+                student_id = conn.execute(
+                    INSERT_STUDENT_SQL, _student(f"UP{i:06d}", f"Upload {i}", i, 'ECE')
+                ).lastrowid
+                for fee_type_id, fee_type in enumerate(FEE_TYPES, start=1):
+                    conn.execute(INSERT_FEE_SQL, {'s': student_id, 't': fee_type_id, 'tn': fee_type, 'a': 250000})
+    except OperationalError:
+        stats['upload_failed'] = True
+    stats['upload_seconds'] = time.perf_counter() - start
+
+
+def _payments(engine, stop, stats):
+    """Small independent writes, like cashiers recording payments"""
+    i = 0
+    while not stop.is_set():
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(
+                    "INSERT INTO payment (student_id, batch_id, fee_type_id, fee_type, "
+                    "amount_paid_paise, date, received_by) "
+                    "VALUES (:s, 4, 1, 'CRT Fee', 100000, :d, 'bench')"
+                ), {'s': 1 + i % 100, 'd': date.today()})
+            stats['payments'] += 1
+        except OperationalError:
+            stats['payment_errors'] += 1
+        i += 1
+        time.sleep(0.005)
+
+
+def _reader(engine, stop, latencies, stats, lock):
+    local = []
+    errors = 0
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            with engine.connect() as conn:
+                conn.execute(DASHBOARD_SQL).fetchall()
+            local.append(time.perf_counter() - start)
+        except OperationalError:
+            errors += 1
+    with lock:
+        latencies.extend(local)
+        stats['read_errors'] += errors
+
+
+def run(label, pragmas, students, readers):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        engine = _make_engine(path, pragmas)
+        _seed(engine, students)
+
+        stats = {'payments': 0, 'payment_errors': 0, 'read_errors': 0, 'upload_failed': False}
+        latencies = []
+        lock = threading.Lock()
+        stop = threading.Event()
+
+        threads = [threading.Thread(target=_reader, args=(engine, stop, latencies, stats, lock))
+                   for _ in range(readers)]
+        threads.append(threading.Thread(target=_payments, args=(engine, stop, stats)))
+        for thread in threads:
+            thread.start()
+
+        _bulk_upload(engine, students, stats)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    elapsed = stats['upload_seconds']
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else float('nan')
+    worst = latencies[-1] * 1000 if latencies else float('nan')
+    print(f"{label:>10}: upload {elapsed:6.2f}s{' (FAILED)' if stats['upload_failed'] else ''} | "
+          f"reads {len(latencies):6d} ({len(latencies) / elapsed:8.1f}/s, p95 {p95:7.1f} ms, max {worst:7.1f} ms, "
+          f"{stats['read_errors']} locked) | "
+          f"payments {stats['payments']} ({stats['payment_errors']} locked)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20000, help='Students in the seed data and in the upload')
+    parser.add_argument('--readers', type=int, default=4, help='Concurrent reader threads')
+    args = parser.parse_args()
+
+    run('defaults', {}, args.students, args.readers)
+    run('profile', DEFAULT_SQLITE_PRAGMAS, args.students, args.readers)
+
+
+if __name__ == '__main__':
+    main()
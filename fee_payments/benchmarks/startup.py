@@ -0,0 +1,87 @@
+"""
+Startup latency: importing app, building it with create_app() and serving
+the first requests, each measured in a fresh interpreter.
+
+The first /upload GET is cheap, the first /dashboard renders charts and so
+pays for the pandas/matplotlib imports unless FEE_WARMUP=1 moved them into
+create_app(). Both modes are run and the median of each step is reported.
+
+Usage:
+    python -m benchmarks.startup --runs 5
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter and prints one JSON line of timings (ms)
+PROBE = r'''
+import sys, json, time
+t0 = time.perf_counter()
+import app as app_module
+t1 = time.perf_counter()
+heavy_after_import = sorted(m for m in ('pandas', 'numpy', 'matplotlib') if m in sys.modules)
+app = app_module.create_app()
+t2 = time.perf_counter()
+client = app.test_client()
+client.post('/admin/login', data={'username': 'admin', 'password': 'adminpass'})
+t3 = time.perf_counter()
+client.get('/dashboard')
+t4 = time.perf_counter()
+client.get('/dashboard')
+t5 = time.perf_counter()
+print(json.dumps({
+    'import_app': (t1 - t0) * 1000,
+    'create_app': (t2 - t1) * 1000,
+    'first_request': (t3 - t2) * 1000,
+    'first_dashboard': (t4 - t3) * 1000,
+    'warm_dashboard': (t5 - t4) * 1000,
+    'heavy_after_import': heavy_after_import,
+}))
+'''
+
+STEPS = ['import_app', 'create_app', 'first_request', 'first_dashboard', 'warm_dashboard']
+
+
+def _run_once(env):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=APP_DIR, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(label, warmup, runs, tmp):
+    env = dict(os.environ)
+    env.update({
+        'FEE_DATABASE_URL': 'sqlite:///' + os.path.join(tmp, 'fee_payments.db'),
+        'FEE_SECRET_KEY': 'startup-benchmark',
+        'FEE_WARMUP': '1' if warmup else '0',
+    })
+    # The first run creates the database; keep it out of the numbers
+    _run_once(env)
+    samples = [_run_once(env) for _ in range(runs)]
+
+    row = {step: statistics.median(s[step] for s in samples) for step in STEPS}
+    print(f"{label:>8}: " + "  ".join(f"{step} {row[step]:7.1f} ms" for step in STEPS))
+    print(f"{'':>8}  heavy modules loaded by 'import app': {samples[0]['heavy_after_import'] or 'none'}")
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        measure('lazy', False, args.runs, tmp)
+        measure('warm-up', True, args.runs, tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""
+Join cost of fee_master/payment -> student through the regd_no string
+versus the integer student_id foreign key.
+
+Builds the same synthetic ledger with the old schema, where fee_master and
+payment carry regd_no, and with student_id. Then it times the query shapes
+the app runs:
+
+- ledger:  every fee entry joined to its student and to the per-student
+  payment totals, grouped by batch (dashboard / student details)
+- lookup:  one student's fees and payments by registration number
+  (api/student-fees, payments page), repeated for random students
+
+The "regd_no + index" run adds indexes on the regd_no columns, so the
+comparison isn't just "no index" versus "index".
+
+Usage:
+    python -m benchmarks.student_joins --students 100000 --lookups 200
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+from sqlite_tuning import DEFAULT_SQLITE_PRAGMAS, apply_pragmas
+
+FEE_TYPES = 3
+BATCHES = ['2021-2025', '2022-2026', '2023-2027', '2024-2028']
+
+SCHEMAS = {
+    'regd_no': {
+        'key': 'regd_no TEXT NOT NULL REFERENCES student (regd_no)',
+        'indexes': [],
+    },
+    'regd_no + index': {
+        'key': 'regd_no TEXT NOT NULL REFERENCES student (regd_no)',
+        'indexes': ['CREATE INDEX ix_fee_master_regd_no ON fee_master (regd_no)',
+                    'CREATE INDEX ix_payment_regd_no ON payment (regd_no)'],
+    },
+    'student_id': {
+        'key': 'student_id INTEGER NOT NULL REFERENCES student (id)',
+        'indexes': ['CREATE INDEX ix_fee_master_student_id ON fee_master (student_id)',
+                    'CREATE INDEX ix_payment_student_id ON payment (student_id)'],
+    },
+}
+
+LEDGER_SQL = '''
+    SELECT s.batch_year, COUNT(*), SUM(f.amount_paise), SUM(COALESCE(p.paid_paise, 0))
+    FROM student s
+    JOIN fee_master f ON {fee_join}
+    LEFT JOIN (
+        SELECT {key} AS key, fee_type_id, SUM(amount_paid_paise) AS paid_paise
+        FROM payment GROUP BY {key}, fee_type_id
+    ) p ON p.key = f.{key} AND p.fee_type_id = f.fee_type_id
+    GROUP BY s.batch_year
+'''
+
+LOOKUP_SQL = '''
+    SELECT f.fee_type_id, f.amount_paise,
+           (SELECT COALESCE(SUM(p.amount_paid_paise), 0) FROM payment p
+            WHERE p.{key} = f.{key} AND p.fee_type_id = f.fee_type_id)
+    FROM student s JOIN fee_master f ON {fee_join}
+    WHERE s.regd_no = ?
+'''
+
+
+def _build(path, schema, students):
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, DEFAULT_SQLITE_PRAGMAS)
+    key_column = schema['key'].split()[0]
+    conn.executescript(f'''
+        CREATE TABLE student (
+            id INTEGER PRIMARY KEY,
+            regd_no VARCHAR(20) NOT NULL UNIQUE,
+            name VARCHAR(100) NOT NULL,
+            batch_year VARCHAR(10) NOT NULL
+        );
+        CREATE TABLE fee_master (
+            id INTEGER PRIMARY KEY,
+            {schema['key']},
+            fee_type_id INTEGER NOT NULL,
+            amount_paise INTEGER NOT NULL
+        );
+        CREATE TABLE payment (
+            id INTEGER PRIMARY KEY,
+            {schema['key']},
+            fee_type_id INTEGER NOT NULL,
+            amount_paid_paise INTEGER NOT NULL
+        );
+    ''')
+    rng = random.Random(42)
+    regd_nos = [f"{21 + i % 4}B01A{i:06d}" for i in range(students)]
+    conn.executemany("INSERT INTO student (id, regd_no, name, batch_year) VALUES (?, ?, ?, ?)", (
+        (i + 1, regd_no, f"Student {i}", BATCHES[i % len(BATCHES)]) for i, regd_no in enumerate(regd_nos)
+    ))
+
+    def key(i):
+        return i + 1 if key_column == 'student_id' else regd_nos[i]
+
+    conn.executemany(f"INSERT INTO fee_master ({key_column}, fee_type_id, amount_paise) VALUES (?, ?, ?)", (
+        (key(i), fee_type_id, 500000) for i in range(students) for fee_type_id in range(1, FEE_TYPES + 1)
+    ))
+    conn.executemany(f"INSERT INTO payment ({key_column}, fee_type_id, amount_paid_paise) VALUES (?, ?, ?)", (
+        (key(i), rng.randint(1, FEE_TYPES), rng.choice([100000, 250000, 500000]))
+        for i in range(students) for _ in range(rng.randint(0, 3))
+    ))
+    for index_sql in schema['indexes']:
+        conn.execute(index_sql)
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.execute("VACUUM")
+    return conn, regd_nos
+
+
+def _time(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(label, schema, students, lookups, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        conn, regd_nos = _build(path, schema, students)
+        key = schema['key'].split()[0]
+        fee_join = 'f.student_id = s.id' if key == 'student_id' else 'f.regd_no = s.regd_no'
+
+        ledger_sql = LEDGER_SQL.format(key=key, fee_join=fee_join)
+        lookup_sql = LOOKUP_SQL.format(key=key, fee_join=fee_join)
+        sample = random.Random(7).sample(regd_nos, min(lookups, len(regd_nos)))
+
+        ledger = _time(lambda: conn.execute(ledger_sql).fetchall(), repeat)
+        lookup = _time(lambda: [conn.execute(lookup_sql, (regd_no,)).fetchall() for regd_no in sample], repeat)
+        size_mb = os.path.getsize(path) / 1e6
+        conn.close()
+
+    print(f"{label:>16}: ledger {ledger * 1000:8.1f} ms | "
+          f"{len(sample)} lookups {lookup * 1000:8.1f} ms ({lookup / len(sample) * 1e6:6.1f} us each) | "
+          f"db {size_mb:6.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=200, help='Single-student lookups per timing')
+    parser.add_argument('--repeat', type=int, default=3, help='Timings per query (best is reported)')
+    args = parser.parse_args()
+
+    print(f"{args.students} students, {args.students * FEE_TYPES} fee entries")
+    for label, schema in SCHEMAS.items():
+        run(label, schema, args.students, args.lookups, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
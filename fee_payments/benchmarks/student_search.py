@@ -0,0 +1,129 @@
+"""
+/api/students autocomplete latency: LIKE scan versus the student_search
+trigram index.
+
+Builds a synthetic student table, then replays the queries a user produces
+while typing registration numbers and names (every prefix of three or more
+characters), and reports p50 / p99 / max per query.
+
+Usage:
+    python -m benchmarks.student_search --students 100000
+"""
+import os
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+
+from sqlite_tuning import DEFAULT_SQLITE_PRAGMAS, apply_pragmas
+from student_index import RegdNoIndex, entry_of
+from student_search import SEARCH_SQL, MAX_CANDIDATES, install_student_search, _like_escape, _fts_phrase
+
+FIRST_NAMES = ['Aarav', 'Aditya', 'Ananya', 'Arjun', 'Deepika', 'Divya', 'Harsha', 'Karthik', 'Keerthi',
+               'Lakshmi', 'Manoj', 'Meghana', 'Naveen', 'Pavan', 'Priya', 'Rahul', 'Ramesh', 'Sai',
+               'Sandeep', 'Sravani', 'Srinivas', 'Swathi', 'Teja', 'Vamsi', 'Venkat', 'Vijay']
+SURNAMES = ['Kumar', 'Reddy', 'Rao', 'Naidu', 'Sharma', 'Varma', 'Chowdary', 'Goud', 'Raju', 'Prasad',
+            'Krishna', 'Babu', 'Devi', 'Lakshmi', 'Murthy', 'Sastry']
+
+LIKE_SQL = '''
+    SELECT s.regd_no, s.name, b.name FROM student s JOIN batch b ON b.id = s.batch_id
+    WHERE s.regd_no LIKE ? ESCAPE '\\' OR s.name LIKE ? ESCAPE '\\'
+    LIMIT 10
+'''
+
+
+def _build(path, students):
+    conn = sqlite3.connect(path)
+    apply_pragmas(conn, DEFAULT_SQLITE_PRAGMAS)
+    conn.execute("CREATE TABLE batch (id INTEGER PRIMARY KEY, name VARCHAR(20) NOT NULL UNIQUE)")
+    conn.execute('''
+        CREATE TABLE student (
+            id INTEGER PRIMARY KEY,
+            regd_no VARCHAR(20) NOT NULL UNIQUE,
+            name VARCHAR(100) NOT NULL,
+            batch_id INTEGER NOT NULL REFERENCES batch (id)
+        )
+    ''')
+    conn.executemany("INSERT INTO batch (id, name) VALUES (?, ?)",
+                     [(1 + i, f"{2021 + i}-{2025 + i}") for i in range(4)])
+    rng = random.Random(42)
+    conn.executemany("INSERT INTO student (regd_no, name, batch_id) VALUES (?, ?, ?)", (
+        (f"{21 + i % 4}B01A{i:06d}",
+         f"{rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}".upper(),
+         1 + i % 4)
+        for i in range(students)
+    ))
+    conn.commit()
+    return conn
+
+
+def _typed(value):
+    """Queries sent while value is typed in: every prefix of three or more characters"""
+    return [value[:n] for n in range(3, len(value) + 1)]
+
+
+def _queries(conn, samples):
+    rng = random.Random(7)
+    rows = conn.execute("SELECT regd_no, name FROM student ORDER BY random() LIMIT ?", (samples,)).fetchall()
+    queries = []
+    for regd_no, name in rows:
+        queries += _typed(regd_no)
+        queries += _typed(rng.choice(name.split()).title())
+        queries.append(regd_no[-5:])  # the tail a user remembers
+    return queries
+
+
+def _search(conn, index, query):
+    rows = index.prefix(query, 10)
+    if len(rows) == 10:
+        return rows
+    escaped = _like_escape(query)
+    return rows + conn.execute(SEARCH_SQL.text, {
+        'match': _fts_phrase(query), 'candidates': MAX_CANDIDATES,
+        'prefix': escaped + '%', 'word_prefix': '% ' + escaped + '%', 'limit': 10,
+    }).fetchall()
+
+
+def _like(conn, query):
+    escaped = f"%{_like_escape(query)}%"
+    return conn.execute(LIKE_SQL, (escaped, escaped)).fetchall()
+
+
+def _report(label, fn, conn, queries):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        fn(conn, query)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1000
+    p99 = timings[int(len(timings) * 0.99)] * 1000
+    print(f"{label:>8}: {len(queries)} queries | p50 {p50:7.2f} ms | p99 {p99:7.2f} ms | max {timings[-1] * 1000:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--samples', type=int, default=50, help='Students whose number and name are typed in')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = _build(os.path.join(tmp, 'bench.db'), args.students)
+        queries = _queries(conn, args.samples)
+        print(f"{args.students} students")
+        _report('LIKE', _like, conn, queries)
+
+        start = time.perf_counter()
+        install_student_search(conn)
+        conn.commit()
+        print(f"Built student_search in {(time.perf_counter() - start) * 1000:.0f} ms")
+        index = RegdNoIndex(entry_of(row) for row in conn.execute(
+            "SELECT s.id, s.regd_no, s.name, b.name FROM student s JOIN batch b ON b.id = s.batch_id"))
+        print(f"Built the regd_no index: {index.memory_bytes() / 1e6:.1f} MB")
+        _report('trigram', lambda conn, query: _search(conn, index, query), conn, queries)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
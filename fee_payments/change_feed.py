@@ -0,0 +1,108 @@
+"""
+Change-data-capture feed over the change_log table.
+
+Every insert, update and delete on student, fee_master and payment gets a
+monotonically increasing change_log.seq (maintained by SQLite triggers).
+A consumer keeps the last seq it has seen as its cursor and asks only for
+newer entries, so an incremental sync costs time proportional to the
+number of changes rather than the size of the ledger.
+
+Rows moved to a batch's archive file (cold_storage.py) are reported with
+op 'archive' rather than 'delete', and with op 'restore' when they come
+back.
+"""
+import json
+from datetime import date, datetime
+
+from models import db, Batch, Branch, Student, FeeMaster, Payment, ChangeLog
+
+DEFAULT_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 5000
+
+# Operations after which the row is no longer in the hot database
+GONE_OPERATIONS = ('delete', 'archive')
+
+TRACKED_MODELS = {
+    'student': Student,
+    'fee_master': FeeMaster,
+    'payment': Payment,
+}
+
+# Rows store batch and branch ids only; their names are joined in and added
+# to the record under these keys
+DIMENSION_NAMES = {
+    'student': [('batch_year', Batch, Student.batch_id), ('branch', Branch, Student.branch_id)],
+    'payment': [('batch_year', Batch, Payment.batch_id)],
+}
+
+
+def _serialize_row(model, row):
+    record = {}
+    for column in model.__table__.columns:
+        value = getattr(row, column.key)
+        if isinstance(value, (date, datetime)):
+            value = value.isoformat()
+        record[column.key] = value
+    return record
+
+
+def read_changes(since=0, limit=DEFAULT_PAGE_SIZE):
+    """Return (changes, next_cursor, has_more) for entries with seq > since.
+
+    Inserted and updated rows carry their current state; a row that has
+    been deleted since the change was logged is reported with row=None.
+    """
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+
+    # Fetch one extra entry to know whether another page follows
+    entries = ChangeLog.query.filter(
+        ChangeLog.seq > since
+    ).order_by(
+        ChangeLog.seq
+    ).limit(limit + 1).all()
+
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    # One lookup per table for the rows referenced on this page
+    current_rows = {}
+    for table_name, model in TRACKED_MODELS.items():
+        row_ids = {e.row_id for e in entries if e.table_name == table_name and e.operation not in GONE_OPERATIONS}
+        if not row_ids:
+            continue
+        query = db.session.query(model).filter(model.id.in_(row_ids))
+        added = []
+        if model is not Student:
+            # Fee and payment rows reference the student by id; add the registration number back
+            query = query.join(Student, Student.id == model.student_id)
+            added.append(('regd_no', Student.regd_no))
+        for key, dimension, id_column in DIMENSION_NAMES.get(table_name, []):
+            query = query.join(dimension, dimension.id == id_column)
+            added.append((key, dimension.name))
+        query = query.add_columns(*[column for _, column in added])
+        current_rows[table_name] = {
+            row.id: dict(_serialize_row(model, row), **{key: value for (key, _), value in zip(added, values)})
+            for row, *values in query
+        }
+
+    changes = []
+    for entry in entries:
+        row = None
+        if entry.operation not in GONE_OPERATIONS:
+            row = current_rows.get(entry.table_name, {}).get(entry.row_id)
+        changes.append({
+            'seq': entry.seq,
+            'table': entry.table_name,
+            'op': entry.operation,
+            'id': entry.row_id,
+            'changed_at': entry.changed_at.isoformat() if entry.changed_at else None,
+            'row': row,
+        })
+
+    next_cursor = entries[-1].seq if entries else since
+    return changes, next_cursor, has_more
+
+
+def to_json_lines(changes):
+    """Serialize change records as JSON Lines"""
+    return ''.join(json.dumps(change, ensure_ascii=False) + '\n' for change in changes)
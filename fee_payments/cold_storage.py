@@ -0,0 +1,268 @@
+"""
+Year-end cold storage for whole batch years.
+
+Closed batches used to stay in the hot database forever, so every dashboard
+and report scan walked their students, fee entries and payments too.
+
+    flask archive batch 2021-2025      # move the batch to instance/archive/batch_2021-2025.db
+    flask archive list
+    flask archive restore 2021-2025    # move it back
+
+An archive file is an ordinary SQLite database with the same tables as the
+hot one (student, fee_master, payment and the batch, branch and fee_type
+rows they reference), so it can be opened with any SQLite tool. The move
+happens on one connection with the file ATTACHed:
+
+1. INSERT OR REPLACE ... SELECT copies the batch into the file and commits
+   (re-running after a crash is harmless)
+2. BEGIN IMMEDIATE takes the write lock, and the row counts on both sides
+   are compared
+3. the rows are deleted from the hot database and the cold_archive
+   registry row is added, in the same transaction
+
+Holding the write lock from the count to the deletes means no other worker
+can add a payment for the batch in between; a row written after the copy
+makes the counts differ and the move stops with nothing deleted.
+
+The change_log entries of the move are tagged 'archive' (and 'restore' on
+the way back) instead of 'delete' and 'insert', so change-feed consumers
+can tell a batch leaving the hot database from records being deleted.
+
+WAL mode makes a transaction atomic per file only, hence copy, check, then
+delete rather than one transaction spanning both files.
+
+The batch row itself stays in the hot database, so the batch still shows
+in the filter dropdowns. Student details for an archived batch are read
+from its file only when an admin asks for history (historical_session()).
+"""
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from models import db, Batch, Branch, FeeType, Student, FeeMaster, Payment, ColdArchive
+
+# Schema name the archive file is attached under
+ATTACH_AS = 'cold'
+
+# Tables copied to an archive file (parents first) and the rows of a batch in each;
+# "t" is the table being copied and :batch_id the archived batch
+BATCH_STUDENTS = "SELECT id FROM main.student WHERE batch_id = :batch_id"
+COLD_TABLES = [
+    (Batch.__table__, "t.id = :batch_id"),
+    (Branch.__table__, "t.id IN (SELECT branch_id FROM main.student WHERE batch_id = :batch_id)"),
+    (FeeType.__table__, "1"),
+    (Student.__table__, "t.batch_id = :batch_id"),
+    (FeeMaster.__table__, f"t.student_id IN ({BATCH_STUDENTS})"),
+    (Payment.__table__, f"t.student_id IN ({BATCH_STUDENTS})"),
+]
+
+# Rows removed from the hot database, children first
+MOVED_TABLES = ['payment', 'fee_master', 'student']
+
+
+def archive_dir():
+    return current_app.config.get('ARCHIVE_DIR') or os.path.join(current_app.instance_path, 'archive')
+
+
+def archive_path(batch_name):
+    safe_name = re.sub(r'[^A-Za-z0-9_-]+', '_', batch_name).strip('_') or 'batch'
+    return os.path.join(archive_dir(), f"batch_{safe_name}.db")
+
+
+def archived_batch(batch_name):
+    """ColdArchive row for a batch name, or None if the batch is in the hot database"""
+    if not batch_name:
+        return None
+    return ColdArchive.query.join(Batch).filter(Batch.name == batch_name).first()
+
+
+def _columns(table):
+    return ', '.join(column.name for column in table.columns)
+
+
+@contextmanager
+def _attached(path):
+    """A raw sqlite3 connection from the pool with path ATTACHed as cold"""
+    raw = db.engine.raw_connection()
+    conn = raw.driver_connection
+    try:
+        # ATTACH can't run inside a transaction
+        conn.commit()
+        conn.execute(f"ATTACH DATABASE ? AS {ATTACH_AS}", (path,))
+        try:
+            yield conn
+        finally:
+            # Undoes whatever wasn't committed
+            conn.rollback()
+            conn.execute(f"DETACH DATABASE {ATTACH_AS}")
+    finally:
+        raw.close()
+
+
+def _tag_changes(conn, after_seq, operation, tag):
+    """Relabel the change_log entries logged by this transaction since after_seq"""
+    conn.execute("UPDATE change_log SET operation = ? WHERE seq > ? AND operation = ?",
+                 (tag, after_seq, operation))
+
+
+def _last_change(conn):
+    return conn.execute("SELECT IFNULL(MAX(seq), 0) FROM change_log").fetchone()[0]
+
+
+def archive_batch_year(batch_name):
+    """Move a batch's students, fee entries and payments to its archive file; returns the ColdArchive"""
+    batch = Batch.query.filter_by(name=batch_name).first()
+    if batch is None:
+        raise ValueError(f"Unknown batch: {batch_name}")
+    if archived_batch(batch_name) is not None:
+        raise ValueError(f"Batch {batch_name} is already archived")
+    batch_id = batch.id
+    path = archive_path(batch_name)
+    db.session.commit()
+
+    # Same tables, indexes and constraints as the hot database
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    engine = create_engine(f"sqlite:///{path}")
+    db.metadata.create_all(engine, tables=[table for table, _ in COLD_TABLES])
+    engine.dispose()
+
+    params = {'batch_id': batch_id}
+    with _attached(path) as conn:
+        # 1. Copy, committed in the archive file
+        for table, where in COLD_TABLES:
+            columns = _columns(table)
+            conn.execute(
+                f"INSERT OR REPLACE INTO {ATTACH_AS}.{table.name} ({columns}) "
+                f"SELECT {columns} FROM main.{table.name} t WHERE {where}", params
+            )
+        conn.commit()
+
+        # 2. Both sides must hold the same rows before anything is deleted; the write
+        # lock keeps them that way until the deletes below are committed
+        conn.execute("BEGIN IMMEDIATE")
+        counts = {}
+        for table, where in COLD_TABLES:
+            hot = conn.execute(f"SELECT COUNT(*) FROM main.{table.name} t WHERE {where}", params).fetchone()[0]
+            cold = conn.execute(f"SELECT COUNT(*) FROM {ATTACH_AS}.{table.name} t WHERE {where}", params).fetchone()[0]
+            if hot != cold:
+                raise RuntimeError(f"{table.name}: {hot} rows in the hot database but {cold} in {path} "
+                                   "(changed while it was being copied? run the archive again)")
+            counts[table.name] = hot
+
+        # 3. Delete from the hot database and register the file
+        student_ids = BATCH_STUDENTS.replace('main.', '')
+        conn.execute(f"DELETE FROM student_selection_member WHERE student_id IN ({student_ids})", params)
+        last_change = _last_change(conn)
+        for table in MOVED_TABLES:
+            where = "batch_id = :batch_id" if table == 'student' else f"student_id IN ({student_ids})"
+            conn.execute(f"DELETE FROM {table} WHERE {where}", params)
+        _tag_changes(conn, last_change, 'delete', 'archive')
+        conn.execute(
+            "INSERT INTO cold_archive (batch_id, path, archived_at, students, fee_entries, payments) "
+            "VALUES (:batch_id, :path, CURRENT_TIMESTAMP, :students, :fee_entries, :payments)",
+            {'batch_id': batch_id, 'path': path, 'students': counts['student'],
+             'fee_entries': counts['fee_master'], 'payments': counts['payment']}
+        )
+        conn.commit()
+
+    current_app.logger.info("Archived batch %s to %s: %s", batch_name, path, counts)
+    return archived_batch(batch_name)
+
+
+def restore_batch_year(batch_name):
+    """Move an archived batch back into the hot database; returns the restored row counts"""
+    record = archived_batch(batch_name)
+    if record is None:
+        raise ValueError(f"Batch {batch_name} is not archived")
+    path = record.path
+    db.session.commit()
+
+    counts = {}
+    with _attached(path) as conn:
+        last_change = _last_change(conn)
+        for table, _ in COLD_TABLES:
+            columns = _columns(table)
+            # Dimension rows are never deleted from the hot database
+            verb = "INSERT OR IGNORE" if table.name in ('batch', 'branch', 'fee_type') else "INSERT"
+            counts[table.name] = conn.execute(
+                f"{verb} INTO main.{table.name} ({columns}) SELECT {columns} FROM {ATTACH_AS}.{table.name}"
+            ).rowcount
+        _tag_changes(conn, last_change, 'insert', 'restore')
+        conn.execute("DELETE FROM cold_archive WHERE id = ?", (record.id,))
+        conn.commit()
+
+    # Keep the file, renamed, until someone deletes it by hand
+    os.replace(path, f"{path}.restored")
+    current_app.logger.info("Restored batch %s from %s: %s", batch_name, path, counts)
+    return counts
+
+
+@contextmanager
+def historical_session(record):
+    """ORM session that reads an archived batch's file.
+
+    The file is ATTACHed to a pooled connection and the session renders every
+    table as cold.<table>, so queries built with db.session can run on it
+    unchanged through Query.with_session().
+    """
+    with db.engine.connect() as connection:
+        connection.exec_driver_sql(f"ATTACH DATABASE ? AS {ATTACH_AS}", (record.path,))
+        session = Session(bind=connection.execution_options(schema_translate_map={None: ATTACH_AS}))
+        try:
+            yield session
+        finally:
+            session.close()
+            connection.rollback()
+            connection.exec_driver_sql(f"DETACH DATABASE {ATTACH_AS}")
+
+
+# --- flask archive ... -------------------------------------------------------
+
+archive_cli = AppGroup('archive', help="Move closed batch years to per-year archive files.")
+
+
+@archive_cli.command('batch')
+@click.argument('batch_year')
+@click.option('--vacuum', is_flag=True, help="VACUUM the hot database afterwards to give the space back")
+def archive_batch_command(batch_year, vacuum):
+    """Move a batch year to its archive file"""
+    try:
+        record = archive_batch_year(batch_year)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    print(f"Archived {record.students} students, {record.fee_entries} fee entries and "
+          f"{record.payments} payments to {record.path}")
+    if vacuum:
+        with db.engine.connect() as connection:
+            connection.exec_driver_sql("VACUUM")
+        print("Vacuumed the hot database.")
+
+
+@archive_cli.command('restore')
+@click.argument('batch_year')
+def restore_batch_command(batch_year):
+    """Move an archived batch year back into the hot database"""
+    try:
+        counts = restore_batch_year(batch_year)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    except sqlite3.IntegrityError as e:
+        # Usually a student re-added to the hot database since the batch was archived
+        raise click.ClickException(f"Could not restore {batch_year}, nothing was changed: {e}")
+    print(f"Restored {counts['student']} students, {counts['fee_master']} fee entries and "
+          f"{counts['payment']} payments.")
+
+
+@archive_cli.command('list')
+def list_archives():
+    """Show archived batch years"""
+    for record in ColdArchive.query.order_by(ColdArchive.archived_at):
+        print(f"{record.batch.name:<12} {record.archived_at:%Y-%m-%d}  {record.students:>6} students  "
+              f"{record.fee_entries:>7} fees  {record.payments:>7} payments  {record.path}")
@@ -0,0 +1,128 @@
+"""
+Application configuration.
+
+Settings come from environment variables so every worker process of a
+production server (see wsgi.py and gunicorn.conf.py) ends up with the same
+values. The defaults keep the development server working unchanged.
+
+    FEE_DATABASE_URL         SQLAlchemy URI (default: sqlite:///fee_payments.db in instance/)
+    FEE_SECRET_KEY           Session signing key shared by all workers
+    FEE_SECRET_KEY_FILE      Where to keep a generated key when FEE_SECRET_KEY is unset
+    FEE_BOOTSTRAP_ON_IMPORT  "1" to create tables, migrate and add the default admin in create_app()
+    FEE_WARMUP               "1" to import pandas/matplotlib and connect to the DB in create_app()
+    FEE_FILTER_OPTIONS_MAX_AGE  Seconds before a worker re-checks the cached dropdown lists (default 30)
+    FEE_STUDENT_INDEX_MAX_AGE   Seconds before a worker applies other processes' student changes (default 5)
+    FEE_ARCHIVE_DIR          Where "flask archive batch" writes per-year archive files (default instance/archive)
+    FEE_QUERY_STATS          "0" to stop counting SQL per request (Server-Timing, /admin/query-stats)
+    FEE_QUERY_STATS_WINDOW   Requests kept for /admin/query-stats (default 1000)
+    FEE_SLOW_REQUEST_MS      Requests at least this slow go to the slow-request log (default 1000, 0: off)
+    FEE_SLOW_LOG             Slow-request log file (default instance/slow_requests.jsonl)
+    FEE_METRICS              "0" to turn off the Prometheus endpoint /metrics
+    FEE_METRICS_DIR          Directory the workers share metric values through (gunicorn.conf.py sets it)
+    FEE_METRICS_TOKEN        Bearer token /metrics requires (default: none)
+    FEE_PROFILE_DIR          Where request profiles are saved (default instance/profiles)
+    FEE_PROFILE_SAMPLE_RATE  Fraction of requests to profile, 0 to 1 (default 0: only ?__profile=1)
+    FEE_PROFILE_KEEP         Profiles kept in FEE_PROFILE_DIR (default 100)
+    FEE_MEMORY_PROFILE       "1" to trace memory of uploads and exports with tracemalloc (see memory_profile.py)
+    FEE_MEMORY_PROFILE_FRAMES  Stack frames kept per traced allocation (default 6; fewer is faster)
+    FEE_MEMORY_LOG           Memory profile log file (default instance/memory_profiles.jsonl)
+    FEE_LOG_LEVEL            Level of the app's loggers (default INFO)
+    FEE_LOG_LEVELS           Levels of single loggers, e.g. "fee_payments.upload=DEBUG,sqlalchemy.engine=INFO"
+    FEE_LOG_FORMAT           "json" (default) or "text" for the log on stderr
+    FEE_LOG_FILE             Also write JSON logs to this file (rotates at 50 MB)
+    FEE_LOG_SAMPLE_FIRST     Per-row messages logged per request before sampling starts (default 20)
+    FEE_LOG_SAMPLE_EVERY     After that, one in this many is logged (default 100)
+"""
+import os
+import time
+import secrets
+from datetime import timedelta
+
+from sqlite_tuning import DEFAULT_SQLITE_PRAGMAS
+
+SECRET_KEY_FILENAME = 'secret_key'
+
+
+def _env_flag(name, default):
+    return os.environ.get(name, default).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+class Config:
+    SQLALCHEMY_DATABASE_URI = os.environ.get('FEE_DATABASE_URL', 'sqlite:///fee_payments.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    PERMANENT_SESSION_LIFETIME = timedelta(days=7)  # For "remember me" functionality
+    # PRAGMAs applied to every SQLite connection (WAL, busy_timeout, cache); {} keeps SQLite defaults
+    SQLITE_PRAGMAS = dict(DEFAULT_SQLITE_PRAGMAS)
+    # The dev server bootstraps the database at startup; wsgi.py turns this off so
+    # workers don't all race to run create_all/migrations (use "flask init-db")
+    BOOTSTRAP_DB_ON_IMPORT = _env_flag('FEE_BOOTSTRAP_ON_IMPORT', '1')
+    # Pay for the heavy imports at startup instead of on the first upload/chart request
+    WARMUP_ON_START = _env_flag('FEE_WARMUP', '0')
+    # Other workers' new batches/branches/fee types show up in the dropdowns within this many seconds
+    FILTER_OPTIONS_MAX_AGE = int(os.environ.get('FEE_FILTER_OPTIONS_MAX_AGE', '30'))
+    # Students added by other workers or sqlite_uploader.py reach the autocomplete within this many seconds
+    STUDENT_INDEX_MAX_AGE = int(os.environ.get('FEE_STUDENT_INDEX_MAX_AGE', '5'))
+    # Archived batch years, one SQLite file each (None = instance/archive)
+    ARCHIVE_DIR = os.environ.get('FEE_ARCHIVE_DIR')
+    # Per-request query count and SQL time (see query_stats.py)
+    QUERY_STATS = _env_flag('FEE_QUERY_STATS', '1')
+    QUERY_STATS_WINDOW = int(os.environ.get('FEE_QUERY_STATS_WINDOW', '1000'))
+    # Slow-request log (see slow_log.py); needs QUERY_STATS
+    SLOW_REQUEST_MS = int(os.environ.get('FEE_SLOW_REQUEST_MS', '1000'))
+    SLOW_LOG_PATH = os.environ.get('FEE_SLOW_LOG')
+    SLOW_LOG_MAX_BYTES = 10 * 1024 * 1024
+    SLOW_LOG_BACKUPS = 5
+    # Prometheus metrics (see metrics.py); without a directory each process reports only itself
+    METRICS = _env_flag('FEE_METRICS', '1')
+    METRICS_DIR = os.environ.get('FEE_METRICS_DIR')
+    METRICS_TOKEN = os.environ.get('FEE_METRICS_TOKEN')
+    # Request profiles (see profiler.py)
+    PROFILE_DIR = os.environ.get('FEE_PROFILE_DIR')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('FEE_PROFILE_SAMPLE_RATE', '0'))
+    PROFILE_KEEP = int(os.environ.get('FEE_PROFILE_KEEP', '100'))
+    # Memory profiles of uploads and exports (see memory_profile.py)
+    MEMORY_PROFILE = _env_flag('FEE_MEMORY_PROFILE', '0')
+    MEMORY_PROFILE_FRAMES = int(os.environ.get('FEE_MEMORY_PROFILE_FRAMES', '6'))
+    MEMORY_LOG_PATH = os.environ.get('FEE_MEMORY_LOG')
+    MEMORY_LOG_MAX_BYTES = 10 * 1024 * 1024
+    MEMORY_LOG_BACKUPS = 5
+    # Logging (see structured_log.py)
+    LOG_LEVEL = os.environ.get('FEE_LOG_LEVEL', 'INFO')
+    LOG_LEVELS = os.environ.get('FEE_LOG_LEVELS', '')
+    LOG_FORMAT = os.environ.get('FEE_LOG_FORMAT', 'json')
+    LOG_FILE = os.environ.get('FEE_LOG_FILE')
+    LOG_FILE_MAX_BYTES = 50 * 1024 * 1024
+    LOG_FILE_BACKUPS = 5
+    LOG_SAMPLE_FIRST = int(os.environ.get('FEE_LOG_SAMPLE_FIRST', '20'))
+    LOG_SAMPLE_EVERY = int(os.environ.get('FEE_LOG_SAMPLE_EVERY', '100'))
+
+
+def load_secret_key(instance_path):
+    """Return the session secret shared by every worker.
+
+    FEE_SECRET_KEY wins. Otherwise a key is generated once and stored in the
+    instance folder; the file is created with O_EXCL so when several workers
+    start at the same time exactly one writes it and the others read it.
+    """
+    key = os.environ.get('FEE_SECRET_KEY')
+    if key:
+        return key
+
+    path = os.environ.get('FEE_SECRET_KEY_FILE') or os.path.join(instance_path, SECRET_KEY_FILENAME)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another process won the race; wait until it has finished writing
+        for _ in range(50):
+            with open(path) as f:
+                key = f.read().strip()
+            if key:
+                return key
+            time.sleep(0.1)
+        raise RuntimeError(f"Secret key file {path} is empty")
+
+    key = secrets.token_hex(32)
+    with os.fdopen(fd, 'w') as f:
+        f.write(key)
+    return key
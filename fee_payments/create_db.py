@@ -1,6 +1,7 @@
 import os
 from flask import Flask
-from models import db, init_db, Student, FeeMaster, Payment
+from models import db, init_db, bootstrap_db, Student, FeeMaster, Payment
+from migrations import get_schema_version, SCHEMA_VERSION
 import sqlite3
 
 # Create a minimal Flask application for database initialization
@@ -36,12 +37,19 @@ def check_full_schema():
         cursor.execute("PRAGMA table_info(fee_master)")
         columns = {col[1]: col for col in cursor.fetchall()}
         
-        required_columns = ['id', 'regd_no', 'fee_type', 'amount', 'batch', 'remarks']
+        required_columns = ['id', 'student_id', 'fee_type_id', 'amount_paise', 'remarks']
         for column in required_columns:
             if column not in columns:
                 conn.close()
                 return False, f"Missing column in fee_master table: {column}"
         
+        # Older databases are migrated on startup (init_db above); a version behind
+        # the code means a migration failed, which recreating the database would hide
+        version = get_schema_version(conn)
+        if version != SCHEMA_VERSION:
+            conn.close()
+            return False, f"Schema version is {version}, expected {SCHEMA_VERSION}"
+        
         conn.close()
         return True, "Schema is correct"
     except Exception as e:
@@ -52,9 +60,10 @@ def create_tables():
     with app.app_context():
         # Drop all existing tables first to ensure clean schema
         db.drop_all()
-        # Create all tables defined in models.py
-        db.create_all()
-        print("Database tables created successfully!")
+    # Create all tables defined in models.py, with the change log, search index,
+    # fee types and schema version of a fresh database
+    bootstrap_db(app)
+    print("Database tables created successfully!")
 
 if __name__ == "__main__":
     # Check if database file exists
@@ -70,11 +79,14 @@ if __name__ == "__main__":
             print(f"Issue: {message}")
             print("The database schema doesn't match the current models.")
             
-            # Force recreation due to schema issues
-            print("Recreating database with correct schema...")
-            os.remove(db_path)
-            create_tables()
-            print("Database recreated successfully!")
+            # Recreating deletes every student and payment, so only when asked to
+            recreate = input("Do you want to delete the database and recreate it? (y/n): ")
+            if recreate.lower() == 'y':
+                os.remove(db_path)
+                create_tables()
+                print("Database recreated successfully!")
+            else:
+                print("Database kept intact.")
         else:
             print(f"Database exists at: {db_path} with correct schema.")
             force_recreate = input("Do you want to force-recreate the database anyway? (y/n): ")
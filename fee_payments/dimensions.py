@@ -0,0 +1,92 @@
+"""
+Batch and branch dimension tables.
+
+Batch years ("2022-2026") and branches ("CSE") used to be free text
+repeated on every student and payment row, and each filter dropdown ran
+SELECT DISTINCT over the whole student table. They now live in the small
+batch and branch tables, and rows point at them through indexed integer
+columns (Student.batch_id, Student.branch_id, Payment.batch_id).
+
+Rows store only the ids. Pages, exports and the change feed that show a
+batch year or branch join the dimension table for its name (see
+join_student_names), and the filter dropdowns read the dimension tables
+(see filter_options.py).
+"""
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# Dimension table -> the text column it replaced (dropped by migration 7)
+DIMENSION_COLUMNS = {
+    'batch': 'batch_year',
+    'branch': 'branch',
+}
+
+
+def id_of(model, name):
+    """Scalar subquery for the id of a batch/branch name, for use in filters:
+
+        query.filter(Student.batch_id == id_of(Batch, batch_year))
+    """
+    from models import db
+
+    return db.session.query(model.id).filter(model.name == name).scalar_subquery()
+
+
+def join_student_names(query):
+    """Join batch and branch onto a query over student, for Batch.name / Branch.name:
+
+        query(Batch.name.label('batch_year'), Student.regd_no).select_from(Student)
+    """
+    from models import Student, Batch, Branch
+
+    return query.join(Batch, Batch.id == Student.batch_id).join(Branch, Branch.id == Student.branch_id)
+
+
+def dimension_id(model, name, cache=None):
+    """Id of the batch/branch called name, adding a row to the session if it is new.
+
+    cache is an optional dict the caller keeps for the length of one
+    transaction (e.g. one upload), so repeated names cost no queries.
+    """
+    from models import db
+
+    name = (name or '').strip()
+    if cache is not None and name in cache:
+        return cache[name]
+    dimension_row_id = db.session.query(model.id).filter(model.name == name).scalar()
+    if dimension_row_id is None:
+        # Another worker may be adding the same name: insert unless it is there by
+        # now, then read back whichever row won
+        added = db.session.execute(
+            sqlite_insert(model).values(name=name).on_conflict_do_nothing(index_elements=['name'])
+        ).rowcount
+        if added:
+            from filter_options import note_dimension_write
+
+            note_dimension_write(db.session)
+        dimension_row_id = db.session.query(model.id).filter(model.name == name).scalar()
+    if cache is not None:
+        cache[name] = dimension_row_id
+    return dimension_row_id
+
+
+# --- plain sqlite3 helpers for migrations and sqlite_uploader.py -------------
+
+def dimension_ddl():
+    return [
+        f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            id INTEGER PRIMARY KEY,
+            name VARCHAR({50 if table == 'branch' else 20}) NOT NULL UNIQUE
+        )
+        '''
+        for table in DIMENSION_COLUMNS
+    ]
+
+
+def resolve_dimension_id(conn, table, name, cache):
+    """Id for a batch/branch name through a sqlite3 connection, adding it if unknown"""
+    name = (name or '').strip()
+    if name not in cache:
+        conn.execute(f"INSERT OR IGNORE INTO {table} (name) VALUES (?)", (name,))
+        cache[name] = conn.execute(f"SELECT id FROM {table} WHERE name = ?", (name,)).fetchone()[0]
+    return cache[name]
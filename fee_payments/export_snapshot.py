@@ -0,0 +1,315 @@
+"""
+Columnar snapshot export of the fee ledger.
+
+Writes the student, fee_type, fee_master and payment tables plus the
+computed per-fee balances as Parquet (or Arrow IPC) files. All files are read
+in one transaction, so they agree with each other even while payments are
+being recorded. Each table is streamed from the database in chunks, and the low-cardinality batch_year, branch and
+fee_type columns are dictionary-encoded against one dictionary per file. Batch years and branch names are joined in
+from the batch and branch tables, which also serve as their dictionaries.
+
+Usage:
+    python export_snapshot.py --out exports --format parquet --chunk-size 50000
+"""
+import os
+import json
+import argparse
+from datetime import datetime
+
+from sqlalchemy import text
+
+from models import db
+
+# Rows fetched from SQLite and written per record batch / row group
+DEFAULT_CHUNK_SIZE = 50000
+
+SNAPSHOT_FORMATS = {
+    'parquet': '.parquet',
+    'arrow': '.arrow',
+}
+
+PAYMENT_STATUSES = ['Not Paid', 'Paid', 'Partially Paid']
+
+
+def _dictionary(conn, sql):
+    """Load the sorted distinct values for a dictionary-encoded column"""
+    values = sorted({row[0] for row in conn.execute(text(sql)) if row[0] is not None})
+    return values, {value: index for index, value in enumerate(values)}
+
+
+def _dictionary_array(pa, values, dictionary):
+    """Encode a column chunk against a fixed dictionary so every batch shares it"""
+    dict_values, index_of = dictionary
+    try:
+        indices = pa.array([None if value is None else index_of[value] for value in values], type=pa.int32())
+    except KeyError as e:
+        # The dictionaries and the tables are read in one transaction, so this is a bug, not a race
+        raise ValueError(f"Value {e.args[0]!r} is missing from the column's dictionary") from None
+    return pa.DictionaryArray.from_arrays(indices, pa.array(dict_values, type=pa.string()))
+
+
+class _TableWriter:
+    """Append record batches to a Parquet or Arrow IPC file"""
+
+    def __init__(self, pa, path, schema, file_format):
+        self.path = path
+        self.rows = 0
+        if file_format == 'parquet':
+            import pyarrow.parquet as pq
+            self._writer = pq.ParquetWriter(path, schema, compression='zstd')
+            self._write = self._writer.write_table
+            self._wrap = lambda batch: pa.Table.from_batches([batch])
+        else:
+            self._sink = pa.OSFile(path, 'wb')
+            self._writer = pa.ipc.new_file(self._sink, schema)
+            self._write = self._writer.write_batch
+            self._wrap = lambda batch: batch
+
+    def write(self, batch):
+        self._write(self._wrap(batch))
+        self.rows += batch.num_rows
+
+    def close(self):
+        self._writer.close()
+        if hasattr(self, '_sink'):
+            self._sink.close()
+
+
+def _export_query(pa, conn, sql, schema, encoders, path, file_format, chunk_size):
+    """Stream a query into a columnar file, one record batch per chunk"""
+    writer = _TableWriter(pa, path, schema, file_format)
+    try:
+        result = conn.execution_options(yield_per=chunk_size).execute(text(sql))
+        for rows in result.partitions(chunk_size):
+            columns = list(zip(*rows))
+            arrays = [encode(values) for encode, values in zip(encoders, columns)]
+            writer.write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def _iter_balances(conn, chunk_size):
+    """Yield (student, fee, amount, paid) rows in paise by merge-joining fees with payment totals.
+
+    Both queries are ordered by student_id, so only one student's payment
+    groups are held in memory at a time.
+    """
+    fees = conn.execution_options(yield_per=chunk_size).execute(text(
+        "SELECT f.student_id, s.regd_no, b.name, r.name, t.label, f.fee_type_id, f.amount_paise "
+        "FROM fee_master f JOIN student s ON s.id = f.student_id "
+        "JOIN batch b ON b.id = s.batch_id JOIN branch r ON r.id = s.branch_id "
+        "JOIN fee_type t ON t.id = f.fee_type_id "
+        "ORDER BY f.student_id, f.id"
+    ))
+    payments = conn.execution_options(yield_per=chunk_size).execute(text(
+        "SELECT student_id, fee_type_id, SUM(amount_paid_paise) FROM payment "
+        "GROUP BY student_id, fee_type_id ORDER BY student_id"
+    ))
+
+    pending = next(payments, None)
+    current_student_id = None
+    current_groups = {}
+    for student_id, regd_no, batch_year, branch, fee_label, fee_type_id, amount_paise in fees:
+        if student_id != current_student_id:
+            current_student_id = student_id
+            current_groups = {}
+            # Skip payment groups for students without fee entries
+            while pending is not None and pending[0] < student_id:
+                pending = next(payments, None)
+            while pending is not None and pending[0] == student_id:
+                current_groups[pending[1]] = pending[2] or 0
+                pending = next(payments, None)
+
+        yield regd_no, batch_year, branch, fee_label, amount_paise, current_groups.get(fee_type_id, 0)
+
+
+def _payment_status(amount, paid):
+    """Status label for integer paise amounts, as on the student details page"""
+    if paid >= amount:
+        return 'Paid'
+    elif paid > 0:
+        return 'Partially Paid'
+    return 'Not Paid'
+
+
+def _export_balances(pa, conn, schema, dictionaries, path, file_format, chunk_size):
+    """Write the computed per-fee balances, chunk by chunk"""
+    status_dictionary = (PAYMENT_STATUSES, {status: i for i, status in enumerate(PAYMENT_STATUSES)})
+
+    def flush(chunk):
+        regd_nos, batch_years, branches, fee_labels, amounts, paid = zip(*chunk)
+        arrays = [
+            pa.array(regd_nos, type=pa.string()),
+            _dictionary_array(pa, batch_years, dictionaries['batch_year']),
+            _dictionary_array(pa, branches, dictionaries['branch']),
+            _dictionary_array(pa, fee_labels, dictionaries['fee_label']),
+            pa.array(amounts, type=pa.int64()),
+            pa.array(paid, type=pa.int64()),
+            pa.array([max(0, a - p) for a, p in zip(amounts, paid)], type=pa.int64()),
+            _dictionary_array(pa, [_payment_status(a, p) for a, p in zip(amounts, paid)],
+                              status_dictionary),
+        ]
+        writer.write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+    writer = _TableWriter(pa, path, schema, file_format)
+    try:
+        chunk = []
+        for row in _iter_balances(conn, chunk_size):
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    finally:
+        writer.close()
+    return writer.rows
+
+
+def write_snapshot(out_dir, file_format='parquet', chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write a full ledger snapshot into out_dir and return the manifest.
+
+    Must be called inside an application context.
+    """
+    if file_format not in SNAPSHOT_FORMATS:
+        raise ValueError(f"Unsupported snapshot format: {file_format}")
+
+    import pyarrow as pa
+
+    os.makedirs(out_dir, exist_ok=True)
+    extension = SNAPSHOT_FORMATS[file_format]
+    dict_type = pa.dictionary(pa.int32(), pa.string())
+
+    with db.engine.connect() as conn:
+        # pysqlite only opens a transaction before writes, so without this every SELECT
+        # would see the database as of its own start. One read transaction for the
+        # dictionaries and every table makes the files a point-in-time snapshot (with
+        # WAL, writers carry on meanwhile); it is rolled back when the connection closes.
+        conn.exec_driver_sql("BEGIN")
+
+        # One dictionary per column for the whole snapshot, shared by every chunk
+        dictionaries = {
+            'batch_year': _dictionary(conn, "SELECT name FROM batch"),
+            'branch': _dictionary(conn, "SELECT name FROM branch"),
+            'fee_type': _dictionary(conn, "SELECT DISTINCT fee_type FROM fee_master "
+                                          "UNION SELECT DISTINCT fee_type FROM payment"),
+        }
+        dictionaries['fee_label'] = _dictionary(conn, "SELECT label FROM fee_type")
+
+        def plain(arrow_type):
+            return lambda values: pa.array(values, type=arrow_type)
+
+        def encoded(column):
+            return lambda values: _dictionary_array(pa, values, dictionaries[column])
+
+        tables = {
+            'fee_type': (
+                "SELECT id, code, label, aliases FROM fee_type ORDER BY id",
+                pa.schema([
+                    ('id', pa.int64()),
+                    ('code', pa.string()),
+                    ('label', pa.string()),
+                    ('aliases', pa.string()),
+                ]),
+                [plain(pa.int64()), plain(pa.string()), plain(pa.string()), plain(pa.string())],
+            ),
+            'student': (
+                "SELECT s.id, s.regd_no, s.name, b.name, r.name, s.mobile FROM student s "
+                "JOIN batch b ON b.id = s.batch_id JOIN branch r ON r.id = s.branch_id ORDER BY s.id",
+                pa.schema([
+                    ('id', pa.int64()),
+                    ('regd_no', pa.string()),
+                    ('name', pa.string()),
+                    ('batch_year', dict_type),
+                    ('branch', dict_type),
+                    ('mobile', pa.string()),
+                ]),
+                [plain(pa.int64()), plain(pa.string()), plain(pa.string()),
+                 encoded('batch_year'), encoded('branch'), plain(pa.string())],
+            ),
+            'fee_master': (
+                "SELECT id, student_id, fee_type_id, fee_type, amount_paise, remarks FROM fee_master ORDER BY id",
+                pa.schema([
+                    ('id', pa.int64()),
+                    ('student_id', pa.int64()),
+                    ('fee_type_id', pa.int64()),
+                    ('fee_type', dict_type),
+                    ('amount_paise', pa.int64()),
+                    ('remarks', pa.string()),
+                ]),
+                [plain(pa.int64()), plain(pa.int64()), plain(pa.int64()), encoded('fee_type'),
+                 plain(pa.int64()), plain(pa.string())],
+            ),
+            'payment': (
+                "SELECT p.id, p.student_id, b.name, p.fee_type_id, p.fee_type, p.amount_paid_paise, p.date, "
+                "p.received_by FROM payment p JOIN batch b ON b.id = p.batch_id ORDER BY p.id",
+                pa.schema([
+                    ('id', pa.int64()),
+                    ('student_id', pa.int64()),
+                    ('batch_year', dict_type),
+                    ('fee_type_id', pa.int64()),
+                    ('fee_type', dict_type),
+                    ('amount_paid_paise', pa.int64()),
+                    ('date', pa.date32()),
+                    ('received_by', pa.string()),
+                ]),
+                [plain(pa.int64()), plain(pa.int64()), encoded('batch_year'), plain(pa.int64()),
+                 encoded('fee_type'), plain(pa.int64()),
+                 lambda values: pa.array([_parse_date(v) for v in values], type=pa.date32()),
+                 plain(pa.string())],
+            ),
+        }
+
+        manifest = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'format': file_format,
+            'chunk_size': chunk_size,
+            'files': {},
+        }
+        for name, (sql, schema, encoders) in tables.items():
+            path = os.path.join(out_dir, name + extension)
+            rows = _export_query(pa, conn, sql, schema, encoders, path, file_format, chunk_size)
+            manifest['files'][name] = {'path': os.path.basename(path), 'rows': rows}
+
+        balance_schema = pa.schema([
+            ('regd_no', pa.string()),
+            ('batch_year', dict_type),
+            ('branch', dict_type),
+            ('fee_type', dict_type),
+            ('amount_paise', pa.int64()),
+            ('paid_paise', pa.int64()),
+            ('balance_paise', pa.int64()),
+            ('status', dict_type),
+        ])
+        path = os.path.join(out_dir, 'balances' + extension)
+        rows = _export_balances(pa, conn, balance_schema, dictionaries, path, file_format, chunk_size)
+        manifest['files']['balances'] = {'path': os.path.basename(path), 'rows': rows}
+
+    with open(os.path.join(out_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _parse_date(value):
+    """SQLite hands dates back as ISO strings when read through raw SQL"""
+    if value is None or not isinstance(value, str):
+        return value
+    return datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a columnar snapshot of the fee ledger")
+    parser.add_argument('--out', default='exports', help="Directory to write the snapshot into")
+    parser.add_argument('--format', choices=sorted(SNAPSHOT_FORMATS), default='parquet')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    from app import create_app
+
+    app = create_app()
+    snapshot_dir = os.path.join(args.out, 'snapshot_' + datetime.now().strftime('%Y%m%d_%H%M%S'))
+    with app.app_context():
+        result = write_snapshot(snapshot_dir, args.format, args.chunk_size)
+    for table, info in result['files'].items():
+        print(f"{table}: {info['rows']} rows -> {os.path.join(snapshot_dir, info['path'])}")
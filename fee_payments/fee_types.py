@@ -0,0 +1,326 @@
+"""
+Fee type registry.
+
+Fee types live in the fee_type table (id, code, label, aliases). FeeMaster
+and Payment rows reference them by integer id, so filtering and grouping by
+fee type is an integer comparison instead of LIKE matching on free text.
+
+The table is small and read on almost every request, so each process keeps
+it in memory as an alias -> id dictionary. Spellings are reduced to a key
+(lowercase, punctuation collapsed to single spaces) and looked up in O(1).
+A new program is added with "flask fee-types add", or created automatically
+the first time an upload mentions a spelling nobody has registered yet.
+
+Sheets also carry decorated spellings such as "CRT Training" or "Smart
+Interviews Phase-3 Fee", which the old substring rules mapped to the standard
+types. Before registering a spelling, resolve() looks for a registered alias
+among its words (the oldest fee type wins, as CRT was checked first) and
+records the spelling as an alias of that type.
+"""
+import re
+import time
+import threading
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from metrics import cache_lookup
+
+# A spelling that isn't registered re-reads the table at most this often, so
+# unknown values in query strings don't cost a full read on every request
+MISS_RELOAD_INTERVAL = 30
+
+# (code, label, aliases) seeded into every database
+DEFAULT_FEE_TYPES = [
+    ('crt fee', 'CRT', ['crt', 'crt fees']),
+    ('smart interviews phase-ii', 'Phase 2',
+     ['phase 2', 'phase ii', 'phase2', 'smart interviews phase 2', 'si phase 2', 'si phase ii']),
+    ('smart interviews phase-iii', 'Phase 3',
+     ['phase 3', 'phase iii', 'phase3', 'smart interviews phase 3', 'si phase 3', 'si phase iii']),
+]
+
+
+def alias_key(value):
+    """Reduce a fee type spelling to its lookup key: 'Phase-II ' -> 'phase ii'"""
+    if value is None:
+        return ''
+    return re.sub(r'[^a-z0-9]+', ' ', str(value).lower()).strip()
+
+
+def split_aliases(aliases):
+    """Aliases are stored as a comma-separated list of keys"""
+    return [alias for alias in (aliases or '').split(',') if alias]
+
+
+def join_aliases(aliases):
+    return ','.join(sorted({alias_key(alias) for alias in aliases if alias_key(alias)}))
+
+
+def match_alias(key, by_key):
+    """Id of the oldest fee type with an alias among the words of key, or None.
+
+    'crt fee 2nd installment' contains the alias 'crt fee', so it is CRT.
+    Matching whole words keeps 'phase 2' from matching 'phase 20'.
+    """
+    words = key.split()
+    matches = [by_key[' '.join(words[start:end])]
+               for start in range(len(words))
+               for end in range(start + 1, len(words) + 1)
+               if ' '.join(words[start:end]) in by_key]
+    return min(matches) if matches else None
+
+
+class FeeTypeInfo:
+    __slots__ = ('id', 'code', 'label')
+
+    def __init__(self, id, code, label):
+        self.id = id
+        self.code = code
+        self.label = label
+
+    def __repr__(self):
+        return f"<FeeType {self.id}: {self.label}>"
+
+
+class FeeTypeRegistry:
+    """Per-process cache of the fee_type table"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_id = {}
+        self._by_key = {}
+        self._loaded = False
+        self._loaded_at = 0.0
+        # Set when resolve() adds a row that isn't committed yet
+        self._uncommitted = False
+
+    def reload(self):
+        """Read the fee_type table into memory (call inside an application context)"""
+        from models import db, FeeType
+
+        by_id = {}
+        by_key = {}
+        for fee_type in db.session.query(FeeType).order_by(FeeType.id):
+            by_id[fee_type.id] = FeeTypeInfo(fee_type.id, fee_type.code, fee_type.label)
+            for key in [alias_key(fee_type.code), alias_key(fee_type.label)] + split_aliases(fee_type.aliases):
+                by_key.setdefault(key, fee_type.id)
+        with self._lock:
+            self._by_id = by_id
+            self._by_key = by_key
+            self._loaded = True
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        self._loaded = False
+
+    def end_transaction(self):
+        """Drop the cache if it may hold a fee type added in the transaction that just ended"""
+        if self._uncommitted:
+            self._uncommitted = False
+            self.invalidate()
+
+    def _ensure_loaded(self):
+        """Load the table if needed; True when the cache could be used as it was"""
+        if self._loaded:
+            return True
+        self.reload()
+        return False
+
+    def all(self):
+        """Registered fee types in id order"""
+        cache_lookup('fee_types', self._ensure_loaded())
+        return list(self._by_id.values())
+
+    def labels(self):
+        return [fee_type.label for fee_type in self.all()]
+
+    def get(self, fee_type_id):
+        """FeeTypeInfo for an id; reloads once if another process added it"""
+        hit = self._ensure_loaded()
+        info = self._by_id.get(fee_type_id)
+        if info is None and fee_type_id is not None:
+            self.reload()
+            info = self._by_id.get(fee_type_id)
+            hit = False
+        cache_lookup('fee_types', hit)
+        return info
+
+    def label(self, fee_type_id):
+        info = self.get(fee_type_id)
+        return info.label if info else ''
+
+    def code(self, fee_type_id):
+        info = self.get(fee_type_id)
+        return info.code if info else ''
+
+    def lookup(self, spelling, fresh=False):
+        """Id for a code, label or alias, or None if it isn't registered.
+
+        A miss re-reads the table in case another process registered the
+        spelling, at most once every MISS_RELOAD_INTERVAL seconds; fresh=True
+        re-reads it on any miss, for callers about to register a fee type.
+        """
+        key = alias_key(spelling)
+        if not key:
+            return None
+        hit = self._ensure_loaded()
+        fee_type_id = self._by_key.get(key)
+        if fee_type_id is None and hit and (fresh or time.monotonic() - self._loaded_at >= MISS_RELOAD_INTERVAL):
+            self.reload()
+            fee_type_id = self._by_key.get(key)
+            hit = False
+        cache_lookup('fee_types', hit)
+        return fee_type_id
+
+    def match(self, spelling):
+        """Id resolve() maps spelling to without registering anything, or None"""
+        fee_type_id = self.lookup(spelling)
+        if fee_type_id is None:
+            fee_type_id = match_alias(alias_key(spelling), self._by_key)
+        return fee_type_id
+
+    def resolve(self, spelling):
+        """Id for a spelling, registering a new fee type if it is unknown.
+
+        A spelling that contains a registered alias is added to that type's
+        aliases instead (see match_alias). New rows are added to the current
+        session and become permanent when the caller commits; the cache is
+        refreshed after the commit or rollback so it never holds an id that
+        was rolled back.
+        """
+        fee_type_id = self.lookup(spelling, fresh=True)
+        if fee_type_id is not None:
+            return fee_type_id
+
+        from models import db, FeeType
+
+        key = alias_key(spelling)
+        fee_type_id = match_alias(key, self._by_key)
+        if fee_type_id is not None:
+            row = db.session.get(FeeType, fee_type_id)
+            row.aliases = join_aliases(split_aliases(row.aliases) + [key])
+            db.session.flush()
+            # Later rows with the same spelling are plain lookups
+            with self._lock:
+                self._by_key[key] = fee_type_id
+            self._uncommitted = True
+            return fee_type_id
+
+        # Flushed but uncommitted types are visible to this session only
+        fee_type = db.session.query(FeeType).filter_by(code=key).first()
+        if fee_type is None:
+            fee_type = FeeType(code=key, label=str(spelling).strip().title(), aliases='')
+            db.session.add(fee_type)
+            db.session.flush()
+            self._uncommitted = True
+        return fee_type.id
+
+
+fee_type_registry = FeeTypeRegistry()
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_soft_rollback')
+def _end_transaction(session, *args):
+    fee_type_registry.end_transaction()
+
+
+# --- plain sqlite3 helpers for migrations and sqlite_uploader.py -------------
+
+def seed_fee_types(conn):
+    """Insert the default fee types that are missing"""
+    for code, label, aliases in DEFAULT_FEE_TYPES:
+        conn.execute(
+            "INSERT OR IGNORE INTO fee_type (code, label, aliases) VALUES (?, ?, ?)",
+            (code, label, join_aliases(aliases))
+        )
+
+
+def load_alias_map(conn):
+    """alias key -> fee_type id, read through a sqlite3 connection"""
+    alias_map = {}
+    for fee_type_id, code, label, aliases in conn.execute(
+            "SELECT id, code, label, aliases FROM fee_type ORDER BY id"):
+        for key in [alias_key(code), alias_key(label)] + split_aliases(aliases):
+            alias_map.setdefault(key, fee_type_id)
+    return alias_map
+
+
+def add_alias(conn, alias_map, fee_type_id, spelling):
+    """Record spelling as another alias of fee_type_id through a sqlite3 connection"""
+    key = alias_key(spelling)
+    if not key or key in alias_map:
+        return
+    aliases = conn.execute("SELECT aliases FROM fee_type WHERE id = ?", (fee_type_id,)).fetchone()[0]
+    conn.execute("UPDATE fee_type SET aliases = ? WHERE id = ?",
+                 (join_aliases(split_aliases(aliases) + [key]), fee_type_id))
+    alias_map[key] = fee_type_id
+
+
+def resolve_fee_type_id(conn, alias_map, spelling):
+    """Id for a spelling through a sqlite3 connection, registering it if unknown"""
+    key = alias_key(spelling)
+    if key not in alias_map:
+        fee_type_id = match_alias(key, alias_map)
+        if fee_type_id is not None:
+            add_alias(conn, alias_map, fee_type_id, key)
+            return fee_type_id
+        cursor = conn.execute(
+            "INSERT INTO fee_type (code, label, aliases) VALUES (?, ?, '')",
+            (key, str(spelling).strip().title())
+        )
+        alias_map[key] = cursor.lastrowid
+    return alias_map[key]
+
+
+# --- flask fee-types ... -----------------------------------------------------
+
+fee_types_cli = AppGroup('fee-types', help="List and register fee types.")
+
+
+@fee_types_cli.command('list')
+def list_fee_types():
+    """Show registered fee types and their aliases"""
+    from models import FeeType
+
+    for fee_type in FeeType.query.order_by(FeeType.id):
+        print(f"{fee_type.id:>3}  {fee_type.label:<15} {fee_type.code:<30} {fee_type.aliases or ''}")
+
+
+@fee_types_cli.command('add')
+@click.argument('code')
+@click.argument('label')
+@click.option('--alias', 'aliases', multiple=True, help="Another spelling that means this fee type")
+def add_fee_type(code, label, aliases):
+    """Register a new fee type"""
+    from models import db, FeeType
+
+    key = alias_key(code)
+    existing = fee_type_registry.lookup(key, fresh=True) or fee_type_registry.lookup(label, fresh=True)
+    if existing is not None:
+        raise click.ClickException(f"'{code}' is already registered as {fee_type_registry.label(existing)}")
+    db.session.add(FeeType(code=key, label=label, aliases=join_aliases(aliases)))
+    db.session.commit()
+    print(f"Added fee type {label} ({key})")
+
+
+@fee_types_cli.command('alias')
+@click.argument('fee_type')
+@click.argument('aliases', nargs=-1, required=True)
+def add_aliases(fee_type, aliases):
+    """Add spellings to an existing fee type, e.g.: flask fee-types alias CRT "crt training" """
+    from models import db, FeeType
+
+    fee_type_id = fee_type_registry.lookup(fee_type)
+    if fee_type_id is None:
+        raise click.ClickException(f"Unknown fee type: {fee_type}")
+    for alias in aliases:
+        other = fee_type_registry.lookup(alias, fresh=True)
+        if other is not None and other != fee_type_id:
+            raise click.ClickException(f"'{alias}' already means {fee_type_registry.label(other)}")
+    row = db.session.get(FeeType, fee_type_id)
+    row.aliases = join_aliases(split_aliases(row.aliases) + list(aliases))
+    db.session.commit()
+    print(f"{row.label}: {row.aliases}")
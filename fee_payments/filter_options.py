@@ -0,0 +1,123 @@
+"""
+Cached filter-option lists (batch years, branches, fee types).
+
+Nearly every page fills the same dropdowns. The lists come from the small
+batch, branch and fee_type tables and change only when an upload, a payment
+or the fee-types CLI adds a name, so each process keeps them in memory:
+
+- A commit in this process that adds or changes a Batch, Branch or FeeType
+  row drops the cache straight away (session events below).
+- Writes from other processes (other gunicorn workers, sqlite_uploader.py,
+  the CLI) are noticed through a data-version fingerprint - row count and
+  max id of the three tables - which is re-checked at most once every
+  FILTER_OPTIONS_MAX_AGE seconds.
+
+In the steady state a page view costs no queries for its dropdowns. The
+same lists are served as JSON by /api/filter-options with an ETag, so
+client-side code can reuse them too.
+"""
+import json
+import time
+import hashlib
+import threading
+from itertools import chain
+
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from models import db, Batch, Branch, FeeType
+from metrics import cache_lookup
+
+DEFAULT_MAX_AGE = 30
+
+# One cheap aggregate per dimension table; any insert or delete changes it
+FINGERPRINT_SQL = text(
+    "SELECT (SELECT COUNT(*) || ':' || IFNULL(MAX(id), 0) FROM batch), "
+    "(SELECT COUNT(*) || ':' || IFNULL(MAX(id), 0) FROM branch), "
+    "(SELECT COUNT(*) || ':' || IFNULL(MAX(id), 0) FROM fee_type)"
+)
+
+
+class FilterOptions:
+    """Per-process cache of the dropdown lists"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._options = None
+        self._fingerprint = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        self._checked_at = 0.0
+        self._fingerprint = None
+
+    def get(self):
+        """{'batch_years': [...], 'branches': [...], 'fee_types': [...], 'version': str}
+
+        Call inside an application context. If the database can't be read
+        the last good lists are returned (empty lists before the first load).
+        """
+        max_age = current_app.config.get('FILTER_OPTIONS_MAX_AGE', DEFAULT_MAX_AGE)
+        if self._options is not None and self._fingerprint is not None \
+                and time.monotonic() - self._checked_at < max_age:
+            cache_lookup('filter_options', True)
+            return self._options
+
+        with self._lock:
+            try:
+                fingerprint = tuple(db.session.execute(FINGERPRINT_SQL).one())
+                reload = self._options is None or fingerprint != self._fingerprint
+                if reload:
+                    self._options = self._load()
+                    self._fingerprint = fingerprint
+                # Re-checking the fingerprint alone still counts as a hit
+                cache_lookup('filter_options', not reload)
+                self._checked_at = time.monotonic()
+            except Exception as e:
+                current_app.logger.error("Error loading filter options: %s", e)
+                if self._options is None:
+                    return {'batch_years': [], 'branches': [], 'fee_types': [], 'version': ''}
+            return self._options
+
+    def _load(self):
+        from fee_types import fee_type_registry
+
+        # Another process may have registered a fee type
+        fee_type_registry.reload()
+        options = {
+            'batch_years': [row[0] for row in db.session.query(Batch.name).order_by(Batch.name)],
+            'branches': [row[0] for row in db.session.query(Branch.name).order_by(Branch.name)],
+            'fee_types': fee_type_registry.labels(),
+        }
+        options['version'] = hashlib.sha1(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+        current_app.logger.info("Loaded filter options (version %s)", options['version'])
+        return options
+
+
+filter_options = FilterOptions()
+
+_DIMENSION_MODELS = (Batch, Branch, FeeType)
+
+
+def note_dimension_write(session):
+    """Drop the cache when session commits, for dimension rows written without the ORM"""
+    session.info['filter_options_changed'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_dimension_writes(session, flush_context):
+    # new/dirty/deleted still hold the pre-flush state here
+    if any(isinstance(obj, _DIMENSION_MODELS) for obj in chain(session.new, session.dirty, session.deleted)):
+        note_dimension_write(session)
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_after_commit(session):
+    if session.info.pop('filter_options_changed', False):
+        filter_options.invalidate()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_after_rollback(session, previous_transaction):
+    session.info.pop('filter_options_changed', None)
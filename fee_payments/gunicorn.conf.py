@@ -0,0 +1,76 @@
+"""
+Gunicorn settings for serving the app with several worker processes.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Set FEE_SECRET_KEY (or let the first start write instance/secret_key) so
+every worker signs sessions with the same key.
+"""
+import os
+import re
+import tempfile
+import multiprocessing
+
+bind = os.environ.get('FEE_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('FEE_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('FEE_THREADS', 1))
+timeout = int(os.environ.get('FEE_TIMEOUT', 120))  # Large uploads and chart rendering can be slow
+
+# Import the app (pandas, matplotlib, models) once in the master and fork the workers
+preload_app = True
+
+accesslog = os.environ.get('FEE_ACCESS_LOG', '-')
+errorlog = '-'
+
+# Workers share their /metrics values through files here; set before the app is imported.
+# Runtime state, so outside the source tree, and one directory per bind address because
+# on_starting clears it.
+os.environ.setdefault('FEE_METRICS_DIR', os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.path.join(
+    tempfile.gettempdir(), 'fee_payments_metrics_' + re.sub(r'[^A-Za-z0-9]+', '_', bind)))
+
+
+def on_starting(server):
+    """Create tables, migrate, add the default admin and build the student index once, before any worker starts"""
+    from wsgi import app
+    from models import db, bootstrap_db
+    from student_index import student_index
+    import metrics
+
+    if app.config['METRICS_DIR']:
+        # Counters start from zero with every server start
+        metrics.clear_directory(app.config['METRICS_DIR'])
+    bootstrap_db(app)
+    with app.app_context():
+        # Built once here; the forked workers start with a copy and only catch up
+        student_index.build()
+        # Connections must not be shared across fork()
+        db.engine.dispose()
+
+
+def post_fork(server, worker):
+    from wsgi import app
+    from models import db
+    import metrics
+
+    # Values recorded in the master would otherwise be counted once per worker
+    metrics.reset_process()
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    import metrics
+    import structured_log
+
+    metrics.flush()
+    # Write out log records still queued for the listener thread
+    structured_log.stop()
+
+
+def child_exit(server, worker):
+    """Keep an exited worker's counters (master process)"""
+    from wsgi import app
+    import metrics
+
+    if app.config['METRICS_DIR']:
+        metrics.mark_process_dead(app.config['METRICS_DIR'], worker.pid)
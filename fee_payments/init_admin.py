@@ -1,7 +1,9 @@
-from app import app, db
+from app import create_app, db
 from models import Admin
 import getpass
 
+app = create_app()
+
 def create_admin_user():
     """Create an admin user interactively"""
     print("=== Creating Admin User ===")
@@ -1,4 +1,6 @@
-from app import app, db  # Import your app and db from wherever they're defined
+from app import create_app, db
+
+app = create_app()
 
 def clear_test_database():
     with app.app_context():
@@ -0,0 +1,251 @@
+"""
+Memory profiling of uploads and exports.
+
+Workers have been killed during large uploads and unpaid-students CSV
+exports. With MEMORY_PROFILE on, those requests (TRACED_REQUESTS) run under
+tracemalloc; an admin can also add ?__memory=1 to any URL to trace that
+one request.
+
+A traced request writes one JSON line to MEMORY_LOG_PATH (default
+instance/memory_profiles.jsonl), rotated like the slow-request log:
+
+    {"at": "2026-03-02T10:15:04", "method": "POST", "path": "/upload",
+     "endpoint": "main.upload", "status": 302, "ms": 8120.4, "rows": 10000,
+     "peak_bytes": 412000000, "peak_per_10k_rows": 412000000,
+     "retained_bytes": 1200000, "max_rss_bytes": 905000000,
+     "top": [{"bytes": 96000000, "count": 410000, "site": "managers.py:1017",
+              "app_site": "app.py:781", "traceback": [...]}, ...]}
+
+peak_bytes is the most Python-allocated memory (numpy and pandas buffers
+included) held at once during the request, over what was held when it
+started. rows is what the view reported through note_rows(): sheet rows
+for an upload, exported rows for an export. top lists the allocation sites
+holding the most memory in a snapshot taken by a watcher thread as the
+peak was approached; app_site is the innermost frame in the app's own
+code, usually the line to look at. /admin/memory shows the newest records,
+and /metrics has the peaks as fee_request_peak_memory_bytes.
+
+tracemalloc is process-wide, so one request per process is traced at a
+time, and with several threads per worker the others' allocations are
+counted too. It also makes allocation-heavy code slower, roughly in
+proportion to MEMORY_PROFILE_FRAMES, the frames kept per allocation: with
+the default 6 an upload takes about ten times as long (mind gunicorn's
+timeout), with 1 about three to four times, but then app_site is only
+known when the app allocated the memory itself. Turn it on to investigate,
+not permanently.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import resource
+import threading
+import tracemalloc
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import g, request, current_app
+from flask_login import current_user
+
+from metrics import REQUEST_PEAK_MEMORY, PROCESS_MAX_RSS, mark_dirty
+from slow_log import tail_records
+from structured_log import queued
+
+MEMORY_PARAM = '__memory'
+DEFAULT_FRAMES = 6
+TOP_SITES = 10
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+# Traced with MEMORY_PROFILE on: endpoint -> predicate on the request
+TRACED_REQUESTS = {
+    'main.upload': lambda: request.method == 'POST',
+    'main.unpaid_students': lambda: (request.args.get('download_csv') == 'true'
+                                     or request.args.get('download_excel') == 'true'),
+    'main.export_snapshot': lambda: True,
+}
+
+# The watcher snapshots the heap when it has grown by this factor since its last snapshot
+SNAPSHOT_GROWTH = 1.25
+SNAPSHOT_MIN_BYTES = 1024 * 1024
+WATCH_INTERVAL = 0.05
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+IGNORED_FILES = (tracemalloc.__file__, '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>')
+
+memory_logger = logging.getLogger('fee_payments.memory_profiles')
+memory_logger.setLevel(logging.INFO)
+memory_logger.propagate = False
+
+# One traced request per process: tracemalloc has no per-thread mode
+_trace_lock = threading.Lock()
+
+
+def memory_log_path():
+    return current_app.config.get('MEMORY_LOG_PATH') or os.path.join(current_app.instance_path,
+                                                                     'memory_profiles.jsonl')
+
+
+def note_rows(rows):
+    """Record how many rows the current request handled, for peak_per_10k_rows"""
+    g.memory_rows = rows
+
+
+def max_rss_bytes():
+    """Largest resident set size this process has had"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _app_site(frames):
+    for frame in frames:
+        if frame.filename.startswith(APP_DIR) and '/site-packages/' not in frame.filename:
+            return f"{os.path.basename(frame.filename)}:{frame.lineno}"
+    return None
+
+
+def top_sites(snapshot, limit=TOP_SITES):
+    """The allocation sites holding the most memory in a snapshot, with their app frame"""
+    snapshot = snapshot.filter_traces([tracemalloc.Filter(False, name) for name in IGNORED_FILES])
+    sites = []
+    for stat in snapshot.statistics('traceback')[:limit]:
+        # most recent call first
+        frames = list(reversed(stat.traceback))
+        sites.append({
+            'bytes': stat.size,
+            'count': stat.count,
+            'site': f"{os.path.basename(frames[0].filename)}:{frames[0].lineno}",
+            'app_site': _app_site(frames),
+            'traceback': [f"{frame.filename}:{frame.lineno}" for frame in frames],
+        })
+    return sites
+
+
+class PeakWatcher:
+    """Snapshots the traced heap from a background thread whenever it reaches a new high"""
+
+    def __init__(self, interval=WATCH_INTERVAL):
+        self.snapshot = None
+        self.snapshot_bytes = 0
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='memory-watcher', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.check()
+
+    def check(self):
+        current, _ = tracemalloc.get_traced_memory()
+        if current >= SNAPSHOT_MIN_BYTES and current > self.snapshot_bytes * SNAPSHOT_GROWTH:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_bytes = current
+
+
+def _wanted():
+    if request.endpoint is None:
+        return False
+    if request.args.get(MEMORY_PARAM) == '1':
+        return current_user.is_authenticated
+    traced = TRACED_REQUESTS.get(request.endpoint)
+    return bool(current_app.config.get('MEMORY_PROFILE') and traced and traced())
+
+
+def _start():
+    if tracemalloc.is_tracing() or not _trace_lock.acquire(blocking=False):
+        # Another request is traced, or tracemalloc was started outside the app (PYTHONTRACEMALLOC)
+        return None
+    tracemalloc.start(current_app.config.get('MEMORY_PROFILE_FRAMES', DEFAULT_FRAMES))
+    watcher = PeakWatcher()
+    watcher.start()
+    return watcher, time.perf_counter()
+
+
+def _finish(trace, status):
+    watcher, started = trace
+    try:
+        watcher.stop()
+        retained, peak = tracemalloc.get_traced_memory()
+        # The heap at its high point: the watcher's snapshot, or now if it never took one
+        snapshot = watcher.snapshot
+        if snapshot is None or retained >= watcher.snapshot_bytes:
+            snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        _trace_lock.release()
+
+    rows = g.pop('memory_rows', None)
+    record = {
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': status,
+        'ms': round((time.perf_counter() - started) * 1000, 1),
+        'rows': rows,
+        'peak_bytes': peak,
+        'peak_per_10k_rows': round(peak * 10000 / rows) if rows else None,
+        'retained_bytes': retained,
+        'max_rss_bytes': max_rss_bytes(),
+        'top': top_sites(snapshot),
+    }
+    REQUEST_PEAK_MEMORY.observe(peak, endpoint=request.endpoint)
+    mark_dirty()
+    try:
+        memory_logger.info(json.dumps(record))
+    except Exception as e:
+        current_app.logger.error("Error writing memory profile log: %s", e)
+    current_app.logger.info("Memory profile: %s %s peaked at %.1f MB (%s rows)",
+                            request.method, request.path, peak / 1024 / 1024, rows)
+    return record
+
+
+def recent_memory_profiles(limit=50):
+    """The newest records of the current log file, newest first"""
+    return tail_records(memory_log_path(), limit)
+
+
+def install_memory_profile(app):
+    """Trace the requests in TRACED_REQUESTS (MEMORY_PROFILE on) and those asked for with ?__memory=1"""
+    path = os.path.abspath(app.config.get('MEMORY_LOG_PATH')
+                           or os.path.join(app.instance_path, 'memory_profiles.jsonl'))
+    if not any(getattr(target, 'baseFilename', None) == path
+               for handler in memory_logger.handlers for target in getattr(handler, 'targets', [handler])):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=app.config.get('MEMORY_LOG_MAX_BYTES', DEFAULT_MAX_BYTES),
+                                      backupCount=app.config.get('MEMORY_LOG_BACKUPS', DEFAULT_BACKUPS),
+                                      encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        memory_logger.addHandler(queued(handler))
+    PROCESS_MAX_RSS.set_function(max_rss_bytes)
+
+    @app.before_request
+    def _start_memory_trace():
+        if _wanted():
+            trace = _start()
+            if trace is not None:
+                g.memory_trace = trace
+
+    @app.after_request
+    def _save_memory_trace(response):
+        trace = g.pop('memory_trace', None)
+        if trace is not None:
+            record = _finish(trace, response.status_code)
+            response.headers['X-Memory-Peak'] = str(record['peak_bytes'])
+        return response
+
+    @app.teardown_request
+    def _stop_memory_trace(exc):
+        # Only still set when the request failed before after_request ran
+        trace = g.pop('memory_trace', None)
+        if trace is not None:
+            _finish(trace, 500)
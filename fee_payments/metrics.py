@@ -0,0 +1,366 @@
+"""
+Prometheus metrics, served at /metrics in the text exposition format.
+
+    fee_http_request_duration_seconds   histogram per method, endpoint and status
+    fee_upload_rows_total               rows saved by spreadsheet uploads
+    fee_upload_row_errors_total         rows skipped with a warning
+    fee_uploads_total                   uploads by result (ok / failed)
+    fee_upload_seconds_total            time spent processing uploads
+    fee_chart_render_seconds            histogram per dashboard chart
+    fee_cache_lookups_total             per cache (filter_options, fee_types,
+                                        student_index), hit or miss
+    fee_db_pool_*                       connections checked out, pool size, overflow
+    fee_student_index_*                 students held by the regd_no index and its size
+    fee_request_peak_memory_bytes       histogram per endpoint of memory-profiled
+                                        requests' peak (memory_profile.py)
+    fee_process_max_rss_bytes           largest resident set size of any worker
+
+Rows per second is rate(fee_upload_rows_total) / rate(fee_upload_seconds_total).
+
+Recording a value is a dict update under a lock, in the process that made
+it. Under gunicorn a background thread in every worker writes its values to
+METRICS_DIR/<pid>.json, at most once every FLUSH_INTERVAL seconds and only
+after requests were served, and a scrape - whichever worker serves it - adds up the files of all workers, so
+counters and histograms cover the whole server. When a worker exits the
+master folds its counters into dead.json so totals never go backwards;
+its gauges are dropped. Without METRICS_DIR (the development server) the
+process reports only itself.
+
+prometheus_client isn't a dependency; the handful of metric types needed
+here are implemented below.
+"""
+import os
+import json
+import math
+import time
+import threading
+from bisect import bisect_left
+
+from flask import g, request
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+FLUSH_INTERVAL = 1.0
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+CHART_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32)
+MEMORY_BUCKETS = tuple(mb * 1024 * 1024 for mb in (1, 4, 16, 64, 128, 256, 512, 1024, 2048))
+
+DEAD_FILE = 'dead.json'
+
+_lock = threading.Lock()
+_registry = []
+_state = {'dir': None, 'dirty': False, 'flusher_pid': None}
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, key, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in (*zip(labelnames, key), *extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        return [[list(key), value] for key, value in self._values.items()]
+
+    def merge(self, merged, series):
+        for labels, value in series:
+            key = tuple(labels)
+            merged[key] = merged.get(key, 0) + value
+
+    def render(self, merged):
+        if not merged and not self.labelnames:
+            merged = {(): 0}
+        for key, value in sorted(merged.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # label values -> [per-bucket counts (not cumulative), sum]
+        self._values = {}
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        position = bisect_left(self.buckets, value)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0]
+            series[0][position] += 1
+            series[1] += value
+
+    def snapshot(self):
+        return [[list(key), list(counts), total] for key, (counts, total) in self._values.items()]
+
+    def merge(self, merged, series):
+        for labels, counts, total in series:
+            key = tuple(labels)
+            if len(counts) != len(self.buckets):
+                # Written by a build with other buckets
+                continue
+            target = merged.setdefault(key, [[0] * len(self.buckets), 0.0])
+            target[0] = [a + b for a, b in zip(target[0], counts)]
+            target[1] += total
+
+    def render(self, merged):
+        for key, (counts, total) in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {_format_value(cumulative)}"
+            labels = _format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {_format_value(total)}"
+            yield f"{self.name}_count{labels} {_format_value(cumulative)}"
+
+
+class Gauge:
+    """Value read from a callback when the process reports; combined across workers by aggregate"""
+    kind = 'gauge'
+    labelnames = ()
+
+    def __init__(self, name, documentation, aggregate='sum'):
+        self.name = name
+        self.documentation = documentation
+        self.aggregate = aggregate
+        self._function = None
+        _registry.append(self)
+
+    def set_function(self, function):
+        self._function = function
+
+    def snapshot(self):
+        if self._function is None:
+            return []
+        try:
+            value = self._function()
+        except Exception:
+            return []
+        return [] if value is None else [value]
+
+    def merge(self, merged, series):
+        merged.setdefault((), []).extend(series)
+
+    def render(self, merged):
+        values = merged.get((), [])
+        if values:
+            value = sum(values) if self.aggregate == 'sum' else max(values)
+            yield f"{self.name} {_format_value(value)}"
+
+
+# --- The app's metrics --------------------------------------------------------
+
+REQUEST_LATENCY = Histogram('fee_http_request_duration_seconds', 'Time to serve a request.',
+                            ['method', 'endpoint', 'status'])
+UPLOAD_ROWS = Counter('fee_upload_rows_total', 'Spreadsheet rows saved by uploads.')
+UPLOAD_ROW_ERRORS = Counter('fee_upload_row_errors_total', 'Spreadsheet rows skipped with a warning.')
+UPLOADS = Counter('fee_uploads_total', 'Spreadsheet uploads by result.', ['result'])
+UPLOAD_SECONDS = Counter('fee_upload_seconds_total', 'Time spent reading and saving uploaded spreadsheets.')
+CHART_RENDER = Histogram('fee_chart_render_seconds', 'Time to query and draw a dashboard chart.',
+                         ['chart'], buckets=CHART_BUCKETS)
+CACHE_LOOKUPS = Counter('fee_cache_lookups_total',
+                        'In-process cache lookups; a miss had to read the database.', ['cache', 'result'])
+DB_POOL_CHECKED_OUT = Gauge('fee_db_pool_checked_out', 'Database connections in use.')
+DB_POOL_SIZE = Gauge('fee_db_pool_size', 'Database connections the pools keep.')
+DB_POOL_OVERFLOW = Gauge('fee_db_pool_overflow', 'Connections opened beyond the pool size (negative: unused slots).')
+STUDENT_INDEX_STUDENTS = Gauge('fee_student_index_students', 'Students in the regd_no index.', aggregate='max')
+STUDENT_INDEX_BYTES = Gauge('fee_student_index_bytes', 'Approximate size of the regd_no index in one worker.',
+                            aggregate='max')
+REQUEST_PEAK_MEMORY = Histogram('fee_request_peak_memory_bytes',
+                                'Peak Python heap growth of a memory-profiled request (tracemalloc).',
+                                ['endpoint'], buckets=MEMORY_BUCKETS)
+PROCESS_MAX_RSS = Gauge('fee_process_max_rss_bytes', 'Largest resident set size a worker has reached.',
+                        aggregate='max')
+
+
+def cache_lookup(cache, hit):
+    CACHE_LOOKUPS.inc(cache=cache, result='hit' if hit else 'miss')
+
+
+# --- Collecting across workers -----------------------------------------------
+
+def _snapshot():
+    with _lock:
+        data = {metric.name: metric.snapshot() for metric in _registry if metric.kind != 'gauge'}
+    # Gauge callbacks may take locks of their own, so they run outside _lock
+    data.update({metric.name: metric.snapshot() for metric in _registry if metric.kind == 'gauge'})
+    return data
+
+
+def _write(path, data):
+    temp = f"{path}.{os.getpid()}.tmp"
+    with open(temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Being replaced or folded into dead.json right now
+        return None
+
+
+def configure(directory):
+    """Share values through directory (None: report this process only)"""
+    _state['dir'] = directory
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+def flush():
+    """Write this process's values for the other workers' scrapes"""
+    directory = _state['dir']
+    if not directory:
+        return
+    _state['dirty'] = False
+    _write(os.path.join(directory, f"{os.getpid()}.json"), _snapshot())
+
+
+def _flush_loop():
+    while True:
+        time.sleep(FLUSH_INTERVAL)
+        if _state['dirty']:
+            try:
+                flush()
+            except OSError:
+                pass
+
+
+def mark_dirty():
+    """Note new values; the first call in a process starts its flush thread"""
+    _state['dirty'] = True
+    # Threads don't survive fork(), so each worker starts its own
+    if _state['dir'] and _state['flusher_pid'] != os.getpid():
+        _state['flusher_pid'] = os.getpid()
+        threading.Thread(target=_flush_loop, name='metrics-flush', daemon=True).start()
+
+
+def reset_process():
+    """Forget values inherited from the parent process (call after fork)"""
+    with _lock:
+        for metric in _registry:
+            if metric.kind != 'gauge':
+                metric._values.clear()
+    _state['dirty'] = False
+
+
+def clear_directory(directory):
+    """Remove the files of a previous server run (gunicorn master, before forking)"""
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith('.json') or name.endswith('.tmp'):
+            os.remove(os.path.join(directory, name))
+
+
+def mark_process_dead(directory, pid):
+    """Fold an exited worker's counters and histograms into dead.json"""
+    path = os.path.join(directory, f"{pid}.json")
+    data = _read(path)
+    if data is None:
+        return
+    dead_path = os.path.join(directory, DEAD_FILE)
+    dead = _read(dead_path) or {}
+    for metric in _registry:
+        if metric.kind == 'gauge' or metric.name not in data:
+            continue
+        merged = {}
+        metric.merge(merged, dead.get(metric.name, []))
+        metric.merge(merged, data[metric.name])
+        dead[metric.name] = (
+            [[list(key), value] for key, value in merged.items()] if metric.kind == 'counter'
+            else [[list(key), counts, total] for key, (counts, total) in merged.items()]
+        )
+    _write(dead_path, dead)
+    os.remove(path)
+
+
+def render():
+    """All metrics in the Prometheus text format"""
+    directory = _state['dir']
+    if directory:
+        flush()
+        snapshots = [_read(os.path.join(directory, name))
+                     for name in sorted(os.listdir(directory)) if name.endswith('.json')]
+    else:
+        snapshots = [_snapshot()]
+
+    lines = []
+    for metric in _registry:
+        merged = {}
+        for data in snapshots:
+            if data and metric.name in data:
+                metric.merge(merged, data[metric.name])
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render(merged))
+    return '\n'.join(lines) + '\n'
+
+
+def install_metrics(app, engine):
+    """Time every request, report the connection pool and the student index, share through METRICS_DIR"""
+    configure(app.config.get('METRICS_DIR'))
+
+    # engine.dispose() (gunicorn's post_fork) replaces the pool, so look it up each time;
+    # SQLite :memory: databases use a pool without these counters
+    def pool_stat(name):
+        return lambda: getattr(engine.pool, name)() if hasattr(engine.pool, name) else None
+
+    DB_POOL_CHECKED_OUT.set_function(pool_stat('checkedout'))
+    DB_POOL_SIZE.set_function(pool_stat('size'))
+    DB_POOL_OVERFLOW.set_function(pool_stat('overflow'))
+
+    from student_index import student_index
+    STUDENT_INDEX_STUDENTS.set_function(student_index.size)
+    STUDENT_INDEX_BYTES.set_function(student_index.memory_bytes)
+
+    @app.before_request
+    def _start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('metrics_started', None)
+        if started is None or request.endpoint == 'static':
+            return response
+        REQUEST_LATENCY.observe(time.perf_counter() - started, method=request.method,
+                                endpoint=request.endpoint or 'unmatched', status=response.status_code)
+        mark_dirty()
+        return response
@@ -0,0 +1,383 @@
+"""
+Schema migrations for existing SQLite databases.
+
+The schema version is tracked in SQLite's PRAGMA user_version. A fresh
+database created by db.create_all() already matches the models, so it is
+simply stamped with the latest version; older databases get each pending
+migration applied in order.
+
+Migrations work on a plain sqlite3 connection so sqlite_uploader.py can
+use them without an application context.
+"""
+import re
+
+from fee_types import seed_fee_types, load_alias_map, resolve_fee_type_id, add_alias
+from dimensions import DIMENSION_COLUMNS, dimension_ddl
+from student_search import install_student_search
+
+# Tables whose inserts, updates and deletes are recorded in change_log
+CHANGE_TRACKED_TABLES = ['student', 'fee_master', 'payment']
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def _set_schema_version(conn, version):
+    # PRAGMA does not accept bound parameters
+    conn.execute(f"PRAGMA user_version = {int(version)}")
+
+
+def _table_columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _tracked_tables(conn):
+    """Tracked tables present in this database (the legacy uploader schema has no fee_master)"""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return [table for table in CHANGE_TRACKED_TABLES if table in existing]
+
+
+def change_log_ddl(tables=CHANGE_TRACKED_TABLES):
+    """DDL for the change_log table and the triggers that keep it current"""
+    statements = ['''
+    CREATE TABLE IF NOT EXISTS change_log (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name VARCHAR(30) NOT NULL,
+        row_id INTEGER NOT NULL,
+        operation VARCHAR(10) NOT NULL,
+        changed_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''']
+    for table in tables:
+        for operation, row in (('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')):
+            statements.append(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation}_change_log
+            AFTER {operation.upper()} ON {table}
+            BEGIN
+                INSERT INTO change_log (table_name, row_id, operation)
+                VALUES ('{table}', {row}.id, '{operation}');
+            END
+            ''')
+    return statements
+
+
+def install_change_log(conn):
+    """Create the change_log table and triggers if they are missing"""
+    for statement in change_log_ddl(_tracked_tables(conn)):
+        conn.execute(statement)
+
+
+def _migrate_change_log(conn):
+    """Add updated_at columns and seed change_log with the existing rows"""
+    for table in _tracked_tables(conn):
+        if 'updated_at' not in _table_columns(conn, table):
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN updated_at DATETIME")
+            conn.execute(f"UPDATE {table} SET updated_at = CURRENT_TIMESTAMP")
+
+    install_change_log(conn)
+
+    # Existing rows show up as inserts so a sync starting from cursor 0 gets everything
+    if conn.execute("SELECT COUNT(*) FROM change_log").fetchone()[0] == 0:
+        for table in _tracked_tables(conn):
+            conn.execute(
+                f"INSERT INTO change_log (table_name, row_id, operation) "
+                f"SELECT '{table}', id, 'insert' FROM {table} ORDER BY id"
+            )
+
+
+# REAL rupee columns converted to INTEGER paise columns by migration 2
+PAISE_COLUMNS = [
+    ('fee_master', 'amount'),
+    ('payment', 'amount_paid'),
+    ('payment', 'amount'),  # legacy sqlite_uploader schema
+]
+
+
+def _migrate_amounts_to_paise(conn):
+    """Replace REAL rupee amounts with exact INTEGER paise columns"""
+    existing = _tracked_tables(conn)
+    for table, column in PAISE_COLUMNS:
+        if table not in existing:
+            continue
+        columns = _table_columns(conn, table)
+        if column not in columns or f"{column}_paise" in columns:
+            continue
+        conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}_paise INTEGER NOT NULL DEFAULT 0")
+        conn.execute(f"UPDATE {table} SET {column}_paise = CAST(ROUND({column} * 100) AS INTEGER)")
+        conn.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+
+
+FEE_TYPE_DDL = '''
+CREATE TABLE IF NOT EXISTS fee_type (
+    id INTEGER PRIMARY KEY,
+    code VARCHAR(50) NOT NULL UNIQUE,
+    label VARCHAR(50) NOT NULL,
+    aliases TEXT
+)
+'''
+
+
+def _legacy_fee_type_code(spelling):
+    """The substring rules normalize_fee_type() applied before the registry existed"""
+    fee_type = (spelling or '').lower().strip()
+    if 'crt' in fee_type:
+        return 'crt fee'
+    elif any(x in fee_type for x in ['phase 3', 'phase-3', 'phase-iii', 'phase iii']):
+        return 'smart interviews phase-iii'
+    elif any(x in fee_type for x in ['phase 2', 'phase-2', 'phase-ii', 'phase ii']):
+        return 'smart interviews phase-ii'
+    return fee_type
+
+
+def _migrate_fee_type_registry(conn):
+    """Create the fee_type registry and point fee_master/payment rows at it by id"""
+    conn.execute(FEE_TYPE_DDL)
+    seed_fee_types(conn)
+    alias_map = load_alias_map(conn)
+
+    for table in _tracked_tables(conn):
+        columns = _table_columns(conn, table)
+        if 'fee_type' not in columns:
+            continue
+        if 'fee_type_id' not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN fee_type_id INTEGER REFERENCES fee_type (id)")
+        spellings = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT fee_type FROM {table} WHERE fee_type_id IS NULL"
+        )]
+        for spelling in spellings:
+            # Map with the old heuristics once, then remember the spelling as an
+            # alias so later uploads resolve it with a plain dictionary lookup
+            fee_type_id = resolve_fee_type_id(conn, alias_map, _legacy_fee_type_code(spelling))
+            add_alias(conn, alias_map, fee_type_id, spelling)
+            conn.execute(f"UPDATE {table} SET fee_type_id = ? WHERE fee_type = ?", (fee_type_id, spelling))
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_fee_type_id ON {table} (fee_type_id)")
+
+
+# (table, id column, dimension table) filled by migration 4
+DIMENSION_FOREIGN_KEYS = [
+    ('student', 'batch_id', 'batch'),
+    ('student', 'branch_id', 'branch'),
+    ('payment', 'batch_id', 'batch'),
+]
+
+
+def _migrate_dimensions(conn):
+    """Move batch years and branches into dimension tables referenced by integer ids"""
+    for statement in dimension_ddl():
+        conn.execute(statement)
+
+    existing = _tracked_tables(conn)
+    for table, id_column, dimension in DIMENSION_FOREIGN_KEYS:
+        name_column = DIMENSION_COLUMNS[dimension]
+        if table not in existing:
+            continue
+        columns = _table_columns(conn, table)
+        # The legacy uploader's payment table has no batch_year column
+        if name_column not in columns:
+            continue
+        if id_column not in columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {id_column} INTEGER REFERENCES {dimension} (id)")
+        conn.execute(
+            f"INSERT OR IGNORE INTO {dimension} (name) "
+            f"SELECT DISTINCT trim({name_column}) FROM {table} WHERE {name_column} IS NOT NULL"
+        )
+        conn.execute(
+            f"UPDATE {table} SET {id_column} = "
+            f"(SELECT id FROM {dimension} WHERE name = trim({table}.{name_column}))"
+        )
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_{id_column} ON {table} ({id_column})")
+
+
+def rebuilds_tables(migrate):
+    """Mark a migration that rebuilds tables; run_migrations() runs it with foreign keys off"""
+    migrate.rebuilds_tables = True
+    return migrate
+
+
+def _column_definitions(conn, table, replace):
+    """Column DDL for a rebuilt copy of table, with the columns in replace swapped out
+    (or dropped, where replace maps them to None).
+
+    Types, NOT NULL, defaults, foreign keys, composite primary keys and UNIQUE
+    constraints are read back from PRAGMA table_info / foreign_key_list /
+    index_list so the legacy uploader schema is handled too.
+    """
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    references = {fk[3]: (fk[2], fk[4]) for fk in conn.execute(f"PRAGMA foreign_key_list({table})")}
+    columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+    primary_key = [name for _, name, _, _, _, pk in sorted(columns, key=lambda column: column[5]) if pk]
+    definitions = []
+    kept = []
+    for cid, name, column_type, notnull, default, pk in columns:
+        if name in replace:
+            if replace[name] is not None:
+                definitions.append(replace[name])
+            continue
+        ddl = f"{name} {column_type}".strip()
+        if pk and len(primary_key) == 1:
+            ddl += " PRIMARY KEY" + (" AUTOINCREMENT" if 'AUTOINCREMENT' in sql.upper() else "")
+        elif notnull:
+            ddl += " NOT NULL"
+        if default is not None:
+            ddl += f" DEFAULT {default}"
+        if name in references:
+            ddl += f" REFERENCES {references[name][0]} ({references[name][1]})"
+        definitions.append(ddl)
+        kept.append(name)
+    if len(primary_key) > 1:
+        definitions.append(f"PRIMARY KEY ({', '.join(primary_key)})")
+    for _, index, unique, origin, _ in conn.execute(f"PRAGMA index_list({table})"):
+        if origin == 'u':
+            unique_columns = [row[2] for row in conn.execute(f"PRAGMA index_info({index})")]
+            if all(column in kept for column in unique_columns):
+                definitions.append(f"UNIQUE ({', '.join(unique_columns)})")
+    return definitions, kept
+
+
+@rebuilds_tables
+def _migrate_student_id_keys(conn):
+    """Point fee_master and payment at student.id instead of the regd_no string"""
+    for table in _tracked_tables(conn):
+        if table == 'student' or 'regd_no' not in _table_columns(conn, table):
+            continue
+
+        definitions, kept = _column_definitions(
+            conn, table, {'regd_no': "student_id INTEGER NOT NULL REFERENCES student (id)"}
+        )
+        indexes = [row[0] for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+        ) if 'regd_no' not in row[0]]
+
+        # Rows whose student no longer exists can't get a student_id; keep them aside
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {table}_orphaned AS SELECT * FROM {table} WHERE 0")
+        orphaned = conn.execute(
+            f"INSERT INTO {table}_orphaned SELECT * FROM {table} "
+            f"WHERE regd_no NOT IN (SELECT regd_no FROM student)"
+        ).rowcount
+        if orphaned:
+            print(f"Moved {orphaned} {table} rows without a matching student to {table}_orphaned")
+
+        conn.execute(f"CREATE TABLE {table}_new ({', '.join(definitions)})")
+        conn.execute(
+            f"INSERT INTO {table}_new ({', '.join(kept)}, student_id) "
+            f"SELECT {', '.join('t.' + column for column in kept)}, s.id "
+            f"FROM {table} t JOIN student s ON s.regd_no = t.regd_no"
+        )
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for index_sql in indexes:
+            conn.execute(index_sql)
+        conn.execute(f"CREATE INDEX IF NOT EXISTS ix_{table}_student_id ON {table} (student_id)")
+
+        problems = conn.execute(f"PRAGMA foreign_key_check({table})").fetchall()
+        if problems:
+            raise RuntimeError(f"{table} has {len(problems)} rows with broken foreign keys after the rebuild")
+
+    # DROP TABLE took the change_log triggers with it
+    install_change_log(conn)
+
+
+# Text columns the batch/branch ids replaced (migration 4), dropped by migration 7
+DIMENSION_NAME_COLUMNS = {
+    'student': ['batch_year', 'branch'],
+    'payment': ['batch_year'],
+    'payment_archive': ['batch_year'],
+}
+
+
+@rebuilds_tables
+def _drop_dimension_names(conn):
+    """Drop the batch_year / branch text columns; readers join batch and branch instead"""
+    existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    for table, names in DIMENSION_NAME_COLUMNS.items():
+        if table not in existing:
+            continue
+        dropped = [name for name in names if name in _table_columns(conn, table)]
+        if not dropped:
+            continue
+
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+        definitions, kept = _column_definitions(conn, table, dict.fromkeys(dropped))
+        mentions_dropped = re.compile(r'\b(' + '|'.join(dropped) + r')\b')
+        indexes = [row[0] for row in conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL", (table,)
+        ) if not mentions_dropped.search(row[0])]
+
+        options = " WITHOUT ROWID" if 'WITHOUT ROWID' in sql.upper() else ""
+        conn.execute(f"CREATE TABLE {table}_new ({', '.join(definitions)}){options}")
+        conn.execute(f"INSERT INTO {table}_new ({', '.join(kept)}) SELECT {', '.join(kept)} FROM {table}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+        for index_sql in indexes:
+            conn.execute(index_sql)
+
+        problems = conn.execute(f"PRAGMA foreign_key_check({table})").fetchall()
+        if problems:
+            raise RuntimeError(f"{table} has {len(problems)} rows with broken foreign keys after the rebuild")
+
+    # DROP TABLE took the change_log and student_search triggers with it
+    install_change_log(conn)
+    install_student_search(conn)
+
+
+# (version, description, function) - append new migrations to the end
+MIGRATIONS = [
+    (1, "Add updated_at columns and the change_log feed", _migrate_change_log),
+    (2, "Store fee and payment amounts as integer paise", _migrate_amounts_to_paise),
+    (3, "Add the fee_type registry and fee_type_id foreign keys", _migrate_fee_type_registry),
+    (4, "Add batch and branch dimension tables", _migrate_dimensions),
+    (5, "Reference students by integer id from fee_master and payment", _migrate_student_id_keys),
+    (6, "Add the student_search trigram index", install_student_search),
+    (7, "Drop the batch_year and branch text columns", _drop_dimension_names),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def run_migrations(conn, fresh=False):
+    """Bring the database up to SCHEMA_VERSION and return the applied versions.
+
+    Pass fresh=True when the tables were just created from the models.
+    """
+    applied = []
+    if fresh:
+        install_change_log(conn)
+        install_student_search(conn)
+        seed_fee_types(conn)
+        _set_schema_version(conn, SCHEMA_VERSION)
+        conn.commit()
+        return applied
+
+    current = get_schema_version(conn)
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        print(f"Applying migration {version}: {description}")
+        rebuild = getattr(migrate, 'rebuilds_tables', False)
+        if rebuild:
+            # SQLite's table rebuild recipe: foreign keys off (which only works outside
+            # a transaction), then the whole rebuild inside one explicit transaction
+            conn.commit()
+            foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+            conn.execute("PRAGMA foreign_keys = OFF")
+        try:
+            if rebuild:
+                conn.execute("BEGIN")
+            migrate(conn)
+            _set_schema_version(conn, version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            if rebuild:
+                conn.execute(f"PRAGMA foreign_keys = {int(foreign_keys)}")
+        applied.append(version)
+
+    # Triggers are cheap to re-check and may have been dropped by a manual rebuild
+    install_change_log(conn)
+    install_student_search(conn)
+    seed_fee_types(conn)
+    conn.commit()
+    return applied
@@ -3,8 +3,30 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from datetime import datetime
 
+from money import from_paise
+
 db = SQLAlchemy()
 
+# Batch and branch dimensions - filter dropdowns read these instead of
+# SELECT DISTINCT over the student table (see dimensions.py)
+class Batch(db.Model):
+    __tablename__ = 'batch'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(20), unique=True, nullable=False)
+    
+    def __repr__(self):
+        return f"<Batch {self.id}: {self.name}>"
+
+class Branch(db.Model):
+    __tablename__ = 'branch'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), unique=True, nullable=False)
+    
+    def __repr__(self):
+        return f"<Branch {self.id}: {self.name}>"
+
 # Student model
 class Student(db.Model):
     __tablename__ = 'student'
@@ -12,25 +34,48 @@ class Student(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     regd_no = db.Column(db.String(20), unique=True, nullable=False)
     name = db.Column(db.String(100), nullable=False)
-    batch_year = db.Column(db.String(10), nullable=False)
-    branch = db.Column(db.String(50), nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), nullable=False, index=True)
+    branch_id = db.Column(db.Integer, db.ForeignKey('branch.id'), nullable=False, index=True)
     mobile = db.Column(db.String(15), nullable=True)
-    # Define relationships to other tables
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Define relationships to other tables - both join on the integer student_id
     fees = db.relationship('FeeMaster', backref='student', lazy=True)
     payments = db.relationship('Payment', backref='student', lazy=True)
     
     def __repr__(self):
         return f"<Student {self.regd_no}: {self.name}>"
 
+# Fee type registry (CRT, Phase 2, ...) - see fee_types.py for the in-memory alias lookup
+class FeeType(db.Model):
+    __tablename__ = 'fee_type'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(50), unique=True, nullable=False)
+    label = db.Column(db.String(50), nullable=False)
+    # Comma-separated alias keys, e.g. "phase 2,phase ii,phase2"
+    aliases = db.Column(db.Text, nullable=True)
+    
+    def __repr__(self):
+        return f"<FeeType {self.id}: {self.label}>"
+
 # Fee model
 class FeeMaster(db.Model): 
     __tablename__ = 'fee_master'
     
     id = db.Column(db.Integer, primary_key=True)
-    regd_no = db.Column(db.String(20), db.ForeignKey('student.regd_no'), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False, index=True)
+    fee_type_id = db.Column(db.Integer, db.ForeignKey('fee_type.id'), nullable=False, index=True)
+    # Registry code of fee_type_id, kept for exports and the change feed
     fee_type = db.Column(db.String(50), nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    # Stored in paise (see money.py) so sums and comparisons are exact
+    amount_paise = db.Column(db.Integer, nullable=False)
     remarks = db.Column(db.Text, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @property
+    def amount(self):
+        """Fee amount in rupees, for display"""
+        return from_paise(self.amount_paise)
     
     def __repr__(self):
         return f"<FeeMaster {self.id}: {self.fee_type} - {self.amount}>"
@@ -39,15 +84,109 @@ class Payment(db.Model):
     __tablename__ = 'payment'
     
     id = db.Column(db.Integer, primary_key=True)
-    regd_no = db.Column(db.String(20), db.ForeignKey('student.regd_no'), nullable=False)
-    batch_year = db.Column(db.String(20), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id'), nullable=False, index=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), nullable=False, index=True)
+    fee_type_id = db.Column(db.Integer, db.ForeignKey('fee_type.id'), nullable=False, index=True)
+    # Registry code of fee_type_id, kept for exports and the change feed
     fee_type = db.Column(db.String(100), nullable=False)
-    amount_paid = db.Column(db.Float, nullable=False)
+    # Stored in paise (see money.py)
+    amount_paid_paise = db.Column(db.Integer, nullable=False)
     date = db.Column(db.Date, nullable=False)
     received_by = db.Column(db.String(100), nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    @property
+    def amount_paid(self):
+        """Paid amount in rupees, for display"""
+        return from_paise(self.amount_paid_paise)
     
     def __repr__(self):
-        return f"<Payment {self.regd_no}: {self.fee_type} - ₹{self.amount_paid}>"
+        return f"<Payment {self.id}: student {self.student_id} {self.fee_type} - ₹{self.amount_paid}>"
+
+# Fully paid fee entries and their payments moved out of the live tables by
+# "Delete Paid Records" (see archive.py); kept so an archive run can be restored
+class ArchiveBatch(db.Model):
+    __tablename__ = 'archive_batch'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Filters the run was made with ('' = all)
+    batch_year = db.Column(db.String(20), nullable=False, default='')
+    fee_type = db.Column(db.String(100), nullable=False, default='')
+    students = db.Column(db.Integer, nullable=False, default=0)
+    fee_entries = db.Column(db.Integer, nullable=False, default=0)
+    payments = db.Column(db.Integer, nullable=False, default=0)
+    restored_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f"<ArchiveBatch {self.id}: {self.fee_entries} fee entries, {self.payments} payments>"
+
+# Whole batch years moved to their own SQLite file (see cold_storage.py)
+class ColdArchive(db.Model):
+    __tablename__ = 'cold_archive'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), unique=True, nullable=False)
+    path = db.Column(db.String(500), nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    students = db.Column(db.Integer, nullable=False, default=0)
+    fee_entries = db.Column(db.Integer, nullable=False, default=0)
+    payments = db.Column(db.Integer, nullable=False, default=0)
+    
+    batch = db.relationship('Batch')
+    
+    def __repr__(self):
+        return f"<ColdArchive batch {self.batch_id}: {self.path}>"
+
+def _archive_table(table):
+    """Copy of a live table's columns, plus the archive run each row belongs to"""
+    return db.Table(
+        f"{table.name}_archive",
+        db.Column('archive_id', db.Integer, db.ForeignKey('archive_batch.id'), primary_key=True),
+        # No foreign keys or unique constraints: archived rows must outlive their references
+        *[db.Column(column.name, column.type, primary_key=column.primary_key, nullable=column.nullable)
+          for column in table.columns],
+        sqlite_with_rowid=False
+    )
+
+fee_master_archive = _archive_table(FeeMaster.__table__)
+payment_archive = _archive_table(Payment.__table__)
+
+# Change feed - one row per insert/update/delete, written by SQLite triggers
+# (see migrations.change_log_ddl) so every write path is captured
+class ChangeLog(db.Model):
+    __tablename__ = 'change_log'
+    __table_args__ = {'sqlite_autoincrement': True}
+    
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(30), nullable=False)
+    row_id = db.Column(db.Integer, nullable=False)
+    operation = db.Column(db.String(10), nullable=False)
+    changed_at = db.Column(db.DateTime, nullable=False, server_default=db.func.current_timestamp())
+    
+    def __repr__(self):
+        return f"<ChangeLog {self.seq}: {self.operation} {self.table_name}#{self.row_id}>"
+
+# A saved set of students (e.g. the ones an upload touched), referenced by a
+# short token in the URL instead of a long reg_numbers list (see selections.py)
+class StudentSelection(db.Model):
+    __tablename__ = 'student_selection'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    token = db.Column(db.String(32), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<StudentSelection {self.token}>"
+
+class StudentSelectionMember(db.Model):
+    __tablename__ = 'student_selection_member'
+    # Rows are only ever found through the primary key
+    __table_args__ = {'sqlite_with_rowid': False}
+    
+    # The primary key doubles as the index student_details joins through
+    selection_id = db.Column(db.Integer, db.ForeignKey('student_selection.id', ondelete='CASCADE'), primary_key=True)
+    student_id = db.Column(db.Integer, db.ForeignKey('student.id', ondelete='CASCADE'), primary_key=True)
 
 # Admin model for authentication
 class Admin(db.Model, UserMixin):
@@ -83,10 +222,30 @@ class Admin(db.Model, UserMixin):
             return None
 
 # Function to initialize the database with the app
-def init_db(app):
+def init_db(app, bootstrap=True):
+    from sqlite_tuning import install_sqlite_profile
+    
     db.init_app(app)
     with app.app_context():
+        # Register the PRAGMA profile before the first connection is opened
+        install_sqlite_profile(db.engine, app.config.get('SQLITE_PRAGMAS'))
+    if bootstrap:
+        bootstrap_db(app)
+
+# Create tables, apply migrations and add the default admin.
+# Production servers run this once (flask init-db / gunicorn on_starting), not in every worker.
+def bootstrap_db(app):
+    from migrations import run_migrations
+    
+    with app.app_context():
+        fresh = not db.inspect(db.engine).has_table('student')
         db.create_all()
+        # Bring older databases up to date with the models
+        conn = db.engine.raw_connection()
+        try:
+            run_migrations(conn.driver_connection, fresh=fresh)
+        finally:
+            conn.close()
         # Create default admin user
         print("Attempting to create default admin...")
         Admin.create_default_admin(db.session)
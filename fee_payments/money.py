@@ -0,0 +1,50 @@
+"""
+Money helpers.
+
+Amounts are stored as integer paise (1 rupee = 100 paise) so sums and
+comparisons are exact. Rupee values only exist at the edges: parsing form,
+JSON and spreadsheet input, and formatting for display.
+"""
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+PAISE_PER_RUPEE = 100
+
+
+def to_paise(value):
+    """Convert a rupee amount (str, int, float or Decimal) to integer paise"""
+    if value is None or value == '':
+        raise ValueError("Amount is required")
+    try:
+        # Go through str() so floats like 0.1 are taken at their printed value
+        rupees = Decimal(str(value).strip().replace(',', ''))
+    except InvalidOperation:
+        raise ValueError(f"Invalid amount: {value}")
+    if not rupees.is_finite():
+        raise ValueError(f"Invalid amount: {value}")
+    return int((rupees * PAISE_PER_RUPEE).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+
+def from_paise(paise):
+    """Convert integer paise to rupees for display and JSON output"""
+    if paise is None:
+        return 0.0
+    return paise / PAISE_PER_RUPEE
+
+
+def split_paise(total, weights):
+    """Split total paise proportionally to weights.
+
+    Each share is rounded down and the last share takes the remainder, so
+    the shares always add up to exactly total. Falls back to an equal split
+    when every weight is zero.
+    """
+    if not weights:
+        return []
+    total_weight = sum(weights)
+    if total_weight <= 0:
+        weights = [1] * len(weights)
+        total_weight = len(weights)
+
+    shares = [total * weight // total_weight for weight in weights[:-1]]
+    shares.append(total - sum(shares))
+    return shares
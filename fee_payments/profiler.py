@@ -0,0 +1,260 @@
+"""
+On-demand request profiling.
+
+When a page is slow in production it's rarely obvious whether pandas,
+matplotlib, SQL or Jinja is to blame. A logged-in admin can add
+?__profile=1 to any URL to profile that one request, and
+PROFILE_SAMPLE_RATE (0 to 1) profiles that fraction of all requests.
+
+A profiled request runs under two profilers:
+
+- cProfile, saved as <name>.prof (python -m pstats, snakeviz)
+- a sampler thread that records the request thread's stack every
+  SAMPLE_INTERVAL seconds, saved as <name>.collapsed: one
+  "outer;...;inner count" line per stack, ready for flamegraph.pl or
+  speedscope
+
+The files go to PROFILE_DIR (default instance/profiles); the newest
+PROFILE_KEEP profiles are kept. The response names its profile in an
+X-Profile header, and /admin/profiles lists recent profiles with the own
+time spent per library and their top functions.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import pstats
+import cProfile
+import secrets
+import threading
+import traceback
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request, current_app
+from flask_login import current_user
+
+PROFILE_PARAM = '__profile'
+SAMPLE_INTERVAL = 0.005
+TOP_FUNCTIONS = 20
+DEFAULT_KEEP = 100
+FILE_KINDS = ('prof', 'collapsed', 'json')
+
+# Never profiled: scrapes and the profile pages themselves
+SKIPPED_ENDPOINTS = {'static', 'main.prometheus_metrics', 'main.admin_profiles', 'main.admin_profile_file'}
+
+# Own time is grouped by the first library whose marker appears in a function's file or name
+LIBRARIES = [
+    ('sql', ('sqlalchemy', 'sqlite3')),
+    ('pandas', ('/pandas/',)),
+    ('numpy', ('/numpy/',)),
+    ('matplotlib', ('/matplotlib/', '/seaborn/', '/PIL/')),
+    ('jinja', ('/jinja2/', '/markupsafe/')),
+    ('flask', ('/flask/', '/flask_login/', '/werkzeug/')),
+]
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def profile_dir():
+    return current_app.config.get('PROFILE_DIR') or os.path.join(current_app.instance_path, 'profiles')
+
+
+def library_of(filename, function):
+    for library, markers in LIBRARIES:
+        if any(marker in filename or marker in function for marker in markers):
+            return library
+    if filename.startswith(APP_DIR) and '/site-packages/' not in filename:
+        return 'app'
+    return 'other'
+
+
+def _library_of_entry(stats, key, depth=0):
+    """library_of() for a pstats entry; built-ins count towards the library that called them"""
+    filename, _, function = key
+    library = library_of(filename, function)
+    callers = stats[key][4]
+    if library == 'other' and filename == '~' and callers and depth < 3:
+        caller = max(callers, key=lambda entry: callers[entry][2])
+        if caller in stats:
+            return _library_of_entry(stats, caller, depth + 1)
+    return library
+
+
+def _function_label(filename, line, function):
+    if filename == '~':
+        # Built-in, e.g. <method 'execute' of 'sqlite3.Cursor' objects>
+        return function
+    return f"{function} ({os.path.basename(filename)}:{line})"
+
+
+class StackSampler:
+    """Counts the stacks one thread is seen in, sampled from a background thread"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.stacks = Counter()
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def summarize(stats):
+    """Own time per library and the functions with the most own time, from a pstats.Stats"""
+    libraries = Counter()
+    functions = []
+    for key, (_, calls, own, cumulative, _) in stats.stats.items():
+        filename, line, function = key
+        libraries[_library_of_entry(stats.stats, key)] += own
+        functions.append((own, cumulative, calls, _function_label(filename, line, function)))
+    functions.sort(reverse=True)
+    return {
+        'libraries_ms': {library: round(seconds * 1000, 1) for library, seconds in libraries.most_common()},
+        'top': [
+            {'function': label, 'calls': calls, 'own_ms': round(own * 1000, 2),
+             'cumulative_ms': round(cumulative * 1000, 2)}
+            for own, cumulative, calls, label in functions[:TOP_FUNCTIONS]
+        ],
+    }
+
+
+def _wanted():
+    if request.endpoint is None or request.endpoint in SKIPPED_ENDPOINTS:
+        return False
+    if request.args.get(PROFILE_PARAM) == '1':
+        return current_user.is_authenticated
+    rate = current_app.config.get('PROFILE_SAMPLE_RATE', 0)
+    return rate > 0 and random.random() < rate
+
+
+def _save(profiler, sampler, started, status):
+    """Write the .prof, .collapsed and .json files of a finished request; returns the profile name"""
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    endpoint = (request.endpoint or 'unknown').rsplit('.', 1)[-1]
+    name = f"{datetime.now():%Y%m%d-%H%M%S}-{endpoint}-{secrets.token_hex(3)}"
+    path = os.path.join(directory, name)
+
+    profiler.dump_stats(f"{path}.prof")
+    with open(f"{path}.collapsed", 'w') as f:
+        f.write(sampler.collapsed())
+    summary = {
+        'name': name,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'method': request.method,
+        'path': request.full_path.rstrip('?'),
+        'endpoint': request.endpoint,
+        'status': status,
+        'ms': round(elapsed_ms, 1),
+        'samples': sum(sampler.stacks.values()),
+        **summarize(pstats.Stats(profiler)),
+    }
+    with open(f"{path}.json", 'w') as f:
+        json.dump(summary, f)
+
+    _prune(directory, current_app.config.get('PROFILE_KEEP', DEFAULT_KEEP))
+    current_app.logger.info("Saved profile %s (%s %s, %.0f ms)", name, request.method, request.path, elapsed_ms)
+    return name
+
+
+def _prune(directory, keep):
+    names = sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+    for name in names[:max(len(names) - keep, 0)]:
+        for kind in FILE_KINDS:
+            try:
+                os.remove(os.path.join(directory, f"{name}.{kind}"))
+            except FileNotFoundError:
+                pass
+
+
+def recent_profiles(limit=50):
+    """Summaries of the newest profiles, newest first"""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for filename in sorted((name for name in os.listdir(directory) if name.endswith('.json')), reverse=True)[:limit]:
+        try:
+            with open(os.path.join(directory, filename)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            # Pruned or still being written
+            continue
+    return profiles
+
+
+def profile_file(name, kind):
+    """Path of one of a profile's files, or None if the name or kind isn't valid"""
+    if kind not in FILE_KINDS or not re.fullmatch(r'[A-Za-z0-9_-]+', name):
+        return None
+    path = os.path.join(profile_dir(), f"{name}.{kind}")
+    return path if os.path.exists(path) else None
+
+
+def _finish(profile, status):
+    profiler, sampler, started = profile
+    profiler.disable()
+    sampler.stop()
+    try:
+        return _save(profiler, sampler, started, status)
+    except Exception as e:
+        current_app.logger.error("Error saving profile: %s", e)
+        current_app.logger.error(traceback.format_exc())
+        return None
+
+
+def install_profiler(app):
+    """Profile requests asked for with ?__profile=1 (admins) or picked by PROFILE_SAMPLE_RATE"""
+
+    @app.before_request
+    def _start_profile():
+        if not _wanted():
+            return
+        profiler = cProfile.Profile()
+        sampler = StackSampler(threading.get_ident())
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active in this thread
+            return
+        sampler.start()
+        g.profile = (profiler, sampler, time.perf_counter())
+
+    @app.after_request
+    def _save_profile(response):
+        profile = g.pop('profile', None)
+        if profile is not None:
+            name = _finish(profile, response.status_code)
+            if name:
+                response.headers['X-Profile'] = name
+        return response
+
+    @app.teardown_request
+    def _stop_profile(exc):
+        # Only still set when the request failed before after_request ran
+        profile = g.pop('profile', None)
+        if profile is not None:
+            _finish(profile, 500)
@@ -0,0 +1,190 @@
+"""
+Per-request SQL instrumentation.
+
+Cursor events on the engine count every statement a request runs and time
+it. Each response gets a Server-Timing header, which browser dev tools
+show in the network panel:
+
+    Server-Timing: db;desc="14 queries";dur=8.2, app;dur=35.0
+
+The last QUERY_STATS_WINDOW requests are kept in memory per process. From
+them, /admin/query-stats reports query counts and SQL time per endpoint,
+and the slowest statements. An endpoint whose query count grows with the
+data (an N+1 loop) stands out there straight away.
+
+Statements are reported without their parameters, and each one is cut to
+STATEMENT_CHARS characters. Requests slower than SLOW_REQUEST_MS are also
+written to the slow-request log (slow_log.py).
+"""
+import time
+import threading
+from collections import deque
+
+from flask import g, request, current_app, has_app_context
+from sqlalchemy import event
+
+from slow_log import log_slow_request
+
+# Slowest statements kept per request
+SLOWEST_PER_REQUEST = 5
+STATEMENT_CHARS = 300
+# Statement timings kept per request, in execution order, for the slow-request log
+MAX_STATEMENTS = 200
+
+DEFAULT_WINDOW = 1000
+
+
+def short_statement(statement):
+    return ' '.join(statement.split())[:STATEMENT_CHARS]
+
+
+class RequestStats:
+    __slots__ = ('queries', 'sql_seconds', 'slowest', 'statements', 'started')
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_seconds = 0.0
+        self.slowest = []  # [(seconds, statement, parameters)], longest first
+        self.statements = []  # [(seconds, statement)] in execution order, up to MAX_STATEMENTS
+        self.started = time.perf_counter()
+
+    def record(self, seconds, statement, parameters=None):
+        self.queries += 1
+        self.sql_seconds += seconds
+        if len(self.statements) < MAX_STATEMENTS:
+            self.statements.append((seconds, statement))
+        if len(self.slowest) < SLOWEST_PER_REQUEST or seconds > self.slowest[-1][0]:
+            # Full statement and parameters, so the slow-request log can EXPLAIN it
+            self.slowest.append((seconds, statement, parameters))
+            self.slowest.sort(key=lambda item: item[0], reverse=True)
+            del self.slowest[SLOWEST_PER_REQUEST:]
+
+
+class QueryReport:
+    """Rolling window of finished requests (per process)"""
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        self._lock = threading.Lock()
+        self._requests = deque(maxlen=window)
+        self.since = time.time()
+
+    def resize(self, window):
+        with self._lock:
+            self._requests = deque(self._requests, maxlen=window)
+
+    def add(self, endpoint, method, stats, total_seconds):
+        with self._lock:
+            self._requests.append({
+                'endpoint': endpoint,
+                'method': method,
+                'queries': stats.queries,
+                'sql_ms': stats.sql_seconds * 1000,
+                'total_ms': total_seconds * 1000,
+                'slowest': [(seconds, short_statement(statement)) for seconds, statement, _ in stats.slowest],
+                'at': time.time(),
+            })
+
+    def reset(self):
+        with self._lock:
+            self._requests.clear()
+            self.since = time.time()
+
+    def summary(self, slowest=20):
+        with self._lock:
+            requests = list(self._requests)
+
+        endpoints = {}
+        for item in requests:
+            summary = endpoints.setdefault((item['method'], item['endpoint']), {
+                'endpoint': item['endpoint'], 'method': item['method'], 'requests': 0,
+                'queries_total': 0, 'queries_max': 0, 'sql_ms_total': 0.0, 'sql_ms_max': 0.0,
+                'total_ms_total': 0.0, 'total_ms_max': 0.0,
+            })
+            summary['requests'] += 1
+            summary['queries_total'] += item['queries']
+            summary['queries_max'] = max(summary['queries_max'], item['queries'])
+            summary['sql_ms_total'] += item['sql_ms']
+            summary['sql_ms_max'] = max(summary['sql_ms_max'], item['sql_ms'])
+            summary['total_ms_total'] += item['total_ms']
+            summary['total_ms_max'] = max(summary['total_ms_max'], item['total_ms'])
+
+        rows = []
+        for summary in endpoints.values():
+            count = summary['requests']
+            rows.append({
+                'endpoint': summary['endpoint'],
+                'method': summary['method'],
+                'requests': count,
+                'queries_avg': round(summary['queries_total'] / count, 1),
+                'queries_max': summary['queries_max'],
+                'sql_ms_avg': round(summary['sql_ms_total'] / count, 2),
+                'sql_ms_max': round(summary['sql_ms_max'], 2),
+                'total_ms_avg': round(summary['total_ms_total'] / count, 2),
+                'total_ms_max': round(summary['total_ms_max'], 2),
+            })
+        # Where the database time goes, biggest first
+        rows.sort(key=lambda row: row['sql_ms_avg'] * row['requests'], reverse=True)
+
+        statements = [
+            {'endpoint': item['endpoint'], 'ms': round(seconds * 1000, 2), 'statement': statement, 'at': item['at']}
+            for item in requests for seconds, statement in item['slowest']
+        ]
+        statements.sort(key=lambda row: row['ms'], reverse=True)
+        return {
+            'since': self.since,
+            'requests': len(requests),
+            'endpoints': rows,
+            'slowest_statements': statements[:slowest],
+        }
+
+
+query_report = QueryReport()
+
+
+def _current_stats():
+    if not has_app_context():
+        return None
+    return g.get('query_stats')
+
+
+def install_query_stats(app, engine):
+    """Count and time the statements of every request on engine"""
+    query_report.resize(app.config.get('QUERY_STATS_WINDOW', DEFAULT_WINDOW))
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def _start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_stats_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def _stop_timer(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info['query_stats_start'].pop()
+        stats = _current_stats()
+        if stats is not None:
+            # executemany: the first parameter set stands for the rest
+            stats.record(time.perf_counter() - started, statement,
+                         parameters[0] if executemany and parameters else parameters)
+
+    @event.listens_for(engine, 'handle_error')
+    def _drop_timer(context):
+        # after_cursor_execute doesn't run for a failed statement
+        if context.connection is not None and context.connection.info.get('query_stats_start'):
+            context.connection.info['query_stats_start'].pop()
+
+    @app.before_request
+    def _start_request_stats():
+        g.query_stats = RequestStats()
+
+    @app.after_request
+    def _report_request_stats(response):
+        stats = g.pop('query_stats', None)
+        if stats is None or request.endpoint == 'static':
+            return response
+        total = time.perf_counter() - stats.started
+        response.headers.add('Server-Timing',
+                             f'db;desc="{stats.queries} queries";dur={stats.sql_seconds * 1000:.1f}')
+        response.headers.add('Server-Timing', f'app;dur={total * 1000:.1f}')
+        query_report.add(request.endpoint or request.path, request.method, stats, total)
+        threshold = current_app.config.get('SLOW_REQUEST_MS', 0)
+        if threshold and total * 1000 >= threshold:
+            log_slow_request(stats, total, response.status_code)
+        return response
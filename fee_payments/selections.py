@@ -0,0 +1,79 @@
+"""
+Saved student selections.
+
+After an upload the student details page shows the students the sheet
+touched. Passing them as ?reg_numbers=...&reg_numbers=... made the URL grow
+with the sheet and turned into an IN (...) list with one bound variable per
+student, which breaks on large uploads (URL length, SQLite's variable limit).
+
+The upload instead saves the student ids under a short random token:
+
+    token = create_selection(student_ids)
+    redirect(url_for('main.student_details', selection=token))
+
+and student_details joins student_selection_member on its primary key
+(selection_id, student_id), so any number of students costs one indexed
+join. Selections live in the database rather than in a worker's memory,
+so the redirect can be served by any worker; they expire after
+SELECTION_TTL and are purged when new ones are created.
+"""
+import secrets
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from models import db, StudentSelection, StudentSelectionMember
+
+SELECTION_TTL = timedelta(days=7)
+
+
+def create_selection(student_ids):
+    """Save student_ids and return the token that refers to them (the caller commits)"""
+    purge_expired()
+    selection = StudentSelection(token=secrets.token_urlsafe(9))
+    db.session.add(selection)
+    db.session.flush()
+    rows = [{'selection_id': selection.id, 'student_id': student_id} for student_id in set(student_ids)]
+    if rows:
+        # executemany: one statement however many students there are
+        db.session.execute(insert(StudentSelectionMember), rows)
+    return selection.token
+
+
+def purge_expired():
+    """Delete selections older than SELECTION_TTL"""
+    cutoff = datetime.utcnow() - SELECTION_TTL
+    expired = db.session.query(StudentSelection).filter(StudentSelection.created_at < cutoff)
+    # Members first, so this doesn't depend on foreign key cascades being enabled
+    db.session.query(StudentSelectionMember).filter(
+        StudentSelectionMember.selection_id.in_(expired.with_entities(StudentSelection.id).scalar_subquery())
+    ).delete(synchronize_session=False)
+    expired.delete(synchronize_session=False)
+
+
+def _live_selection(token):
+    """Query for the id of the selection saved under token, unless it has expired
+
+    Expired selections are only purged when a new one is created, so their
+    rows can still be there; they are treated as if they were gone.
+    """
+    return db.session.query(StudentSelection.id).filter(
+        StudentSelection.token == token,
+        StudentSelection.created_at >= datetime.utcnow() - SELECTION_TTL
+    )
+
+
+def selection_exists(token):
+    return _live_selection(token).first() is not None
+
+
+def join_selection(query, student_id_column, token):
+    """Restrict query to the students saved under token, through one indexed join"""
+    selection_id = _live_selection(token).scalar_subquery()
+    return query.join(
+        StudentSelectionMember,
+        db.and_(
+            StudentSelectionMember.selection_id == selection_id,
+            StudentSelectionMember.student_id == student_id_column
+        )
+    )
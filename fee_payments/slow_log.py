@@ -0,0 +1,145 @@
+"""
+Slow-request log.
+
+A request that takes SLOW_REQUEST_MS or longer writes one JSON line to
+SLOW_LOG_PATH (default instance/slow_requests.jsonl). The file rotates at
+SLOW_LOG_MAX_BYTES and SLOW_LOG_BACKUPS old files are kept:
+
+    {"at": "2026-03-02T10:15:04", "method": "GET", "route": "main.dashboard",
+     "path": "/dashboard", "args": {"start_date": ["2026-01-01"]}, "status": 200,
+     "total_ms": 2210.4, "sql_ms": 180.2, "queries": 14,
+     "statements": [{"ms": 2.1, "sql": "SELECT ..."}, ...],
+     "explain": [{"ms": 95.0, "sql": "SELECT ...", "plan": ["SCAN payment", ...]}, ...]}
+
+statements lists every statement the request ran (up to
+query_stats.MAX_STATEMENTS) in execution order, so an N+1 loop shows up as
+a run of near-identical lines. The EXPLAIN_SLOWEST slowest statements are
+run again under EXPLAIN QUERY PLAN with their parameters, on a connection
+of their own after the response is ready; "SCAN" on a large table is the
+usual culprit. The timings come from query_stats.py, so QUERY_STATS must be
+on. The file is written from a background thread (structured_log.queued()),
+and /admin/slow-requests shows the newest records.
+"""
+import os
+import json
+import logging
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import request, current_app
+
+from models import db
+from structured_log import queued
+
+EXPLAIN_SLOWEST = 3
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+DEFAULT_BACKUPS = 5
+
+# Only these can be explained; EXPLAIN of anything else is an error or meaningless
+EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+# How much of the end of a log tail_records() reads
+TAIL_BYTES = 1024 * 1024
+
+slow_logger = logging.getLogger('fee_payments.slow_requests')
+slow_logger.setLevel(logging.INFO)
+slow_logger.propagate = False
+
+
+def slow_log_path():
+    return current_app.config.get('SLOW_LOG_PATH') or os.path.join(current_app.instance_path, 'slow_requests.jsonl')
+
+
+def install_slow_log(app):
+    """Attach the rotating file handler (once per process)"""
+    path = os.path.abspath(app.config.get('SLOW_LOG_PATH') or os.path.join(app.instance_path, 'slow_requests.jsonl'))
+    if any(getattr(target, 'baseFilename', None) == path
+           for handler in slow_logger.handlers for target in getattr(handler, 'targets', [handler])):
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=app.config.get('SLOW_LOG_MAX_BYTES', DEFAULT_MAX_BYTES),
+                                  backupCount=app.config.get('SLOW_LOG_BACKUPS', DEFAULT_BACKUPS),
+                                  encoding='utf-8', delay=True)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_logger.addHandler(queued(handler))
+
+
+def explain(statement, parameters):
+    """EXPLAIN QUERY PLAN rows of a statement as strings, indented by depth"""
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    if not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    with db.engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters or ()).fetchall()
+    # (id, parent, notused, detail); children follow their parent
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append('  ' * depth[node_id] + detail)
+    return plan
+
+
+def log_slow_request(stats, total_seconds, status):
+    """Write the record of a slow request (query_stats.py calls this from after_request)"""
+    from query_stats import short_statement
+
+    explained = []
+    for seconds, statement, parameters in stats.slowest[:EXPLAIN_SLOWEST]:
+        try:
+            plan = explain(statement, parameters)
+        except Exception as e:
+            # e.g. a statement on an ATTACHed archive file, which this connection doesn't have
+            plan = [f"EXPLAIN failed: {str(e)}"]
+        explained.append({'ms': round(seconds * 1000, 2), 'sql': short_statement(statement), 'plan': plan})
+
+    record = {
+        'at': datetime.now().isoformat(timespec='seconds'),
+        'method': request.method,
+        'route': request.endpoint,
+        'path': request.path,
+        'args': request.args.to_dict(flat=False),
+        'view_args': request.view_args or {},
+        'status': status,
+        'total_ms': round(total_seconds * 1000, 1),
+        'sql_ms': round(stats.sql_seconds * 1000, 1),
+        'queries': stats.queries,
+        'statements': [{'ms': round(seconds * 1000, 2), 'sql': short_statement(statement)}
+                       for seconds, statement in stats.statements],
+        'explain': explained,
+    }
+    if stats.queries > len(stats.statements):
+        record['statements_not_listed'] = stats.queries - len(stats.statements)
+    try:
+        slow_logger.info(json.dumps(record, default=str))
+    except Exception as e:
+        current_app.logger.error("Error writing slow request log: %s", e)
+
+
+def recent_slow_requests(limit=50):
+    """The newest records of the current log file, newest first"""
+    return tail_records(slow_log_path(), limit)
+
+
+def tail_records(path, limit):
+    """The newest JSON-line records at the end of a log file, newest first"""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - TAIL_BYTES, 0))
+        lines = f.read().decode('utf-8', errors='replace').splitlines()
+    if size > TAIL_BYTES:
+        # Probably starts mid-record
+        lines = lines[1:]
+    records = []
+    for line in reversed(lines):
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            continue
+        if len(records) >= limit:
+            break
+    return records
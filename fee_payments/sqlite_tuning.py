@@ -0,0 +1,46 @@
+"""
+SQLite connection tuning.
+
+The PRAGMAs below are applied to every new connection through a SQLAlchemy
+"connect" event. WAL lets readers keep working while an upload is being
+committed, and busy_timeout makes concurrent writers wait for the lock
+instead of failing straight away with "database is locked".
+
+The profile is configurable through app.config['SQLITE_PRAGMAS']; set it to
+an empty dict to fall back to SQLite's defaults.
+"""
+from sqlalchemy import event
+
+DEFAULT_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',    # Safe with WAL; only the last commits can be lost on power failure
+    'busy_timeout': 5000,       # Milliseconds to wait for a lock
+    'mmap_size': 268435456,     # 256 MB of the database file memory-mapped
+    'cache_size': -65536,       # Negative means KiB, so 64 MB of page cache per connection
+    'temp_store': 'MEMORY',
+    'foreign_keys': 'ON',
+}
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """Run PRAGMA statements on a raw sqlite3 connection"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            # PRAGMA does not accept bound parameters
+            cursor.execute(f"PRAGMA {name} = {value}")
+    finally:
+        cursor.close()
+
+
+def install_sqlite_profile(engine, pragmas=None):
+    """Apply the PRAGMA profile to every connection the engine opens"""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = DEFAULT_SQLITE_PRAGMAS if pragmas is None else pragmas
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        apply_pragmas(dbapi_connection, pragmas)
@@ -3,12 +3,18 @@ import sqlite3
 import pandas as pd
 from datetime import datetime
 
+from migrations import run_migrations
+from money import to_paise
+from sqlite_tuning import apply_pragmas, DEFAULT_SQLITE_PRAGMAS
+from fee_types import load_alias_map, resolve_fee_type_id
+from dimensions import resolve_dimension_id
+
 def connect_db():
     """Create a connection to the SQLite database"""
     db_path = os.path.join(os.path.dirname(__file__), 'fee_payments.db')
     conn = sqlite3.connect(db_path)
-    # Enable foreign keys support
-    conn.execute("PRAGMA foreign_keys = ON")
+    # Same WAL/busy_timeout profile as the web app (also enables foreign keys)
+    apply_pragmas(conn, DEFAULT_SQLITE_PRAGMAS)
     return conn
 
 def setup_db():
@@ -24,7 +30,8 @@ def setup_db():
         name TEXT NOT NULL,
         batch_year TEXT NOT NULL,
         branch TEXT NOT NULL,
-        mobile TEXT
+        mobile TEXT,
+        updated_at DATETIME
     )
     ''')
     
@@ -32,23 +39,28 @@ def setup_db():
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS payment (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        regd_no TEXT NOT NULL,
+        student_id INTEGER NOT NULL,
         fee_type TEXT NOT NULL,
         batch TEXT,
-        amount REAL NOT NULL,
-        amount_paid REAL NOT NULL,
+        amount_paise INTEGER NOT NULL,
+        amount_paid_paise INTEGER NOT NULL,
         payment_date DATE NOT NULL,
         received_by TEXT NOT NULL,
         remarks TEXT,
-        FOREIGN KEY (regd_no) REFERENCES student (regd_no)
+        updated_at DATETIME,
+        FOREIGN KEY (student_id) REFERENCES student (id)
     )
     ''')
     
     conn.commit()
+    
+    # Add updated_at columns, the change_log triggers, the fee_type registry and the
+    # batch/branch dimensions if missing (migration 7 then drops batch_year and branch)
+    run_migrations(conn)
     conn.close()
 
 def upsert_student(conn, student_data):
-    """Insert or update student record"""
+    """Insert or update student record and return its id"""
     cursor = conn.cursor()
     
     # Check if student exists
@@ -59,29 +71,32 @@ def upsert_student(conn, student_data):
         # Update existing student
         cursor.execute('''
         UPDATE student 
-        SET name = ?, batch_year = ?, branch = ?, mobile = ?
+        SET name = ?, batch_id = ?, branch_id = ?, mobile = ?, updated_at = ?
         WHERE regd_no = ?
         ''', (
             student_data['name'], 
-            student_data['batch_year'], 
-            student_data['branch'], 
+            student_data['batch_id'], 
+            student_data['branch_id'], 
             student_data['mobile'], 
+            datetime.utcnow(),
             student_data['regd_no']
         ))
+        return exists[0]
     else:
         # Insert new student
         cursor.execute('''
-        INSERT INTO student (regd_no, name, batch_year, branch, mobile)
-        VALUES (?, ?, ?, ?, ?)
+        INSERT INTO student (regd_no, name, batch_id, branch_id, mobile, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
         ''', (
             student_data['regd_no'],
             student_data['name'],
-            student_data['batch_year'],
-            student_data['branch'],
-            student_data['mobile']
+            student_data['batch_id'],
+            student_data['branch_id'],
+            student_data['mobile'],
+            datetime.utcnow()
         ))
     
-    return cursor.rowcount  # Return number of affected rows
+    return cursor.lastrowid
 
 def insert_payment(conn, payment_data):
     """Insert payment record"""
@@ -89,17 +104,19 @@ def insert_payment(conn, payment_data):
     
     # Insert payment record
     cursor.execute('''
-    INSERT INTO payment (regd_no, fee_type, batch, amount, amount_paid, payment_date, received_by, remarks)
-    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    INSERT INTO payment (student_id, fee_type, fee_type_id, batch, amount_paise, amount_paid_paise, payment_date, received_by, remarks, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     ''', (
-        payment_data['regd_no'],
+        payment_data['student_id'],
         payment_data['fee_type'],
+        payment_data['fee_type_id'],
         payment_data.get('batch', ''),
-        payment_data['amount'],
-        payment_data['amount_paid'],
+        payment_data['amount_paise'],
+        payment_data['amount_paid_paise'],
         payment_data['payment_date'],
         payment_data['received_by'],
-        payment_data.get('remarks', '')
+        payment_data.get('remarks', ''),
+        datetime.utcnow()
     ))
     
     return cursor.rowcount
@@ -154,6 +171,11 @@ def process_excel_file(file_path):
         
         records_processed = 0
         errors = []
+        # Fee type spellings resolve to registry ids with a dictionary lookup
+        alias_map = load_alias_map(conn)
+        # Batch and branch name -> dimension id, filled as names are seen
+        batch_ids = {}
+        branch_ids = {}
         
         # Process each row
         for idx, row in df.iterrows():
@@ -169,22 +191,22 @@ def process_excel_file(file_path):
                 student_data = {
                     'regd_no': regd_no,
                     'name': name,
-                    'batch_year': batch_year,
-                    'branch': branch,
+                    'batch_id': resolve_dimension_id(conn, 'batch', batch_year, batch_ids),
+                    'branch_id': resolve_dimension_id(conn, 'branch', branch, branch_ids),
                     'mobile': mobile
                 }
-                upsert_student(conn, student_data)
+                student_id = upsert_student(conn, student_data)
                 
                 # 2. Process payment data
                 fee_type = str(row['fee_type']).strip().lower()
                 batch = str(row.get('batch', '')).strip()
                 
-                # Convert amounts to float
+                # Convert amounts to integer paise
                 try:
-                    amount = float(row['amount'])
-                    amount_paid = float(row.get('paid_amount', 0)) if pd.notna(row.get('paid_amount')) else 0
+                    amount_paise = to_paise(row['amount'])
+                    amount_paid_paise = to_paise(row.get('paid_amount')) if pd.notna(row.get('paid_amount')) else 0
                     
-                    if amount <= 0:
+                    if amount_paise <= 0:
                         raise ValueError("Fee amount must be positive")
                 except (ValueError, TypeError) as e:
                     raise ValueError(f"Invalid amount values: {str(e)}")
@@ -203,11 +225,12 @@ def process_excel_file(file_path):
                 
                 # Insert payment record
                 payment_data = {
-                    'regd_no': regd_no,
+                    'student_id': student_id,
                     'fee_type': fee_type,
+                    'fee_type_id': resolve_fee_type_id(conn, alias_map, fee_type),
                     'batch': batch,
-                    'amount': amount,
-                    'amount_paid': amount_paid,
+                    'amount_paise': amount_paise,
+                    'amount_paid_paise': amount_paid_paise,
                     'payment_date': payment_date,
                     'received_by': received_by,
                     'remarks': remarks
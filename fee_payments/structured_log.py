@@ -0,0 +1,223 @@
+"""
+Structured, non-blocking logging.
+
+install_logging(app) sends every log record - the app's, the subsystem
+loggers' (fee_payments.<subsystem>) and the libraries' - through a
+QueueHandler on the root logger. The request thread only fills in the
+message and the request it belongs to; a QueueListener thread formats the
+record and writes it. With LOG_FORMAT "json" (the default) each record is
+one line:
+
+    {"ts": "2026-03-02T10:15:04.123", "level": "WARNING", "logger": "fee_payments.upload",
+     "msg": "Warning on row 14: Fee type is required", "where": "app.py:958",
+     "request": {"method": "POST", "path": "/upload", "endpoint": "main.upload"},
+     "sample": {"key": "upload.row", "seen": 14}}
+
+Fields passed with extra= are logged as fields of their own. Log with
+%-style arguments, logger.debug("Added %s", regd_no), rather than
+f-strings: the message is only built when the level is enabled.
+
+Levels: LOG_LEVEL for the app and its subsystems, and LOG_LEVELS for
+single loggers, e.g. "fee_payments.upload=DEBUG,sqlalchemy.engine=INFO".
+
+Per-row messages carry extra={'sample_key': ...}. Of each sample key, the
+first LOG_SAMPLE_FIRST records of a request are logged and after that one
+in LOG_SAMPLE_EVERY; at the end of the request one record says how many
+were left out.
+
+Other file logs (slow_log.py, memory_profile.py) wrap their handlers with
+queued() so their writes leave the request thread too. The listener
+threads are restarted in forked gunicorn workers, and drained at exit.
+"""
+import os
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+
+ROOT = 'fee_payments'
+DEFAULT_SAMPLE_FIRST = 20
+DEFAULT_SAMPLE_EVERY = 100
+TEXT_FORMAT = '[%(asctime)s] %(levelname)s in %(module)s: %(message)s'
+
+# Attributes every LogRecord has; anything else on a record came from extra= and becomes a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'request', 'sample_key', 'sample',
+}
+
+# (queue handler, listener) of every queued() handler in this process
+_pipes = []
+
+log = logging.getLogger(f"{ROOT}.logging")
+
+
+def subsystem_logger(name):
+    """Logger of one part of the app, e.g. subsystem_logger('upload'); levels can be set per subsystem"""
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'where': f"{record.filename}:{record.lineno}",
+        }
+        if getattr(record, 'request', None):
+            entry['request'] = record.request
+        if getattr(record, 'sample', None):
+            entry['sample'] = record.sample
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RequestQueueHandler(QueueHandler):
+    """Puts records on a queue for a listener thread; only the message and request fields are built here"""
+
+    @property
+    def targets(self):
+        """The handlers that write this handler's records"""
+        for pipe_handler, listener in _pipes:
+            if pipe_handler is self:
+                return listener.handlers
+        return ()
+
+    def prepare(self, record):
+        # A copy, as other handlers may see the record too. The arguments are merged
+        # into the message here because they can be objects only this thread may
+        # touch (ORM rows); the exception is formatted by the listener.
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if has_request_context() and getattr(record, 'request', None) is None:
+            record.request = {'method': request.method, 'path': request.path, 'endpoint': request.endpoint}
+        return record
+
+
+class SamplingFilter(logging.Filter):
+    """Of the records with a sample_key, lets through the first `first` per request, then one in `every`"""
+
+    def __init__(self, first=DEFAULT_SAMPLE_FIRST, every=DEFAULT_SAMPLE_EVERY):
+        super().__init__()
+        self.first = first
+        self.every = max(every, 1)
+        # Outside requests (CLI commands) the counts are per process
+        self._counts = {}
+
+    def logged(self, seen):
+        """How many of `seen` records of one key were let through"""
+        return min(seen, self.first) + max(seen // self.every - self.first // self.every, 0)
+
+    def filter(self, record):
+        key = getattr(record, 'sample_key', None)
+        if key is None:
+            return True
+        counts = g.setdefault('log_samples', {}) if has_request_context() else self._counts
+        seen = counts[key] = counts.get(key, 0) + 1
+        if seen <= self.first or seen % self.every == 0:
+            record.sample = {'key': key, 'seen': seen}
+            return True
+        return False
+
+
+def queued(*handlers):
+    """A handler that hands records to a listener thread, which passes them to handlers"""
+    pipe = queue.SimpleQueue()
+    queue_handler = RequestQueueHandler(pipe)
+    listener = QueueListener(pipe, *handlers, respect_handler_level=True)
+    listener.start()
+    _pipes.append((queue_handler, listener))
+    return queue_handler
+
+
+def stop():
+    """Write out everything still queued and stop the listener threads"""
+    for _, listener in _pipes:
+        if listener._thread is not None:
+            listener.stop()
+
+
+def _restart_after_fork():
+    # The listener threads don't survive fork(), and their queues may have been locked by them
+    for position, (queue_handler, listener) in enumerate(_pipes):
+        pipe = queue.SimpleQueue()
+        queue_handler.queue = pipe
+        restarted = QueueListener(pipe, *listener.handlers, respect_handler_level=True)
+        restarted.start()
+        _pipes[position] = (queue_handler, restarted)
+
+
+atexit.register(stop)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def parse_levels(text):
+    """{'fee_payments.upload': 'DEBUG', ...} from "fee_payments.upload=DEBUG,werkzeug=WARNING" """
+    levels = {}
+    for part in (text or '').split(','):
+        name, _, level = part.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def install_logging(app):
+    """Route all logging through the queue (once per process) and apply the configured levels"""
+    level = app.config.get('LOG_LEVEL', 'INFO').upper()
+    app.logger.setLevel(level)
+    logging.getLogger(ROOT).setLevel(level)
+    for name, name_level in parse_levels(app.config.get('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(name_level)
+
+    # The root handler writes for everyone, so Flask's own stderr handler would print twice
+    app.logger.removeHandler(default_handler)
+    root = logging.getLogger()
+    queue_handler = next((handler for handler in root.handlers if isinstance(handler, RequestQueueHandler)), None)
+    if queue_handler is None:
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT) if app.config.get('LOG_FORMAT') == 'text'
+                            else JsonFormatter())
+        handlers = [stream]
+        if app.config.get('LOG_FILE'):
+            os.makedirs(os.path.dirname(os.path.abspath(app.config['LOG_FILE'])), exist_ok=True)
+            log_file = RotatingFileHandler(app.config['LOG_FILE'], maxBytes=app.config.get('LOG_FILE_MAX_BYTES', 0),
+                                           backupCount=app.config.get('LOG_FILE_BACKUPS', 0), encoding='utf-8',
+                                           delay=True)
+            log_file.setFormatter(JsonFormatter())
+            handlers.append(log_file)
+        queue_handler = queued(*handlers)
+        queue_handler.addFilter(SamplingFilter(app.config.get('LOG_SAMPLE_FIRST', DEFAULT_SAMPLE_FIRST),
+                                               app.config.get('LOG_SAMPLE_EVERY', DEFAULT_SAMPLE_EVERY)))
+        root.addHandler(queue_handler)
+        if root.level == logging.NOTSET or root.level > logging.WARNING:
+            # Libraries' warnings; the app's own loggers have their levels set above
+            root.setLevel(logging.WARNING)
+    sampling = next(f for f in queue_handler.filters if isinstance(f, SamplingFilter))
+
+    @app.teardown_request
+    def _log_sampled(exc):
+        samples = g.pop('log_samples', None)
+        for key, seen in (samples or {}).items():
+            logged = sampling.logged(seen)
+            if logged < seen:
+                log.info("%d '%s' messages, %d logged (sampled)", seen, key, logged)
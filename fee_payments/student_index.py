@@ -0,0 +1,275 @@
+"""
+In-memory registration number index.
+
+Most autocomplete queries are a registration number being typed in
+("21PA1A05..."), and the payments page asks for every registration number of
+a batch. Both are answered from memory:
+
+- a sorted list of lower-cased regd_no keys, searched with bisect, for
+  prefix lookups (registration numbers are matched case-insensitively)
+- per batch year, a list of students sorted by name
+
+Each process builds the index on first use, or at startup through
+warm_up() / gunicorn's on_starting (forked workers then share the pages).
+It is kept current from change_log (see migrations.py) instead of being
+rebuilt: a refresh reads the student ids changed since the last applied
+seq and reloads only those rows. A commit in this process that touches a
+Student makes the next lookup refresh at once; writes from other processes
+show up within STUDENT_INDEX_MAX_AGE seconds.
+"""
+import sys
+import time
+import threading
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from flask import current_app
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+
+from models import db, Student, Batch
+from metrics import cache_lookup
+
+DEFAULT_MAX_AGE = 5
+
+# Above this many changed students a refresh reloads everything instead
+REBUILD_THRESHOLD = 5000
+
+# Ids per "WHERE id IN (...)" when reloading changed students
+ID_CHUNK = 500
+
+StudentEntry = namedtuple('StudentEntry', ['id', 'regd_no', 'name', 'batch_year'])
+
+
+def entry_of(row):
+    """StudentEntry for an (id, regd_no, name, batch_year) row"""
+    student_id, regd_no, name, batch_year = row
+    # A handful of batch years are repeated on every student
+    return StudentEntry(student_id, regd_no, name, sys.intern(batch_year or ''))
+
+
+def _key(entry):
+    lowered = entry.regd_no.lower()
+    # Share the string when the number is already stored lower case
+    return (entry.regd_no if lowered == entry.regd_no else lowered), entry.id
+
+STUDENT_COLUMNS = (Student.id, Student.regd_no, Student.name, Batch.name)
+
+
+def _student_rows():
+    """(id, regd_no, name, batch year) rows, the batch name joined from its dimension table"""
+    return db.session.query(*STUDENT_COLUMNS).join(Batch, Batch.id == Student.batch_id)
+
+MAX_SEQ_SQL = text("SELECT IFNULL(MAX(seq), 0) FROM change_log")
+
+CHANGED_STUDENTS_SQL = text(
+    "SELECT DISTINCT row_id FROM change_log WHERE table_name = 'student' AND seq > :after AND seq <= :upto"
+)
+
+
+class RegdNoIndex:
+    """Sorted regd_no keys and per-batch name lists; not thread-safe on its own"""
+
+    def __init__(self, entries=()):
+        self.by_id = {entry.id: entry for entry in entries}
+        self.keys = sorted(_key(entry) for entry in self.by_id.values())
+        self.batches = {}
+        for entry in self.by_id.values():
+            self.batches.setdefault(entry.batch_year, []).append((entry.name, entry.regd_no, entry.id))
+        for students in self.batches.values():
+            students.sort()
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def put(self, entry):
+        self.remove(entry.id)
+        self.by_id[entry.id] = entry
+        insort(self.keys, _key(entry))
+        insort(self.batches.setdefault(entry.batch_year, []), (entry.name, entry.regd_no, entry.id))
+
+    def remove(self, student_id):
+        entry = self.by_id.pop(student_id, None)
+        if entry is None:
+            return
+        del self.keys[bisect_left(self.keys, _key(entry))]
+        students = self.batches[entry.batch_year]
+        del students[bisect_left(students, (entry.name, entry.regd_no, entry.id))]
+        if not students:
+            del self.batches[entry.batch_year]
+
+    def prefix(self, query, limit):
+        """Entries whose regd_no starts with query (any case), in regd_no order"""
+        query = query.lower()
+        matches = []
+        position = bisect_left(self.keys, (query,))
+        while position < len(self.keys) and len(matches) < limit:
+            key, student_id = self.keys[position]
+            if not key.startswith(query):
+                break
+            matches.append(self.by_id[student_id])
+            position += 1
+        return matches
+
+    def batch(self, batch_year):
+        """Entries of one batch year, ordered by name"""
+        return [self.by_id[student_id] for _, _, student_id in self.batches.get(batch_year, [])]
+
+    def memory_bytes(self):
+        """Approximate size of the index (containers, tuples and the strings they hold)"""
+        size = sys.getsizeof(self.by_id) + sys.getsizeof(self.keys) + sys.getsizeof(self.batches)
+        for entry in self.by_id.values():
+            # batch_year is interned and counted once below
+            size += sys.getsizeof(entry) + sum(sys.getsizeof(value) for value in entry[:3])
+        for key, student_id in self.keys:
+            size += sys.getsizeof((key, student_id))
+            if key is not self.by_id[student_id].regd_no:
+                size += sys.getsizeof(key)
+        for batch_year, students in self.batches.items():
+            size += sys.getsizeof(batch_year) + sys.getsizeof(students) + len(students) * sys.getsizeof((0, 0, 0))
+        return size
+
+
+class StudentIndex:
+    """Per-process RegdNoIndex kept in step with the student table"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = None
+        self._seq = 0
+        self._checked_at = 0.0
+        self._stale = False
+        self.builds = 0
+        self.incremental_updates = 0
+        self.build_ms = 0.0
+        self.built_at = None
+        # (builds, incremental_updates) the memory estimate was made at, and the estimate
+        self._memory = (None, 0)
+
+    def mark_stale(self):
+        self._stale = True
+
+    def build(self):
+        """Load every student (call inside an application context)"""
+        start = time.perf_counter()
+        # Read the seq first: changes committed while loading are replayed on the next refresh
+        seq = db.session.execute(MAX_SEQ_SQL).scalar()
+        index = RegdNoIndex(entry_of(row) for row in _student_rows())
+        with self._lock:
+            self._index = index
+            self._seq = seq
+            self._checked_at = time.monotonic()
+            self._stale = False
+            self.builds += 1
+            self.build_ms = (time.perf_counter() - start) * 1000
+            self.built_at = time.time()
+        current_app.logger.info("Built student index: %d students in %.0f ms", len(index), self.build_ms)
+
+    def _refresh(self):
+        max_age = current_app.config.get('STUDENT_INDEX_MAX_AGE', DEFAULT_MAX_AGE)
+        if self._index is None:
+            self.build()
+            return
+        if not self._stale and time.monotonic() - self._checked_at < max_age:
+            return
+
+        seq = db.session.execute(MAX_SEQ_SQL).scalar()
+        if seq < self._seq:
+            # change_log was recreated; nothing to replay from
+            self.build()
+            return
+        if seq == self._seq:
+            self._checked_at = time.monotonic()
+            self._stale = False
+            return
+
+        changed = [row[0] for row in db.session.execute(CHANGED_STUDENTS_SQL, {'after': self._seq, 'upto': seq})]
+        if len(changed) > REBUILD_THRESHOLD:
+            self.build()
+            return
+
+        rows = {}
+        for i in range(0, len(changed), ID_CHUNK):
+            chunk = changed[i:i + ID_CHUNK]
+            for row in _student_rows().filter(Student.id.in_(chunk)):
+                rows[row[0]] = entry_of(row)
+        with self._lock:
+            for student_id in changed:
+                if student_id in rows:
+                    self._index.put(rows[student_id])
+                else:
+                    self._index.remove(student_id)
+            self._seq = seq
+            self._checked_at = time.monotonic()
+            self._stale = False
+            self.incremental_updates += 1
+
+    def _current(self):
+        version = (self.builds, self.incremental_updates)
+        try:
+            self._refresh()
+            cache_lookup('student_index', version == (self.builds, self.incremental_updates))
+        except Exception as e:
+            current_app.logger.error("Error refreshing student index: %s", e)
+            if self._index is None:
+                raise
+        return self._index
+
+    def prefix(self, query, limit=10):
+        """Students whose registration number starts with query, in regd_no order"""
+        index = self._current()
+        with self._lock:
+            return index.prefix(query, limit)
+
+    def batch(self, batch_year):
+        """Students of a batch year, ordered by name"""
+        index = self._current()
+        with self._lock:
+            return index.batch(batch_year)
+
+    def size(self):
+        index = self._index
+        return len(index) if index is not None else 0
+
+    def memory_bytes(self):
+        """RegdNoIndex.memory_bytes(), recomputed only after the index has changed"""
+        with self._lock:
+            version = (self.builds, self.incremental_updates)
+            if self._memory[0] != version:
+                self._memory = (version, self._index.memory_bytes() if self._index is not None else 0)
+            return self._memory[1]
+
+    def stats(self):
+        memory_bytes = self.memory_bytes()
+        with self._lock:
+            index = self._index
+            return {
+                'students': len(index) if index is not None else 0,
+                'batches': len(index.batches) if index is not None else 0,
+                'memory_bytes': memory_bytes,
+                'seq': self._seq,
+                'builds': self.builds,
+                'incremental_updates': self.incremental_updates,
+                'build_ms': round(self.build_ms, 1),
+                'built_at': self.built_at,
+            }
+
+
+student_index = StudentIndex()
+
+
+@event.listens_for(Session, 'after_flush')
+def _note_student_writes(session, flush_context):
+    if any(isinstance(obj, Student) for obj in (*session.new, *session.dirty, *session.deleted)):
+        session.info['student_index_changed'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _refresh_after_commit(session):
+    if session.info.pop('student_index_changed', False):
+        student_index.mark_stale()
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_after_rollback(session, previous_transaction):
+    session.info.pop('student_index_changed', None)
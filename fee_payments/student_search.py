@@ -0,0 +1,188 @@
+"""
+Student search for the registration number / name autocomplete.
+
+/api/students is called on every key press from the payments and student
+details pages. A plain `regd_no LIKE '%q%' OR name LIKE '%q%'` can't use an
+index, so each key press scanned the whole student table.
+
+student_search is an FTS5 virtual table with the trigram tokenizer over
+student.regd_no and student.name. It is an external-content table: it
+stores only the index and reads the text from student, and triggers on
+student keep it current for every writer (the app, sqlite_uploader.py and
+migrations). A trigram index answers substring queries of three or more
+characters without a scan.
+
+Results are ranked: registration numbers starting with the query (answered
+from the in-memory index in student_index.py), then names starting with it,
+then names with a word starting with it, then any other substring match.
+
+SQLite builds without FTS5 or the trigram tokenizer (before 3.34) fall back
+to the LIKE scan.
+"""
+from flask import current_app
+from sqlalchemy import text
+
+SEARCH_TABLE = 'student_search'
+
+# Ranked candidates are sorted in SQL; this caps the rows a very common
+# substring ("kumar", "21B0") can drag into that sort
+MAX_CANDIDATES = 2000
+
+SEARCH_SQL = text(f'''
+    SELECT s.regd_no, s.name, b.name AS batch_year
+    FROM (
+        SELECT rowid FROM {SEARCH_TABLE}
+        WHERE {SEARCH_TABLE} MATCH :match
+        ORDER BY rowid
+        LIMIT :candidates
+    ) hit
+    JOIN student s ON s.id = hit.rowid
+    JOIN batch b ON b.id = s.batch_id
+    ORDER BY CASE
+        WHEN s.regd_no LIKE :prefix ESCAPE '\\' THEN 0
+        WHEN s.name LIKE :prefix ESCAPE '\\' THEN 1
+        WHEN s.name LIKE :word_prefix ESCAPE '\\' THEN 2
+        ELSE 3
+    END, s.regd_no
+    LIMIT :limit
+''')
+
+
+def student_search_ddl():
+    """DDL for the student_search table and the triggers that keep it current"""
+    return [
+        f'''
+        CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+            regd_no, name, content='student', content_rowid='id', tokenize='trigram'
+        )
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_student_insert_search AFTER INSERT ON student
+        BEGIN
+            INSERT INTO {SEARCH_TABLE} (rowid, regd_no, name) VALUES (NEW.id, NEW.regd_no, NEW.name);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_student_delete_search AFTER DELETE ON student
+        BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, regd_no, name)
+            VALUES ('delete', OLD.id, OLD.regd_no, OLD.name);
+        END
+        ''',
+        f'''
+        CREATE TRIGGER IF NOT EXISTS trg_student_update_search AFTER UPDATE OF regd_no, name ON student
+        BEGIN
+            INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rowid, regd_no, name)
+            VALUES ('delete', OLD.id, OLD.regd_no, OLD.name);
+            INSERT INTO {SEARCH_TABLE} (rowid, regd_no, name) VALUES (NEW.id, NEW.regd_no, NEW.name);
+        END
+        ''',
+    ]
+
+
+def trigram_available(conn):
+    """Whether this SQLite build has FTS5 with the trigram tokenizer"""
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.trigram_probe USING fts5(x, tokenize='trigram')")
+        conn.execute("DROP TABLE temp.trigram_probe")
+        return True
+    except Exception:
+        return False
+
+
+def install_student_search(conn):
+    """Create student_search and its triggers if missing; False if SQLite can't"""
+    if not trigram_available(conn):
+        print("SQLite has no FTS5 trigram tokenizer; student search will scan the table")
+        return False
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (SEARCH_TABLE,)
+    ).fetchone()
+    for statement in student_search_ddl():
+        conn.execute(statement)
+    if not exists:
+        # Index the students that are already there
+        conn.execute(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('rebuild')")
+    return True
+
+
+def _like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _fts_phrase(value):
+    # One quoted phrase, so the query is matched as a substring and
+    # FTS5 operators (AND, OR, *, ^, :) in it are taken literally
+    return '"' + value.replace('"', '""') + '"'
+
+
+class StudentSearch:
+    """Autocomplete queries; checks once per process whether student_search exists"""
+
+    def __init__(self):
+        self._indexed = None
+
+    def _has_index(self):
+        from models import db
+
+        if self._indexed is None:
+            self._indexed = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': SEARCH_TABLE}
+            ).first() is not None
+        return self._indexed
+
+    def search(self, query, limit=10):
+        """Students matching query, best matches first (objects with regd_no, name, batch_year)"""
+        from models import db
+        from student_index import student_index
+
+        query = query.strip()
+        if len(query) < 3:
+            return []
+
+        # Most lookups are a registration number being typed in; the
+        # in-memory index answers those without touching SQLite
+        try:
+            rows = student_index.prefix(query, limit)
+        except Exception as e:
+            current_app.logger.error("Student index unavailable: %s", e)
+            rows = []
+        if len(rows) == limit:
+            return rows
+        seen = {row.regd_no for row in rows}
+
+        if self._has_index():
+            try:
+                escaped = _like_escape(query)
+                ranked = db.session.execute(SEARCH_SQL, {
+                    'match': _fts_phrase(query),
+                    'candidates': MAX_CANDIDATES,
+                    'prefix': escaped + '%',
+                    'word_prefix': '% ' + escaped + '%',
+                    'limit': limit,
+                }).all()
+                rows.extend(row for row in ranked if row.regd_no not in seen)
+                return rows[:limit]
+            except Exception as e:
+                current_app.logger.error("Student search index failed, falling back to LIKE: %s", e)
+                db.session.rollback()
+
+        from models import Student, Batch
+
+        escaped = _like_escape(query)
+        scanned = db.session.query(
+            Student.regd_no, Student.name, Batch.name.label('batch_year')
+        ).join(
+            Batch, Batch.id == Student.batch_id
+        ).filter(
+            db.or_(
+                Student.regd_no.like(f'%{escaped}%', escape='\\'),
+                Student.name.like(f'%{escaped}%', escape='\\')
+            )
+        ).limit(limit).all()
+        rows.extend(row for row in scanned if row.regd_no not in seen)
+        return rows[:limit]
+
+
+student_search = StudentSearch()
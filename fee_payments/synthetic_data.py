@@ -0,0 +1,348 @@
+"""
+Seeded synthetic datasets at production scale.
+
+    python synthetic_data.py --students 100000 --seed 7 --out /tmp/fees-100k
+
+writes to the output directory:
+
+    fee_payments.db   a database with the app's schema (migrations applied,
+                      default admin), N students across batch years and
+                      branches, their fee entries and payments
+    upload.xlsx       the same students and fees as upload sheets
+    upload.csv
+    dataset.json      the parameters and row counts
+
+The same seed always produces the same data; dates run up to --as-of rather
+than today. The generator picks:
+
+- fee types: every student has CRT, most have Phase 2, fewer have Phase 3.
+  The sheets spell each one in the inconsistent ways real sheets do ("crt
+  fees", "SMART INTERVIEWS PHASE-II", "CRT Training", "Smart Interviews
+  Phase-3 Fee"...), and all of them resolve through the fee type registry,
+  some only through its word match (fee_types.match_alias).
+- payments: fee entries are paid in full, partly or not at all, in one to
+  four instalments on dates between the start of the batch and --as-of.
+  A few are overpaid.
+- registration numbers are mostly lower case, as in the college's sheets.
+
+The database holds every instalment. An upload row carries one payment
+only, so in the sheets paid_amount is the total paid and payment_date the
+date of the last instalment.
+
+With --check the CSV sheet is then uploaded into an empty database, and
+the fee entries, amounts and payments per fee type are compared with
+fee_payments.db (exit status 1 if they differ).
+"""
+import os
+import io
+import csv
+import sys
+import json
+import random
+import sqlite3
+import argparse
+import tempfile
+from datetime import date, timedelta
+
+BRANCHES = [('CSE', 30), ('CSE-AI&DS', 12), ('CSE-AI&ML', 12), ('IT', 14), ('ECE', 14), ('EEE', 8),
+            ('MECH', 5), ('CIVIL', 5)]
+BRANCH_CODES = {'CSE': '05', 'CSE-AI&DS': '54', 'CSE-AI&ML': '61', 'IT': '12', 'ECE': '04', 'EEE': '02',
+                'MECH': '03', 'CIVIL': '01'}
+
+FIRST_NAMES = ['Aarav', 'Aditya', 'Akhil', 'Ananya', 'Arjun', 'Bhavana', 'Charan', 'Deepika', 'Divya',
+               'Harsha', 'Hemanth', 'Karthik', 'Keerthi', 'Lakshmi', 'Mahesh', 'Manoj', 'Meghana', 'Naveen',
+               'Nikhil', 'Pavan', 'Pooja', 'Priya', 'Rahul', 'Ramesh', 'Sai', 'Sandeep', 'Sravani',
+               'Srinivas', 'Swathi', 'Teja', 'Vamsi', 'Venkat', 'Vijay', 'Yamini']
+SURNAMES = ['Kumar', 'Reddy', 'Rao', 'Naidu', 'Sharma', 'Varma', 'Chowdary', 'Goud', 'Raju', 'Prasad',
+            'Krishna', 'Babu', 'Devi', 'Murthy', 'Sastry', 'Yadav']
+
+# fee type code -> (share of students who have it, amount in rupees, spellings used in sheets)
+FEE_TYPES = {
+    'crt fee': (1.0, 10000, ['CRT', 'crt', 'CRT Fee', 'crt fees', 'Crt  Fee', 'CRT-FEE', 'crt fee',
+                             'CRT Training', 'CRT fee (2nd installment)']),
+    'smart interviews phase-ii': (0.75, 15000, [
+        'Phase 2', 'phase ii', 'PHASE-II', 'Phase2', 'Smart Interviews Phase-II', 'smart interviews phase 2',
+        'SI Phase 2', 'si phase ii', 'Smart Interviews Phase-2 Fee', 'Phase II (balance)']),
+    'smart interviews phase-iii': (0.45, 20000, [
+        'Phase 3', 'phase iii', 'PHASE-III', 'Phase3', 'Smart Interviews Phase-III', 'smart interviews phase 3',
+        'SI Phase 3', 'si phase iii', 'Smart Interviews Phase-3 Fee', 'SI Phase-III fees']),
+}
+
+# (share of fee entries, paid from, paid to) as fractions of the fee
+PAYMENT_PROFILES = [(0.40, 1.0, 1.0), (0.30, 0.1, 0.9), (0.26, 0.0, 0.0), (0.04, 1.05, 1.3)]
+
+RECEIVERS = ['Accounts Office', 'Counter 1', 'Counter 2', 'Counter 3', 'Online', 'Excel Import']
+
+UPLOAD_COLUMNS = ['batch_year', 'regd_no', 'name', 'branch', 'mobile', 'fee_type', 'amount',
+                  'paid_amount', 'payment_date', 'received_by', 'remarks']
+
+DEFAULT_AS_OF = date(2025, 3, 31)
+
+
+def batch_years(count, as_of=DEFAULT_AS_OF):
+    """The count newest four-year batches that have started by as_of"""
+    newest = as_of.year if as_of.month >= 7 else as_of.year - 1
+    return [f"{year}-{year + 4}" for year in range(newest - count + 1, newest + 1)]
+
+
+def _instalments(rng, total_paise, count):
+    """Split total_paise into count instalments, rounded to whole hundreds of rupees except the last"""
+    if count == 1:
+        return [total_paise]
+    parts = []
+    left = total_paise
+    for remaining in range(count, 1, -1):
+        share = left // remaining
+        share = max(rng.randint(share // 2, share * 3 // 2) // 10000 * 10000, 10000)
+        share = min(share, left - 10000 * (remaining - 1))
+        if share <= 0:
+            break
+        parts.append(share)
+        left -= share
+    parts.append(left)
+    return [part for part in parts if part > 0]
+
+
+def _payment_dates(rng, batch_year, as_of, count):
+    start = date(int(batch_year[:4]), 7, 1)
+    span = max((as_of - start).days, 1)
+    return sorted(start + timedelta(days=rng.randrange(span)) for _ in range(count))
+
+
+def generate(students, seed=0, batches=4, as_of=DEFAULT_AS_OF):
+    """(students, fee_entries, payments) as lists of dicts; ids count from 1"""
+    rng = random.Random(seed)
+    years = batch_years(batches, as_of)
+    branch_names = [name for name, _ in BRANCHES]
+    branch_weights = [weight for _, weight in BRANCHES]
+    profile_weights = [profile[0] for profile in PAYMENT_PROFILES]
+    serials = {}
+
+    student_rows, fee_rows, payment_rows = [], [], []
+    for student_id in range(1, students + 1):
+        batch_year = years[(student_id - 1) % len(years)]
+        branch = rng.choices(branch_names, branch_weights)[0]
+        serial = serials[batch_year, branch] = serials.get((batch_year, branch), 0) + 1
+        regd_no = f"{batch_year[2:4]}pa1a{BRANCH_CODES[branch]}{serial:04d}"
+        if rng.random() < 0.15:
+            regd_no = regd_no.upper()
+        student_rows.append({
+            'id': student_id,
+            'regd_no': regd_no,
+            'name': f"{rng.choice(SURNAMES)} {rng.choice(FIRST_NAMES)} {rng.choice(SURNAMES)}".upper(),
+            'batch_year': batch_year,
+            'branch': branch,
+            'mobile': '' if rng.random() < 0.03 else f"{rng.choice('6789')}{rng.randrange(10 ** 9):09d}",
+        })
+
+        for code, (share, rupees, spellings) in FEE_TYPES.items():
+            if rng.random() >= share:
+                continue
+            amount_paise = rupees * 100
+            _, low, high = rng.choices(PAYMENT_PROFILES, profile_weights)[0]
+            paid_paise = int(amount_paise * rng.uniform(low, high)) // 100 * 100
+            parts = _instalments(rng, paid_paise, rng.randint(1, 4)) if paid_paise else []
+            dates = _payment_dates(rng, batch_year, as_of, len(parts))
+            received_by = rng.choice(RECEIVERS)
+            fee_rows.append({
+                'student_id': student_id,
+                'fee_type': code,
+                'spelling': rng.choice(spellings),
+                'amount_paise': amount_paise,
+                'paid_paise': paid_paise,
+                'last_payment': dates[-1] if dates else None,
+                'received_by': received_by,
+            })
+            for part, paid_on in zip(parts, dates):
+                payment_rows.append({
+                    'student_id': student_id,
+                    'fee_type': code,
+                    'amount_paid_paise': part,
+                    'date': paid_on,
+                    'received_by': received_by,
+                })
+    return student_rows, fee_rows, payment_rows
+
+
+def upload_rows(student_rows, fee_rows):
+    """One sheet row per fee entry, in UPLOAD_COLUMNS order"""
+    by_id = {student['id']: student for student in student_rows}
+    for fee in fee_rows:
+        student = by_id[fee['student_id']]
+        paid = fee['paid_paise']
+        yield [
+            student['batch_year'], student['regd_no'], student['name'], student['branch'], student['mobile'],
+            fee['spelling'], fee['amount_paise'] // 100,
+            paid / 100 if paid else '', fee['last_payment'].isoformat() if fee['last_payment'] else '',
+            fee['received_by'] if paid else '', '',
+        ]
+
+
+def write_csv(path, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(UPLOAD_COLUMNS)
+        writer.writerows(rows)
+
+
+def write_xlsx(path, rows):
+    import pandas as pd
+
+    pd.DataFrame(list(rows), columns=UPLOAD_COLUMNS).to_excel(path, index=False, sheet_name='Student Data')
+
+
+def dataset_config(db_path):
+    """Config class for an app that runs on db_path"""
+    from config import Config
+
+    return type('DatasetConfig', (Config,), {
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.abspath(db_path)}",
+        'BOOTSTRAP_DB_ON_IMPORT': True,
+        'WARMUP_ON_START': False,
+    })
+
+
+def build_database(db_path, student_rows, fee_rows, payment_rows):
+    """Create db_path with the app's schema and load the generated rows"""
+    os.environ.setdefault('FEE_SECRET_KEY', 'synthetic-data')
+    from sqlalchemy import insert
+    from app import create_app
+    from models import db, Batch, Branch, Student, FeeMaster, Payment
+    from fee_types import fee_type_registry
+
+    app = create_app(dataset_config(db_path))
+    with app.app_context():
+        batch_ids = {name: i for i, name in enumerate(sorted({s['batch_year'] for s in student_rows}), 1)}
+        branch_ids = {name: i for i, name in enumerate(sorted({s['branch'] for s in student_rows}), 1)}
+        fee_type_ids = {}
+        for code, (_, _, spellings) in FEE_TYPES.items():
+            fee_type_ids[code] = fee_type_registry.lookup(code)
+            unknown = [spelling for spelling in spellings if fee_type_registry.match(spelling) != fee_type_ids[code]]
+            if unknown:
+                raise RuntimeError(f"Spellings the fee type registry doesn't resolve to {code!r}: {unknown}")
+        batch_of = {student['id']: batch_ids[student['batch_year']] for student in student_rows}
+
+        db.session.execute(insert(Batch), [{'id': i, 'name': name} for name, i in batch_ids.items()])
+        db.session.execute(insert(Branch), [{'id': i, 'name': name} for name, i in branch_ids.items()])
+        db.session.execute(insert(Student), [
+            {'id': student['id'], 'regd_no': student['regd_no'], 'name': student['name'],
+             'batch_id': batch_ids[student['batch_year']], 'branch_id': branch_ids[student['branch']],
+             'mobile': student['mobile'] or None}
+            for student in student_rows
+        ])
+        db.session.execute(insert(FeeMaster), [
+            {'student_id': fee['student_id'], 'fee_type_id': fee_type_ids[fee['fee_type']],
+             'fee_type': fee['fee_type'], 'amount_paise': fee['amount_paise'], 'remarks': ''}
+            for fee in fee_rows
+        ])
+        if payment_rows:
+            db.session.execute(insert(Payment), [
+                dict(payment, fee_type_id=fee_type_ids[payment['fee_type']], batch_id=batch_of[payment['student_id']])
+                for payment in payment_rows
+            ])
+        db.session.commit()
+        db.engine.dispose()
+
+
+def fee_type_totals(db_path):
+    """{fee type label: (fee entries, amount_paise, paid_paise)} in db_path"""
+    conn = sqlite3.connect(db_path)
+    try:
+        fees = conn.execute(
+            "SELECT fee_type.label, COUNT(*), SUM(fee_master.amount_paise) FROM fee_master "
+            "JOIN fee_type ON fee_type.id = fee_master.fee_type_id GROUP BY fee_type.label"
+        ).fetchall()
+        paid = dict(conn.execute(
+            "SELECT fee_type.label, SUM(payment.amount_paid_paise) FROM payment "
+            "JOIN fee_type ON fee_type.id = payment.fee_type_id GROUP BY fee_type.label"
+        ).fetchall())
+    finally:
+        conn.close()
+    return {label: (count, amount, paid.get(label) or 0) for label, count, amount in fees}
+
+
+def check_upload(manifest):
+    """Upload the CSV sheet into an empty database; differences from the generated totals, per fee type"""
+    os.environ.setdefault('FEE_SECRET_KEY', 'synthetic-data')
+    from app import create_app
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'fee_payments.db')
+        app = create_app(dataset_config(db_path))
+        client = app.test_client()
+        client.post('/admin/login', data={'username': 'admin', 'password': 'adminpass'})
+        with open(manifest['files']['csv'], 'rb') as f:
+            response = client.post('/upload', data={'excel-file': (io.BytesIO(f.read()), 'upload.csv')},
+                                   content_type='multipart/form-data')
+        if response.status_code != 302:
+            return [f"upload failed with status {response.status_code}"]
+        with app.app_context():
+            from models import db
+            db.engine.dispose()
+        uploaded = fee_type_totals(db_path)
+
+    generated = fee_type_totals(manifest['files']['database'])
+    return [f"{label}: generated (entries, amount, paid) {generated.get(label)}, uploaded {uploaded.get(label)}"
+            for label in sorted(set(generated) | set(uploaded)) if generated.get(label) != uploaded.get(label)]
+
+
+def generate_dataset(out_dir, students, seed=0, batches=4, as_of=DEFAULT_AS_OF, formats=('xlsx', 'csv')):
+    """Write the database, upload sheets and dataset.json to out_dir; returns the manifest"""
+    os.makedirs(out_dir, exist_ok=True)
+    db_path = os.path.join(out_dir, 'fee_payments.db')
+    if os.path.exists(db_path):
+        raise FileExistsError(f"{db_path} already exists")
+    student_rows, fee_rows, payment_rows = generate(students, seed, batches, as_of)
+    build_database(db_path, student_rows, fee_rows, payment_rows)
+
+    files = {'database': db_path}
+    rows = list(upload_rows(student_rows, fee_rows))
+    if 'csv' in formats:
+        files['csv'] = os.path.join(out_dir, 'upload.csv')
+        write_csv(files['csv'], rows)
+    if 'xlsx' in formats:
+        files['xlsx'] = os.path.join(out_dir, 'upload.xlsx')
+        write_xlsx(files['xlsx'], rows)
+
+    manifest = {
+        'students': students, 'seed': seed, 'batches': batch_years(batches, as_of), 'as_of': as_of.isoformat(),
+        'fee_entries': len(fee_rows), 'payments': len(payment_rows), 'upload_rows': len(rows), 'files': files,
+    }
+    with open(os.path.join(out_dir, 'dataset.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--students', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--batches', type=int, default=4, help="Number of batch years")
+    parser.add_argument('--as-of', type=date.fromisoformat, default=DEFAULT_AS_OF,
+                        help="Latest payment date (YYYY-MM-DD)")
+    parser.add_argument('--formats', default='xlsx,csv', help="Upload files to write: xlsx, csv or both")
+    parser.add_argument('--out', required=True, help="Output directory (must not hold a fee_payments.db yet)")
+    parser.add_argument('--check', action='store_true',
+                        help="Upload the CSV sheet into an empty database and compare the totals per fee type")
+    args = parser.parse_args()
+
+    manifest = generate_dataset(args.out, args.students, args.seed, args.batches, args.as_of,
+                                [fmt.strip() for fmt in args.formats.split(',') if fmt.strip()])
+    print(f"{manifest['students']} students, {manifest['fee_entries']} fee entries and "
+          f"{manifest['payments']} payments in {manifest['files']['database']}")
+    for kind in ('xlsx', 'csv'):
+        if kind in manifest['files']:
+            print(f"{manifest['upload_rows']} upload rows in {manifest['files'][kind]}")
+    if args.check:
+        if 'csv' not in manifest['files']:
+            parser.error("--check uploads the CSV sheet; include csv in --formats")
+        problems = check_upload(manifest)
+        for problem in problems:
+            print(problem)
+        if problems:
+            sys.exit(1)
+        print("Uploaded sheet matches the database for every fee type")
+
+
+if __name__ == '__main__':
+    main()
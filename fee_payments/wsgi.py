@@ -0,0 +1,16 @@
+"""
+WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app built here skips the database bootstrap; gunicorn.conf.py runs it
+once in the master process, or run "flask --app app init-db" before starting
+another WSGI server.
+"""
+import os
+
+os.environ.setdefault('FEE_BOOTSTRAP_ON_IMPORT', '0')
+
+from app import create_app  # noqa: E402
+
+app = application = create_app()